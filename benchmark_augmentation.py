@@ -0,0 +1,101 @@
+import argparse
+import time
+
+import mmcv
+import numpy as np
+import torch
+from mmcv.utils import build_from_cfg
+from mmdet.datasets import PIPELINES
+
+from dataset.batch_augmentation import BatchAugmentation
+from dataset.data_config import data_configs
+from model.RetinaNet_Swin_Data_Augmentation import get_retinanet_swin_data_augmentation_config
+
+img_norm_cfg = dict(mean=np.array([123.675, 116.28, 103.53], dtype=np.float32),
+                    std=np.array([58.395, 57.12, 57.375], dtype=np.float32))
+
+
+def make_sample(img_size: int, num_boxes: int, rng: np.random.RandomState):
+    img = rng.randint(0, 256, (img_size, img_size, 3), dtype=np.uint8)
+    top_left = rng.uniform(0, img_size * 0.8, (num_boxes, 2))
+    size = rng.uniform(8, img_size * 0.2, (num_boxes, 2))
+    bboxes = np.concatenate([top_left, top_left + size], axis=1).astype(np.float32)
+    labels = rng.randint(0, 2, num_boxes).astype(np.int64)
+
+    return img, bboxes, labels
+
+
+def to_tensor(img: np.ndarray) -> torch.Tensor:
+    img = mmcv.imnormalize(img, img_norm_cfg['mean'], img_norm_cfg['std'], to_rgb=True)
+    return torch.from_numpy(img.transpose(2, 0, 1).copy())
+
+
+def run_albu(albu, samples) -> None:
+    imgs = []
+    for img, bboxes, labels in samples:
+        results = albu(dict(img=img.copy(), gt_bboxes=bboxes.copy(), gt_labels=labels.copy(),
+                            img_shape=img.shape, bbox_fields=['gt_bboxes']))
+        img = results['img'] if results is not None else img
+        imgs.append(to_tensor(img))
+    torch.stack(imgs)
+
+
+def run_batch(augmentation: BatchAugmentation, samples) -> None:
+    imgs = torch.stack([to_tensor(img) for img, _, _ in samples])
+    augmentation(
+        imgs=imgs,
+        bboxes=[torch.from_numpy(bboxes) for _, bboxes, _ in samples],
+        labels=[torch.from_numpy(labels) for _, _, labels in samples],
+        mean=img_norm_cfg['mean'].tolist(),
+        std=img_norm_cfg['std'].tolist(),
+    )
+    if augmentation.device.type == 'cuda':
+        torch.cuda.synchronize()
+
+
+def benchmark(fn, batches) -> float:
+    fn(batches[0])
+    start = time.perf_counter()
+    for batch in batches:
+        fn(batch)
+    elapsed = time.perf_counter() - start
+
+    return sum(len(batch) for batch in batches) / elapsed
+
+
+def benchmark_augmentation(opt) -> None:
+    rng = np.random.RandomState(0)
+    batches = [[make_sample(opt.img_size, opt.num_boxes, rng) for _ in range(opt.batch_size)]
+               for _ in range(opt.num_batches)]
+
+    # take the Albu step from the real config so both sides run the same transforms
+    cfg = get_retinanet_swin_data_augmentation_config(
+        data_config=data_configs['2'][str(opt.img_size)],
+        img_size=opt.img_size,
+        batch_augmentation=False,
+    )
+    albu = build_from_cfg([step for step in cfg.train_pipeline if step['type'] == 'Albu'][0], PIPELINES)
+    augmentation = BatchAugmentation(device=opt.device)
+
+    albu_speed = benchmark(lambda batch: run_albu(albu, batch), batches)
+    batch_speed = benchmark(lambda batch: run_batch(augmentation, batch), batches)
+
+    print(f'Albu per sample:            {albu_speed:.1f} samples/s')
+    print(f'Batch augmentation ({augmentation.device.type}): {batch_speed:.1f} samples/s')
+    print(f'Speedup: {batch_speed / albu_speed:.2f}x')
+
+
+def parse_opt(known=False):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--img_size', type=int, default=224, help='train image size (pixels)')
+    parser.add_argument('--batch_size', type=int, default=2, help='samples per batch')
+    parser.add_argument('--num_batches', type=int, default=200, help='number of batches to time')
+    parser.add_argument('--num_boxes', type=int, default=30, help='boxes per sample')
+    parser.add_argument('--device', type=str, default=None, help='device for batch augmentation: cpu or cuda')
+
+    return parser.parse_known_args()[0] if known else parser.parse_args()
+
+
+if __name__ == "__main__":
+    opt = parse_opt()
+    benchmark_augmentation(opt)
@@ -0,0 +1,58 @@
+import argparse
+import time
+
+import torch
+from mmdet.models import build_detector
+
+from inference.utils import get_inference_config
+from model.compile import compile_detector
+
+methods = ['Faster_RCNN', 'RetinaNet', 'VFNet', 'RetinaNet_Swin', 'RetinaNet_EfficientNet', 'SSD']
+
+
+def time_forward(model, img: torch.Tensor, iterations: int) -> float:
+    start = time.perf_counter()
+    for _ in range(iterations):
+        model.extract_feat(img)
+    return (time.perf_counter() - start) / iterations
+
+
+@torch.no_grad()
+def benchmark_compile(opt):
+    torch.manual_seed(0)
+    img = torch.randn(opt.batch_size, 3, opt.img_size, opt.img_size)
+    for method in opt.methods:
+        cfg = get_inference_config(method, num_classes=opt.num_classes, img_size=opt.img_size, device='cpu')
+        model = build_detector(cfg.model)
+        model.eval()
+
+        time_forward(model, img, opt.warmup)
+        eager = time_forward(model, img, opt.iterations)
+
+        compile_detector(model)
+        # the first call traces and compiles, or loads the graphs cached by an earlier run
+        start = time.perf_counter()
+        model.extract_feat(img)
+        compile_time = time.perf_counter() - start
+        time_forward(model, img, opt.warmup)
+        compiled = time_forward(model, img, opt.iterations)
+
+        print(f'{method}: eager {eager * 1000:.1f} ms, compiled {compiled * 1000:.1f} ms '
+              f'({eager / compiled:.2f}x), compile time {compile_time:.1f} s')
+
+
+def parse_opt(known=False):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--methods', type=str, nargs='+', default=methods, help='methods to benchmark')
+    parser.add_argument('--img_size', type=int, default=640, help='input image size (pixels)')
+    parser.add_argument('--num_classes', type=int, default=2, help='number of classes: 2 or 3')
+    parser.add_argument('--batch_size', type=int, default=1, help='images per forward pass')
+    parser.add_argument('--warmup', type=int, default=2, help='untimed forward passes before measuring')
+    parser.add_argument('--iterations', type=int, default=10, help='timed forward passes')
+
+    return parser.parse_known_args()[0] if known else parser.parse_args()
+
+
+if __name__ == "__main__":
+    opt = parse_opt()
+    benchmark_compile(opt)
@@ -0,0 +1,80 @@
+import argparse
+import copy
+import gc
+import os
+
+from mmdet.datasets import build_dataset
+from torch.utils.data import DataLoader, Dataset
+
+from dataset.array_dataset import use_array_datasets
+from inference.utils import get_inference_config
+
+
+class AnnotationReader(Dataset):
+    # touches the same image and annotation info the train pipeline gets, without decoding images
+
+    def __init__(self, dataset):
+        self.dataset = dataset
+
+    def __len__(self) -> int:
+        return len(self.dataset)
+
+    def __getitem__(self, idx: int) -> int:
+        self.dataset.data_infos[idx]
+        self.dataset.get_ann_info(idx)
+        return os.getpid()
+
+
+def proportional_memory(pid: int) -> int:
+    # proportional set size counts shared pages once across the forked workers
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            if line.startswith('Pss:'):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+def measure(dataset, num_workers: int, epochs: int) -> int:
+    loader = DataLoader(AnnotationReader(dataset), batch_size=None, shuffle=True, num_workers=num_workers,
+                        persistent_workers=num_workers > 0)
+    pids = {os.getpid()}
+    for _ in range(epochs):
+        pids.update(loader)
+    # persistent workers are still alive, their memory is read before the loader goes away
+    memory = sum(proportional_memory(pid) for pid in pids)
+    del loader
+    gc.collect()
+    return memory
+
+
+def benchmark_dataset_memory(opt):
+    cfg = get_inference_config(opt.method, num_classes=opt.num_classes, img_size=opt.img_size)
+    cfg.data.train.pipeline = []
+
+    array_cfg = copy.deepcopy(cfg)
+    use_array_datasets(array_cfg)
+
+    for name, train_cfg in [('CocoDataset', cfg.data.train), ('ArrayCocoDataset', array_cfg.data.train)]:
+        dataset = build_dataset(train_cfg)
+        print(f'{name}: {len(dataset)} images')
+        for num_workers in opt.num_workers:
+            memory = measure(dataset, num_workers, opt.epochs)
+            print(f'{name} {num_workers} workers: {memory / 2 ** 20:.1f} MiB total PSS')
+        del dataset
+        gc.collect()
+
+
+def parse_opt(known=False):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--method', type=str, default='RetinaNet', help='model config that defines the train data')
+    parser.add_argument('--img_size', required=True, type=int, default=640, help='train image size (pixels)')
+    parser.add_argument('--num_classes', required=True, type=int, default=2, help='number of classes: 2 or 3')
+    parser.add_argument('--num_workers', type=int, nargs='+', default=[0, 2, 4, 8], help='dataloader worker counts')
+    parser.add_argument('--epochs', type=int, default=2, help='epochs to iterate before measuring')
+
+    return parser.parse_known_args()[0] if known else parser.parse_args()
+
+
+if __name__ == "__main__":
+    opt = parse_opt()
+    benchmark_dataset_memory(opt)
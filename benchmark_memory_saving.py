@@ -0,0 +1,67 @@
+import argparse
+import multiprocessing as mp
+from typing import Optional, Sequence, Tuple
+
+import torch
+from mmcv.runner import build_optimizer
+from mmdet.models import build_detector
+
+from inference.utils import get_inference_config
+from model.memory_saving import apply_memory_saving, backbone_stages
+from probe_batch_size import make_batch, peak_memory, train_throughput
+
+methods = ['RetinaNet_Swin', 'RetinaNet_EfficientNet']
+
+
+def measure(opt, method: str, memory_saving: bool, stages: Optional[Sequence[int]]) -> Tuple[int, float]:
+    cfg = get_inference_config(method, num_classes=opt.num_classes, img_size=opt.img_size, device=opt.device,
+                               memory_saving=memory_saving, checkpoint_stages=stages)
+    model = build_detector(cfg.model).to(opt.device)
+    model.train()
+    apply_memory_saving(model, cfg)
+    optimizer = build_optimizer(model, cfg.optimizer)
+
+    batch = make_batch(opt.batch_size, opt.img_size, opt.num_boxes, opt.num_classes, opt.device)
+    if opt.device.startswith('cuda'):
+        torch.cuda.reset_peak_memory_stats(opt.device)
+    throughput = train_throughput(model, optimizer, batch, opt.iterations, opt.warmup, opt.device)
+
+    return peak_memory(opt.device), opt.batch_size / throughput
+
+
+def benchmark_memory_saving(opt):
+    # every setting runs in a fresh process, the peak host memory of a process never goes down
+    context = mp.get_context('spawn')
+    for method in opt.methods:
+        cfg = get_inference_config(method, num_classes=opt.num_classes, img_size=opt.img_size, device='cpu')
+        num_stages = len(backbone_stages(build_detector(cfg.model).backbone))
+        settings = [('off', False, None)] + [(f'stage {stage}', True, [stage]) for stage in range(num_stages)]
+        settings.append(('all stages', True, None))
+
+        baseline = None
+        for name, memory_saving, stages in settings:
+            with context.Pool(1) as pool:
+                memory, step_time = pool.apply(measure, (opt, method, memory_saving, stages))
+            baseline = baseline or (memory, step_time)
+            print(f'{method} {opt.img_size} batch {opt.batch_size}, checkpointing {name}: '
+                  f'peak memory {memory / 2 ** 20:.0f} MiB ({memory / baseline[0]:.0%}), '
+                  f'step time {step_time * 1000:.0f} ms ({step_time / baseline[1]:.0%})')
+
+
+def parse_opt(known=False):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--methods', type=str, nargs='+', default=methods, help='methods to benchmark')
+    parser.add_argument('--img_size', type=int, default=640, help='train image size (pixels)')
+    parser.add_argument('--num_classes', type=int, default=2, help='number of classes: 2 or 3')
+    parser.add_argument('--batch_size', type=int, default=2, help='images per train step')
+    parser.add_argument('--device', type=str, default='cuda:0', help='device to train on')
+    parser.add_argument('--num_boxes', type=int, default=50, help='synthetic ground truth boxes per image')
+    parser.add_argument('--warmup', type=int, default=1, help='untimed train steps')
+    parser.add_argument('--iterations', type=int, default=5, help='timed train steps')
+
+    return parser.parse_known_args()[0] if known else parser.parse_args()
+
+
+if __name__ == "__main__":
+    opt = parse_opt()
+    benchmark_memory_saving(opt)
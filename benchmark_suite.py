@@ -0,0 +1,220 @@
+import argparse
+import platform
+import subprocess
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, Optional
+
+from dataset.duplicates import find_duplicates
+from dataset.slicing import slice_coco_dataset
+from dataset.splits import make_manifest
+from dataset.synthetic import generate_dataset
+from dataset.utils import prevent_data_leakage, read_data, remap_categories, split_data, write_data
+from path_config import PathConfig
+
+benchmark_history_path = Path(__file__).resolve().parent / 'benchmark_history.json'
+
+# metrics in seconds get better when they drop, throughputs when they grow
+lower_is_better_units = ('s',)
+
+
+def timed(results: Dict, name: str, fn: Callable, *args, **kwargs):
+    start = time.perf_counter()
+    output = fn(*args, **kwargs)
+    results[name] = {'value': round(time.perf_counter() - start, 4), 'unit': 's'}
+    print(f'{name}: {results[name]["value"]:.3f} s')
+    return output
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=Path(__file__).resolve().parent,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def benchmark_preprocessing(opt, work_dir: Path, results: Dict) -> Dict[str, Path]:
+    path_config = PathConfig(data_path=work_dir)
+    generated = timed(results, 'generate_dataset', generate_dataset,
+                      output_dir=work_dir / 'synthetic',
+                      num_images=opt.num_images,
+                      cells_per_image=opt.cells_per_image,
+                      class_mix=opt.class_mix,
+                      image_size=(opt.image_height, opt.image_width),
+                      seed=opt.seed)
+
+    duplicate_groups, overlap_groups = timed(results, 'find_duplicates', find_duplicates,
+                                             annotation_path=generated['annotation_path'],
+                                             image_dir=generated['image_dir'],
+                                             cache_path=work_dir / 'image_hashes.json.gz',
+                                             num_workers=opt.num_workers)
+    write_data(data={'groups': overlap_groups, 'duplicates': duplicate_groups}, save_path=path_config.duplicates_path)
+    timed(results, 'prevent_data_leakage', prevent_data_leakage,
+          annotation_path=generated['annotation_path'],
+          save_path=path_config.cleaned_annotation_path,
+          duplicate_groups=duplicate_groups)
+    timed(results, 'group_categories', remap_categories,
+          annotation_path=path_config.cleaned_annotation_path,
+          save_paths={2: path_config.annotation_2_classes_path, 3: path_config.annotation_3_classes_path})
+
+    path_config.all_images_path = generated['image_dir']
+    for image_path in (path_config.train_image_path, path_config.val_image_path, path_config.test_image_path):
+        image_path.mkdir(parents=True, exist_ok=True)
+    timed(results, 'split_data', split_data,
+          annotation_path=path_config.annotation_2_classes_path,
+          train_annotation_path=path_config.train_annotation_2_classes_path,
+          val_annotation_path=path_config.val_annotation_2_classes_path,
+          test_annotation_path=path_config.test_annotation_2_classes_path,
+          path_config=path_config)
+    timed(results, 'split_manifest', make_manifest,
+          annotation_path=path_config.annotation_2_classes_path,
+          image_dir=generated['image_dir'],
+          group_pattern=r'^(P\d+)_',
+          duplicates_path=path_config.duplicates_path)
+
+    tile_dir = work_dir / 'tiles'
+    timed(results, 'slice_data', slice_coco_dataset,
+          annotation_path=path_config.train_annotation_2_classes_path,
+          image_dir=path_config.train_image_path,
+          output_dir=tile_dir / 'images',
+          output_annotation_file_name=str(tile_dir / 'annotations' / 'train_annotations'),
+          tile_size=opt.img_size,
+          overlap_ratio=0.15,
+          num_workers=opt.num_workers)
+
+    return {'tile_dir': tile_dir / 'images',
+            'tile_annotation_path': tile_dir / 'annotations' / 'train_annotations_coco.json'}
+
+
+def benchmark_training_data(opt, data_config: Dict, results: Dict) -> None:
+    # imported late, the preprocessing steps do not need mmdet
+    from mmdet.datasets import build_dataloader, build_dataset
+
+    from inference.utils import get_inference_config
+
+    cfg = get_inference_config(opt.method[0], num_classes=2, img_size=opt.img_size, device='cpu',
+                               data_config=data_config)
+    train_dataset = timed(results, 'build_dataset', build_dataset, cfg.data.train)
+
+    data_loader = build_dataloader(train_dataset, samples_per_gpu=cfg.data.samples_per_gpu,
+                                   workers_per_gpu=opt.num_workers, dist=False, shuffle=False)
+    num_images = 0
+    start = time.perf_counter()
+    for index, data in enumerate(data_loader):
+        num_images += len(data['img_metas'].data[0])
+        if index + 1 >= opt.loader_batches:
+            break
+    results['dataloader'] = {'value': round(num_images / (time.perf_counter() - start), 2), 'unit': 'images/s'}
+    print(f'dataloader: {results["dataloader"]["value"]:.1f} images/s')
+
+
+def benchmark_inference(opt, data_config: Dict, tile_dir: Path, results: Dict) -> None:
+    import torch
+    from mmdet.apis import inference_detector, init_detector
+
+    from inference.utils import get_inference_config
+
+    tiles = sorted(str(tile_path) for tile_path in tile_dir.iterdir())[:opt.inference_images]
+    for method in opt.method:
+        cfg = get_inference_config(method, num_classes=2, img_size=opt.img_size, device='cpu',
+                                   data_config=data_config)
+        # random weights, only the speed is measured
+        model = init_detector(cfg, checkpoint=None, device='cpu')
+        with torch.no_grad():
+            inference_detector(model, tiles[:1])
+            start = time.perf_counter()
+            for tile in tiles:
+                inference_detector(model, tile)
+        name = f'inference_{method}'
+        results[name] = {'value': round(len(tiles) / (time.perf_counter() - start), 2), 'unit': 'images/s'}
+        print(f'{name}: {results[name]["value"]:.2f} images/s')
+
+
+def compare(previous: Dict, current: Dict, tolerance: float, min_seconds: float) -> None:
+    print(f'\nCompared with {previous["commit"]} ({previous["timestamp"]}):')
+    print(f'{"benchmark":<32}{"before":>12}{"now":>12}{"change":>10}')
+    for name, result in current['results'].items():
+        if name not in previous['results']:
+            continue
+        before, now = previous['results'][name]['value'], result['value']
+        change = (now - before) / before if before else 0.0
+        if result['unit'] in lower_is_better_units:
+            # steps of a few milliseconds are all noise
+            worse = change > tolerance and now >= min_seconds
+        else:
+            worse = change < -tolerance
+        print(f'{name:<32}{before:>12.3f}{now:>12.3f}{change:>+10.1%}{"  REGRESSION" if worse else ""}')
+
+
+def benchmark_suite(opt) -> None:
+    torch_threads = None
+    if opt.threads:
+        import torch
+        torch.set_num_threads(opt.threads)
+        torch_threads = opt.threads
+
+    results = {}
+    with tempfile.TemporaryDirectory() as work_dir:
+        work_dir = Path(opt.work_dir or work_dir)
+        paths = benchmark_preprocessing(opt, work_dir, results)
+
+        data_config = {
+            'data_root': str(paths['tile_dir'].parent),
+            'train_annotation_file': str(paths['tile_annotation_path']),
+            'train_image_path': str(paths['tile_dir']),
+            'val_annotation_file': str(paths['tile_annotation_path']),
+            'val_image_path': str(paths['tile_dir']),
+        }
+        if not opt.skip_mmdet:
+            benchmark_training_data(opt, data_config, results)
+            benchmark_inference(opt, data_config, paths['tile_dir'], results)
+
+    settings = {key: value for key, value in vars(opt).items()
+                if key not in ('history', 'work_dir', 'tolerance', 'min_seconds')}
+    entry = {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'host': f'{platform.node()} {platform.processor() or platform.machine()}',
+        'torch_threads': torch_threads,
+        'settings': settings,
+        'results': results,
+    }
+
+    history = read_data(data_path=opt.history) if Path(opt.history).exists() else []
+    # only runs of the same dataset on the same host are comparable
+    previous = [run for run in history if run['settings'] == settings and run['host'] == entry['host']]
+    if previous:
+        compare(previous[-1], entry, opt.tolerance, opt.min_seconds)
+    write_data(data=history + [entry], save_path=opt.history, pretty=True)
+
+
+def parse_opt(known=False):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num_images', type=int, default=20, help='synthetic images')
+    parser.add_argument('--cells_per_image', type=int, default=50, help='mean number of cells per image')
+    parser.add_argument('--class_mix', type=float, nargs=6, default=[0.4, 0.2, 0.15, 0.1, 0.05, 0.1],
+                        help='relative frequency of the six source categories')
+    parser.add_argument('--image_width', type=int, default=1920, help='synthetic image width (pixels)')
+    parser.add_argument('--image_height', type=int, default=1440, help='synthetic image height (pixels)')
+    parser.add_argument('--img_size', type=int, default=640, help='tile size (pixels)')
+    parser.add_argument('--method', type=str, nargs='+', default=['RetinaNet'], help='methods to time on CPU')
+    parser.add_argument('--inference_images', type=int, default=20, help='tiles per method for inference')
+    parser.add_argument('--loader_batches', type=int, default=20, help='batches to time the dataloader')
+    parser.add_argument('--num_workers', type=int, default=2, help='worker processes and threads')
+    parser.add_argument('--threads', type=int, default=None, help='torch CPU threads, torch default when unset')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the synthetic dataset')
+    parser.add_argument('--skip_mmdet', action="store_true", help='only time the preprocessing steps')
+    parser.add_argument('--work_dir', type=str, default=None, help='keep the generated data here, temporary by default')
+    parser.add_argument('--history', type=str, default=str(benchmark_history_path), help='json file of all runs')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='relative change reported as a regression')
+    parser.add_argument('--min_seconds', type=float, default=0.05, help='shorter steps are never reported as slower')
+
+    return parser.parse_known_args()[0] if known else parser.parse_args()
+
+
+if __name__ == "__main__":
+    opt = parse_opt()
+    benchmark_suite(opt)
@@ -0,0 +1,37 @@
+import argparse
+
+from mmdet.datasets import build_dataset
+
+from dataset.array_dataset import use_array_datasets
+from dataset.data_config import data_configs
+from inference.utils import get_inference_config
+
+
+def build_dataset_index(opt):
+    for num_classes in opt.num_classes:
+        for img_size in opt.img_size:
+            if str(img_size) not in data_configs[str(num_classes)]:
+                continue
+            cfg = get_inference_config(opt.method, num_classes=num_classes, img_size=img_size)
+            use_array_datasets(cfg)
+            # the index only depends on the annotations, the pipeline is not needed
+            for split in ('train', 'val'):
+                split_cfg = cfg.data[split]
+                split_cfg.pipeline = []
+                # same default train_detector uses for the val set
+                dataset = build_dataset(split_cfg, dict(test_mode=True) if split == 'val' else None)
+                print(f'{split_cfg.ann_file}: {len(dataset)} images indexed in {dataset.index_path}')
+
+
+def parse_opt(known=False):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--method', type=str, default='RetinaNet', help='model config that defines the datasets')
+    parser.add_argument('--img_size', type=int, nargs='+', default=[224, 640], help='image sizes to index (pixels)')
+    parser.add_argument('--num_classes', type=int, nargs='+', default=[2, 3], help='number of classes: 2 or 3')
+
+    return parser.parse_known_args()[0] if known else parser.parse_args()
+
+
+if __name__ == "__main__":
+    opt = parse_opt()
+    build_dataset_index(opt)
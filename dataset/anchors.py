@@ -0,0 +1,148 @@
+from pathlib import Path
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+from dataset.utils import read_data
+
+# anchor generators of the base configs: RetinaNet heads (octave_base_scale=4, 3 scales per octave) and Faster R-CNN RPN
+coco_anchor_generators = [
+    dict(strides=[8, 16, 32, 64, 128], scales=[4.0, 5.04, 6.35], ratios=[0.5, 1.0, 2.0]),
+    dict(strides=[4, 8, 16, 32, 64], scales=[8.0], ratios=[0.5, 1.0, 2.0]),
+]
+
+
+def load_boxes(annotation_path: Path) -> Tuple[np.ndarray, np.ndarray, List[Dict]]:
+    dataset = read_data(data_path=annotation_path)
+    bboxes = np.asarray([annotation['bbox'] for annotation in dataset['annotations']], dtype=np.float32).reshape(-1, 4)
+    category_ids = np.asarray([annotation['category_id'] for annotation in dataset['annotations']], dtype=np.int64)
+    keep = (bboxes[:, 2] >= 1) & (bboxes[:, 3] >= 1)
+
+    return bboxes[keep, 2:], category_ids[keep], dataset['categories']
+
+
+def box_statistics(wh: np.ndarray, category_ids: np.ndarray, categories: List[Dict]) -> Dict:
+    percentiles = [5, 25, 50, 75, 95]
+    statistics = {}
+    for category in [{'id': None, 'name': 'all'}] + categories:
+        mask = np.ones(len(wh), dtype=bool) if category['id'] is None else category_ids == category['id']
+        if not mask.any():
+            continue
+        # mmdet ratios are height / width
+        size = np.sqrt(wh[mask, 0] * wh[mask, 1])
+        aspect = wh[mask, 1] / wh[mask, 0]
+        statistics[category['name']] = {
+            'count': int(mask.sum()),
+            'size_percentiles': dict(zip(map(str, percentiles), np.percentile(size, percentiles).round(2).tolist())),
+            'aspect_percentiles': dict(zip(map(str, percentiles),
+                                           np.percentile(aspect, percentiles).round(3).tolist())),
+        }
+
+    return statistics
+
+
+def wh_iou(wh: np.ndarray, anchors: np.ndarray) -> np.ndarray:
+    # boxes and anchors share their center, only the shapes are compared
+    inter = np.minimum(wh[:, None, 0], anchors[None, :, 0]) * np.minimum(wh[:, None, 1], anchors[None, :, 1])
+    union = (wh[:, 0] * wh[:, 1])[:, None] + (anchors[:, 0] * anchors[:, 1])[None, :] - inter
+    return inter / union
+
+
+def iou_kmeans(wh: np.ndarray, k: int, iterations: int = 100, seed: int = 0) -> np.ndarray:
+    rng = np.random.RandomState(seed)
+    centroids = wh[rng.choice(len(wh), k, replace=False)]
+    assignment = None
+    for _ in range(iterations):
+        new_assignment = wh_iou(wh, centroids).argmax(axis=1)
+        if assignment is not None and (new_assignment == assignment).all():
+            break
+        assignment = new_assignment
+        for cluster in range(k):
+            members = wh[assignment == cluster]
+            if len(members):
+                centroids[cluster] = np.median(members, axis=0)
+
+    return centroids[np.argsort(centroids[:, 0] * centroids[:, 1])]
+
+
+def fit_ratios(wh: np.ndarray, num_ratios: int, seed: int = 0) -> List[float]:
+    # unit area shapes, so the clusters only differ in aspect
+    shapes = wh / np.sqrt(wh[:, :1] * wh[:, 1:])
+    centroids = iou_kmeans(shapes, num_ratios, seed=seed)
+    return sorted(round(float(ratio), 3) for ratio in centroids[:, 1] / centroids[:, 0])
+
+
+def anchor_shapes(strides: Sequence[int], scales: Sequence[float], ratios: Sequence[float]) -> np.ndarray:
+    # same shapes as mmdet AnchorGenerator.gen_single_level_base_anchors
+    ratios = np.asarray(ratios, dtype=np.float32)
+    h_ratios = np.sqrt(ratios)
+    w_ratios = 1 / h_ratios
+    sizes = (np.asarray(strides, dtype=np.float32)[:, None] * np.asarray(scales, dtype=np.float32)[None, :]).ravel()
+    return np.stack([(sizes[:, None] * w_ratios[None, :]).ravel(), (sizes[:, None] * h_ratios[None, :]).ravel()], 1)
+
+
+def anchor_recall(wh: np.ndarray, anchors: np.ndarray, iou_threshold: float) -> Tuple[float, float]:
+    best_iou = wh_iou(wh, anchors).max(axis=1)
+    return float((best_iou >= iou_threshold).mean()), float(best_iou.mean())
+
+
+def fit_scales(
+        wh: np.ndarray,
+        strides: Sequence[int],
+        ratios: Sequence[float],
+        iou_threshold: float = 0.5,
+        max_scales: int = 3,
+        tolerance: float = 0.01,
+) -> Tuple[List[float], float, float]:
+    # octave spaced scales, the fewest scales within tolerance of the best recall win
+    candidates = []
+    for num_scales in range(1, max_scales + 1):
+        for base_scale in np.geomspace(1, 16, 33):
+            scales = (base_scale * 2 ** (np.arange(num_scales) / num_scales)).round(3).tolist()
+            recall, mean_iou = anchor_recall(wh, anchor_shapes(strides, scales, ratios), iou_threshold)
+            candidates.append((recall, mean_iou, scales))
+
+    best_recall = max(recall for recall, _, _ in candidates)
+    recall, mean_iou, scales = max(
+        (candidate for candidate in candidates if candidate[0] >= best_recall - tolerance),
+        key=lambda candidate: (-len(candidate[2]), candidate[0], candidate[1]))
+
+    return scales, recall, mean_iou
+
+
+def fit_anchor_generator(
+        wh: np.ndarray,
+        coco_anchor_generator: Dict,
+        num_ratios: int = 3,
+        iou_threshold: float = 0.5,
+        max_boxes: int = 100000,
+        seed: int = 0,
+) -> Dict:
+    if len(wh) > max_boxes:
+        wh = wh[np.random.RandomState(seed).choice(len(wh), max_boxes, replace=False)]
+
+    strides = coco_anchor_generator['strides']
+    ratios = fit_ratios(wh, num_ratios, seed=seed)
+    scales, recall, mean_iou = fit_scales(wh, strides, ratios, iou_threshold=iou_threshold)
+    coco_recall, coco_mean_iou = anchor_recall(
+        wh, anchor_shapes(strides, coco_anchor_generator['scales'], coco_anchor_generator['ratios']), iou_threshold)
+
+    return {
+        'strides': list(strides),
+        'ratios': ratios,
+        'scales': scales,
+        'num_anchors': len(ratios) * len(scales),
+        'recall': round(recall, 4),
+        'mean_iou': round(mean_iou, 4),
+        'coco_num_anchors': len(coco_anchor_generator['ratios']) * len(coco_anchor_generator['scales']),
+        'coco_recall': round(coco_recall, 4),
+        'coco_mean_iou': round(coco_mean_iou, 4),
+    }
+
+
+def get_anchor_path(annotation_path: Path) -> Path:
+    return Path(annotation_path).parent / 'anchors.json'
+
+
+def load_anchors(annotation_path: Path) -> List[Dict]:
+    return read_data(data_path=get_anchor_path(annotation_path))['anchor_generators']
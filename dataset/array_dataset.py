@@ -0,0 +1,181 @@
+import hashlib
+import json
+import shutil
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+from mmdet.datasets import DATASETS, CocoDataset
+from mmdet.datasets.api_wrappers import COCO
+
+from dataset.utils import file_hash, read_data, write_data
+
+# bump when the arrays stored in the index change
+index_version = 1
+
+index_arrays = ('ids', 'widths', 'heights', 'name_offsets', 'names', 'box_offsets', 'gt_bboxes', 'gt_labels',
+                'ignore_offsets', 'gt_bboxes_ignore', 'cat_ids')
+
+
+def offsets(lengths: List[int]) -> np.ndarray:
+    return np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+
+
+def build_index(data_infos: List[Dict], ann_infos: List[Dict], cat_ids: List[int]) -> Dict[str, np.ndarray]:
+    file_names = [info['file_name'].encode('utf-8') for info in data_infos]
+
+    return {
+        'ids': np.array([info['id'] for info in data_infos], dtype=np.int64),
+        'widths': np.array([info['width'] for info in data_infos], dtype=np.int32),
+        'heights': np.array([info['height'] for info in data_infos], dtype=np.int32),
+        'name_offsets': offsets([len(name) for name in file_names]),
+        'names': np.frombuffer(b''.join(file_names), dtype=np.uint8),
+        'box_offsets': offsets([len(ann['bboxes']) for ann in ann_infos]),
+        'gt_bboxes': np.concatenate([ann['bboxes'] for ann in ann_infos]).astype(np.float32).reshape(-1, 4),
+        'gt_labels': np.concatenate([ann['labels'] for ann in ann_infos]).astype(np.int64),
+        'ignore_offsets': offsets([len(ann['bboxes_ignore']) for ann in ann_infos]),
+        'gt_bboxes_ignore': np.concatenate(
+            [ann['bboxes_ignore'] for ann in ann_infos]).astype(np.float32).reshape(-1, 4),
+        'cat_ids': np.array(cat_ids, dtype=np.int64),
+    }
+
+
+def get_index_path(ann_file: str, settings: Dict) -> Path:
+    # one index per annotation file and dataset settings, next to the annotation file
+    key = hashlib.sha256(json.dumps(settings, sort_keys=True).encode('utf-8')).hexdigest()[:8]
+    ann_file = Path(ann_file)
+    return ann_file.parent / f'{ann_file.stem}_index' / key
+
+
+def save_index(index_path: Path, index: Dict[str, np.ndarray], meta: Dict) -> None:
+    tmp_path = index_path.with_name(index_path.name + '.tmp')
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    tmp_path.mkdir(parents=True)
+    for name in index_arrays:
+        np.save(tmp_path / f'{name}.npy', index[name])
+    # meta is written last, an index without it is never loaded
+    write_data(data=meta, save_path=tmp_path / 'meta.json')
+
+    shutil.rmtree(index_path, ignore_errors=True)
+    tmp_path.rename(index_path)
+
+
+def load_index(index_path: Path, meta: Dict) -> Optional[Dict[str, np.ndarray]]:
+    meta_path = index_path / 'meta.json'
+    if not meta_path.exists() or read_data(data_path=meta_path) != meta:
+        return None
+
+    return {name: np.load(index_path / f'{name}.npy', mmap_mode='r') for name in index_arrays}
+
+
+class ArrayInfos:
+    # read-only stand-in for the list of image dicts, backed by the index arrays
+
+    def __init__(self, index: Dict[str, np.ndarray]):
+        self.ids = index['ids']
+        self.widths = index['widths']
+        self.heights = index['heights']
+        self.name_offsets = index['name_offsets']
+        self.names = index['names']
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def file_name(self, idx: int) -> str:
+        return self.names[self.name_offsets[idx]:self.name_offsets[idx + 1]].tobytes().decode('utf-8')
+
+    def __getitem__(self, idx: int) -> Dict:
+        file_name = self.file_name(idx)
+        return dict(
+            id=int(self.ids[idx]),
+            file_name=file_name,
+            filename=file_name,
+            width=int(self.widths[idx]),
+            height=int(self.heights[idx]))
+
+
+@DATASETS.register_module()
+class ArrayCocoDataset(CocoDataset):
+    # forked dataloader workers only read the flat arrays, so the pages stay shared
+    # instead of being copied on every refcount update of the per-image dicts.
+    # the arrays are cached next to the annotation file and memory mapped on the next run
+
+    def __init__(self, *args, index_cache: bool = True, **kwargs):
+        self.index_cache = index_cache
+        self.index = None
+        self._coco = None
+        self._index_meta = None
+        super().__init__(*args, **kwargs)
+
+        if self.index is None:
+            data_infos = self.data_infos
+            ann_infos = [super(ArrayCocoDataset, self).get_ann_info(idx) for idx in range(len(data_infos))]
+            self.index = build_index(data_infos, ann_infos, self.cat_ids)
+            if self.index_cache:
+                save_index(self.index_path, self.index, self.index_meta)
+        # train images are never evaluated, the COCO api is loaded again on demand otherwise
+        self._coco = None
+
+        self.data_infos = ArrayInfos(self.index)
+        # evaluation indexes img_ids like a list
+        self.img_ids = self.index['ids'].tolist() if self.test_mode else self.index['ids']
+
+    @property
+    def coco(self):
+        if self._coco is None:
+            self._coco = COCO(self.ann_file)
+        return self._coco
+
+    @coco.setter
+    def coco(self, coco) -> None:
+        self._coco = coco
+
+    @property
+    def index_settings(self) -> Dict:
+        return dict(version=index_version, classes=list(self.CLASSES), test_mode=self.test_mode,
+                    filter_empty_gt=self.filter_empty_gt)
+
+    @property
+    def index_path(self) -> Path:
+        return get_index_path(self.ann_file, self.index_settings)
+
+    @property
+    def index_meta(self) -> Dict:
+        if self._index_meta is None:
+            self._index_meta = dict(self.index_settings, ann_hash=file_hash(self.ann_file))
+        return self._index_meta
+
+    def load_annotations(self, ann_file: str) -> List[Dict]:
+        if self.index_cache:
+            self.index = load_index(self.index_path, self.index_meta)
+        if self.index is None:
+            return super().load_annotations(ann_file)
+
+        self.cat_ids = self.index['cat_ids'].tolist()
+        self.cat2label = {cat_id: i for i, cat_id in enumerate(self.cat_ids)}
+        return ArrayInfos(self.index)
+
+    def _filter_imgs(self, min_size: int = 32) -> List[int]:
+        # a cached train index only holds the images that passed the filter
+        if self.index is not None:
+            return list(range(len(self.data_infos)))
+        return super()._filter_imgs(min_size)
+
+    def get_ann_info(self, idx: int) -> Dict:
+        start, end = self.index['box_offsets'][idx], self.index['box_offsets'][idx + 1]
+        ignore_start, ignore_end = self.index['ignore_offsets'][idx], self.index['ignore_offsets'][idx + 1]
+        return dict(
+            bboxes=np.array(self.index['gt_bboxes'][start:end]),
+            labels=np.array(self.index['gt_labels'][start:end]),
+            bboxes_ignore=np.array(self.index['gt_bboxes_ignore'][ignore_start:ignore_end]),
+            masks=None,
+            seg_map=self.data_infos.file_name(idx).rsplit('.', 1)[0] + '.png')
+
+    def get_cat_ids(self, idx: int) -> List[int]:
+        start, end = self.index['box_offsets'][idx], self.index['box_offsets'][idx + 1]
+        return [self.cat_ids[label] for label in self.index['gt_labels'][start:end].tolist()]
+
+
+def use_array_datasets(cfg) -> None:
+    cfg.data.train.type = 'ArrayCocoDataset'
+    cfg.data.val.type = 'ArrayCocoDataset'
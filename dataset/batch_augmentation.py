@@ -0,0 +1,181 @@
+import warnings
+from typing import List, Optional, Sequence, Tuple
+
+import torch
+import torch.nn.functional as F
+from mmcv.runner import HOOKS, Hook
+
+
+class BatchAugmentation:
+    # tensor counterpart of the Albu transforms in the data augmentation configs:
+    # ShiftScaleRotate (shift only), RandomBrightnessContrast, RandomRotate90 and Flip
+
+    def __init__(
+            self,
+            shift_limit: float = 0.0625,
+            shift_p: float = 0.3,
+            brightness_limit: Sequence[float] = (0.1, 0.3),
+            contrast_limit: Sequence[float] = (0.1, 0.3),
+            brightness_contrast_p: float = 0.2,
+            rotate90_p: float = 0.3,
+            flip_p: float = 0.4,
+            device: Optional[str] = None,
+    ):
+        self.shift_limit = shift_limit
+        self.shift_p = shift_p
+        self.brightness_limit = brightness_limit
+        self.contrast_limit = contrast_limit
+        self.brightness_contrast_p = brightness_contrast_p
+        self.rotate90_p = rotate90_p
+        self.flip_p = flip_p
+        self.warned_rotate90 = False
+        if device is None:
+            device = 'cuda' if torch.cuda.is_available() else 'cpu'
+        self.device = torch.device(device)
+
+    @staticmethod
+    def _uniform(low: float, high: float, size: int) -> torch.Tensor:
+        return torch.rand(size) * (high - low) + low
+
+    @staticmethod
+    def _select(p: float, size: int) -> torch.Tensor:
+        return torch.nonzero(torch.rand(size) < p).flatten()
+
+    def shift(self, imgs: torch.Tensor, bboxes: List[torch.Tensor], labels: List[torch.Tensor]):
+        idx = self._select(self.shift_p, len(imgs))
+        if len(idx) == 0:
+            return imgs, bboxes, labels
+
+        height, width = imgs.shape[-2:]
+        dx = self._uniform(-self.shift_limit, self.shift_limit, len(idx))
+        dy = self._uniform(-self.shift_limit, self.shift_limit, len(idx))
+
+        # affine_grid works in [-1, 1], a shift of dx * width is 2 * dx there
+        theta = torch.zeros(len(idx), 2, 3)
+        theta[:, 0, 0] = 1
+        theta[:, 1, 1] = 1
+        theta[:, 0, 2] = -2 * dx
+        theta[:, 1, 2] = -2 * dy
+        grid = F.affine_grid(theta.to(imgs), [len(idx), imgs.shape[1], height, width], align_corners=False)
+        imgs[idx.to(imgs.device)] = F.grid_sample(imgs[idx.to(imgs.device)], grid, mode='bilinear',
+                                                  padding_mode='reflection', align_corners=False)
+
+        for i, shift_x, shift_y in zip(idx.tolist(), (dx * width).tolist(), (dy * height).tolist()):
+            boxes = bboxes[i] + bboxes[i].new_tensor([shift_x, shift_y, shift_x, shift_y])
+            boxes[:, 0::2] = boxes[:, 0::2].clamp(0, width)
+            boxes[:, 1::2] = boxes[:, 1::2].clamp(0, height)
+            # drop boxes shifted completely out of the image
+            keep = (boxes[:, 2] > boxes[:, 0]) & (boxes[:, 3] > boxes[:, 1])
+            bboxes[i] = boxes[keep]
+            labels[i] = labels[i][keep]
+
+        return imgs, bboxes, labels
+
+    def brightness_contrast(self, imgs: torch.Tensor, mean: torch.Tensor, std: torch.Tensor) -> torch.Tensor:
+        idx = self._select(self.brightness_contrast_p, len(imgs)).to(imgs.device)
+        if len(idx) == 0:
+            return imgs
+
+        alpha = 1 + self._uniform(self.contrast_limit[0], self.contrast_limit[1], len(idx)).to(imgs)
+        beta = self._uniform(self.brightness_limit[0], self.brightness_limit[1], len(idx)).to(imgs)
+
+        # the batch is already normalized, adjust in pixel space and normalize again
+        pixels = imgs[idx] * std + mean
+        pixels = (pixels * alpha.view(-1, 1, 1, 1) + beta.view(-1, 1, 1, 1) * 255).clamp(0, 255)
+        imgs[idx] = (pixels - mean) / std
+
+        return imgs
+
+    def rotate90(self, imgs: torch.Tensor, bboxes: List[torch.Tensor]):
+        height, width = imgs.shape[-2:]
+        # a quarter turn of a rectangular batch would not fit its padding
+        if height != width:
+            if self.rotate90_p > 0 and not self.warned_rotate90:
+                warnings.warn(f'rot90 augmentation is skipped for the non-square {height}x{width} batches, '
+                              'set rotate90_p=0 to silence this')
+                self.warned_rotate90 = True
+            return imgs, bboxes
+
+        idx = self._select(self.rotate90_p, len(imgs))
+        times = torch.randint(1, 4, (len(idx),))
+        for k in range(1, 4):
+            rotate_idx = idx[times == k]
+            if len(rotate_idx) == 0:
+                continue
+            device_idx = rotate_idx.to(imgs.device)
+            imgs[device_idx] = torch.rot90(imgs[device_idx], k, dims=(2, 3))
+            for i in rotate_idx.tolist():
+                boxes = bboxes[i]
+                for _ in range(k):
+                    # counter-clockwise, the same direction as np.rot90
+                    boxes = torch.stack([boxes[:, 1], width - boxes[:, 2], boxes[:, 3], width - boxes[:, 0]], dim=1)
+                bboxes[i] = boxes
+
+        return imgs, bboxes
+
+    def flip(self, imgs: torch.Tensor, bboxes: List[torch.Tensor]):
+        height, width = imgs.shape[-2:]
+        idx = self._select(self.flip_p, len(imgs))
+        # like albumentations Flip: vertical, horizontal or both with equal probability
+        modes = torch.randint(0, 3, (len(idx),))
+        for mode, dims in ((0, [2]), (1, [3]), (2, [2, 3])):
+            flip_idx = idx[modes == mode]
+            if len(flip_idx) == 0:
+                continue
+            device_idx = flip_idx.to(imgs.device)
+            imgs[device_idx] = imgs[device_idx].flip(dims)
+            for i in flip_idx.tolist():
+                boxes = bboxes[i].clone()
+                if 3 in dims:
+                    boxes[:, [0, 2]] = width - bboxes[i][:, [2, 0]]
+                if 2 in dims:
+                    boxes[:, [1, 3]] = height - bboxes[i][:, [3, 1]]
+                bboxes[i] = boxes
+
+        return imgs, bboxes
+
+    def __call__(
+            self,
+            imgs: torch.Tensor,
+            bboxes: List[torch.Tensor],
+            labels: List[torch.Tensor],
+            mean: Sequence[float],
+            std: Sequence[float],
+    ) -> Tuple[torch.Tensor, List[torch.Tensor], List[torch.Tensor]]:
+        imgs = imgs.to(self.device)
+        bboxes = [boxes.to(self.device) for boxes in bboxes]
+        labels = [label.to(self.device) for label in labels]
+        mean = imgs.new_tensor(mean).view(1, -1, 1, 1)
+        std = imgs.new_tensor(std).view(1, -1, 1, 1)
+
+        imgs, bboxes, labels = self.shift(imgs, bboxes, labels)
+        imgs = self.brightness_contrast(imgs, mean, std)
+        imgs, bboxes = self.rotate90(imgs, bboxes)
+        imgs, bboxes = self.flip(imgs, bboxes)
+
+        return imgs, bboxes, labels
+
+
+@HOOKS.register_module()
+class BatchAugmentationHook(Hook):
+
+    def __init__(self, **kwargs):
+        self.augmentation = BatchAugmentation(**kwargs)
+
+    def before_train_iter(self, runner):
+        data_batch = runner.data_batch
+        img = data_batch['img'].data
+        gt_bboxes = data_batch['gt_bboxes'].data
+        gt_labels = data_batch['gt_labels'].data
+        img_metas = data_batch['img_metas'].data
+
+        # one chunk per gpu after collate
+        for chunk in range(len(img)):
+            img_norm_cfg = img_metas[chunk][0]['img_norm_cfg']
+            img[chunk], gt_bboxes[chunk], gt_labels[chunk] = self.augmentation(
+                imgs=img[chunk],
+                bboxes=gt_bboxes[chunk],
+                labels=gt_labels[chunk],
+                mean=img_norm_cfg['mean'].tolist(),
+                std=img_norm_cfg['std'].tolist(),
+            )
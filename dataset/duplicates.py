@@ -0,0 +1,204 @@
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import cv2
+import numpy as np
+
+from dataset.utils import read_data, write_data
+
+# set bits of every byte value, for the hamming distance of packed hashes
+popcount_table = np.array([bin(value).count('1') for value in range(256)], dtype=np.uint8)
+
+
+def dhash(gray: np.ndarray, hash_size: int = 8) -> int:
+    resized = cv2.resize(gray, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    bits = (resized[:, 1:] > resized[:, :-1]).ravel()
+    return int(np.packbits(bits).view('>u8')[0])
+
+
+def phash(gray: np.ndarray, hash_size: int = 8, highfreq_factor: int = 4) -> int:
+    size = hash_size * highfreq_factor
+    resized = cv2.resize(gray, (size, size), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low_frequencies = cv2.dct(resized)[:hash_size, :hash_size]
+    bits = (low_frequencies > np.median(low_frequencies)).ravel()
+    return int(np.packbits(bits).view('>u8')[0])
+
+
+hash_functions = {'phash': phash, 'dhash': dhash}
+
+
+def image_hashes(image_path: Path, hash_type: str = 'phash', grid: int = 3, min_std: float = 8.0) -> List[int]:
+    # the first hash covers the whole image, the others half size windows for overlapping fields of view
+    gray = cv2.imread(str(image_path), cv2.IMREAD_REDUCED_GRAYSCALE_4)
+    if gray is None:
+        return []
+    hash_function = hash_functions[hash_type]
+    hashes = [hash_function(gray)]
+
+    height, width = gray.shape
+    for row, column in itertools.product(range(grid), repeat=2):
+        y_min = row * height // (2 * (grid - 1)) if grid > 1 else 0
+        x_min = column * width // (2 * (grid - 1)) if grid > 1 else 0
+        window = gray[y_min:y_min + height // 2, x_min:x_min + width // 2]
+        # empty background windows hash alike across unrelated slides
+        if window.size and window.std() >= min_std:
+            hashes.append(hash_function(window))
+
+    return hashes
+
+
+def compute_hashes(
+        image_dir: Path,
+        file_names: Sequence[str],
+        cache_path: Path,
+        hash_type: str = 'phash',
+        grid: int = 3,
+        num_workers: int = os.cpu_count(),
+) -> Dict[str, List[int]]:
+    settings = {'hash_type': hash_type, 'grid': grid}
+    cache = read_data(data_path=cache_path) if Path(cache_path).exists() else {}
+    cached = cache.get('images', {}) if cache.get('settings') == settings else {}
+
+    hashes = {}
+    missing = []
+    for file_name in file_names:
+        image_path = Path(image_dir) / file_name
+        if not image_path.exists():
+            continue
+        stat = image_path.stat()
+        entry = cached.get(file_name)
+        if entry is not None and entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime:
+            hashes[file_name] = [int(value, 16) for value in entry['hashes']]
+        else:
+            missing.append(file_name)
+
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        computed = executor.map(partial(image_hashes, hash_type=hash_type, grid=grid),
+                                [Path(image_dir) / file_name for file_name in missing], chunksize=16)
+        for file_name, values in zip(missing, computed):
+            hashes[file_name] = values
+    print(f'{len(hashes)} images hashed, {len(missing)} new since the last run')
+
+    images = {}
+    for file_name, values in hashes.items():
+        stat = (Path(image_dir) / file_name).stat()
+        images[file_name] = {'size': stat.st_size, 'mtime': stat.st_mtime,
+                             'hashes': [f'{value:016x}' for value in values]}
+    write_data(data={'settings': settings, 'images': images}, save_path=cache_path)
+
+    return hashes
+
+
+def hamming_distance(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    return popcount_table[(a ^ b).view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+
+def band_masks(bits: int, radius: int) -> np.ndarray:
+    masks = [0]
+    for flips in range(1, radius + 1):
+        for positions in itertools.combinations(range(bits), flips):
+            masks.append(sum(1 << position for position in positions))
+    return np.array(masks, dtype=np.uint64)
+
+
+def find_similar_pairs(hashes: np.ndarray, threshold: int = 8, num_bands: int = 4) -> Tuple[np.ndarray, np.ndarray]:
+    # multi-index hashing: two hashes within the threshold agree on some band up to threshold // num_bands bits,
+    # so every band is only searched in that small radius instead of comparing all pairs
+    hashes = np.asarray(hashes, dtype=np.uint64)
+    bits = 64 // num_bands
+    band_mask = np.uint64((1 << bits) - 1)
+    masks = band_masks(bits, threshold // num_bands)
+
+    pairs = []
+    for band in range(num_bands):
+        values = (hashes >> np.uint64(band * bits)) & band_mask
+        order = np.argsort(values, kind='stable')
+        # bucket table over every band value, a lookup replaces the search in the sorted values
+        bucket_sizes = np.bincount(values.astype(np.int64), minlength=1 << bits)
+        bucket_starts = np.cumsum(bucket_sizes) - bucket_sizes
+
+        queries = (values[:, None] ^ masks[None, :]).ravel().astype(np.int64)
+        query_owner = np.repeat(np.arange(len(hashes)), len(masks))
+        start = bucket_starts[queries]
+        counts = bucket_sizes[queries]
+        if counts.sum() == 0:
+            continue
+
+        # expand every matching bucket into (query, candidate) pairs
+        first = np.repeat(query_owner, counts)
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        second = order[np.repeat(start, counts) + offsets]
+        keep = first < second
+        first, second = first[keep], second[keep]
+        keep = hamming_distance(hashes[first], hashes[second]) <= threshold
+        pairs.append(first[keep].astype(np.int64) * len(hashes) + second[keep])
+
+    pairs = np.unique(np.concatenate(pairs + [np.zeros(0, dtype=np.int64)]))
+    pairs = np.stack([pairs // len(hashes), pairs % len(hashes)], axis=1)
+    distances = hamming_distance(hashes[pairs[:, 0]], hashes[pairs[:, 1]])
+
+    return pairs, distances
+
+
+def group_duplicates(hashes: Dict[str, List[int]], threshold: int = 8, num_bands: int = 4) -> List[List[str]]:
+    file_names = list(hashes)
+    owners = np.concatenate([np.full(len(values), index) for index, values in enumerate(hashes.values())] +
+                            [np.zeros(0, dtype=np.int64)]).astype(np.int64)
+    values = np.array([value for values in hashes.values() for value in values], dtype=np.uint64)
+    pairs, _ = find_similar_pairs(values, threshold=threshold, num_bands=num_bands)
+    pairs = owners[pairs]
+    pairs = pairs[pairs[:, 0] != pairs[:, 1]]
+
+    # union find over the images of the matching hashes
+    parents = list(range(len(file_names)))
+
+    def find(index: int) -> int:
+        while parents[index] != index:
+            parents[index] = parents[parents[index]]
+            index = parents[index]
+        return index
+
+    for first, second in pairs.tolist():
+        parents[find(first)] = find(second)
+
+    groups = {}
+    for index, file_name in enumerate(file_names):
+        groups.setdefault(find(index), []).append(file_name)
+
+    return [sorted(group) for group in groups.values() if len(group) > 1]
+
+
+def find_duplicates(
+        annotation_path: Path,
+        image_dir: Path,
+        cache_path: Path,
+        threshold: int = 8,
+        hash_type: str = 'phash',
+        grid: int = 3,
+        num_workers: Optional[int] = None,
+) -> Tuple[List[List[int]], List[List[int]]]:
+    # image ids of duplicates, the same file listed twice or a match of the whole image hashes, and of images that
+    # share part of their field of view, the duplicates included; overlapping images show other cells as well
+    data = read_data(data_path=annotation_path)
+    ids_by_file_name = {}
+    for image in data['images']:
+        ids_by_file_name.setdefault(image['file_name'], []).append(image['id'])
+
+    hashes = compute_hashes(image_dir, list(ids_by_file_name), cache_path, hash_type=hash_type, grid=grid,
+                            num_workers=num_workers or os.cpu_count())
+    whole_image_hashes = {file_name: values[:1] for file_name, values in hashes.items() if values}
+
+    image_id_groups = []
+    for file_name_groups in (group_duplicates(whole_image_hashes, threshold=threshold),
+                             group_duplicates(hashes, threshold=threshold)):
+        grouped = {file_name for group in file_name_groups for file_name in group}
+        file_name_groups += [[file_name] for file_name, image_ids in ids_by_file_name.items()
+                             if len(image_ids) > 1 and file_name not in grouped]
+        image_id_groups.append([[image_id for file_name in group for image_id in ids_by_file_name[file_name]]
+                                for group in file_name_groups])
+
+    return image_id_groups[0], image_id_groups[1]
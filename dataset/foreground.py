@@ -0,0 +1,51 @@
+import numpy as np
+
+
+def otsu_threshold(values: np.ndarray) -> int:
+    hist = np.bincount(values.ravel(), minlength=256).astype(np.float64)
+    prob = hist / max(hist.sum(), 1)
+    omega = np.cumsum(prob)
+    mu = np.cumsum(prob * np.arange(len(prob)))
+    # between-class variance for every candidate threshold at once
+    between = (mu[-1] * omega - mu) ** 2 / np.maximum(omega * (1 - omega), 1e-12)
+
+    return int(np.argmax(between))
+
+
+def foreground_mask(image: np.ndarray, downsample: int = 8, min_saturation: int = 20) -> np.ndarray:
+    # stained cells are saturated, the glass background is close to grey/white
+    small = image[::downsample, ::downsample].astype(np.int32)
+    high = small.max(axis=2)
+    low = small.min(axis=2)
+    saturation = ((high - low) * 255 // np.maximum(high, 1)).astype(np.uint8)
+
+    # an empty field still gets split by Otsu, the floor keeps it all background
+    threshold = max(otsu_threshold(saturation), min_saturation)
+
+    return saturation > threshold
+
+
+def tile_foreground_ratio(mask: np.ndarray, tile_boxes: np.ndarray, downsample: int = 8) -> np.ndarray:
+    integral = np.pad(mask.astype(np.int64).cumsum(axis=0).cumsum(axis=1), ((1, 0), (1, 0)))
+
+    # mask cell j covers pixel j * downsample, so pixel ranges map to ceil-divided indices
+    tile_boxes = np.asarray(tile_boxes, dtype=np.int64).reshape(-1, 4)
+    x_min, y_min, x_max, y_max = (-(-tile_boxes // downsample)).T
+    x_min, x_max = np.minimum(x_min, mask.shape[1]), np.minimum(x_max, mask.shape[1])
+    y_min, y_max = np.minimum(y_min, mask.shape[0]), np.minimum(y_max, mask.shape[0])
+
+    total = integral[y_max, x_max] - integral[y_min, x_max] - integral[y_max, x_min] + integral[y_min, x_min]
+    area = np.maximum((y_max - y_min) * (x_max - x_min), 1)
+
+    return total / area
+
+
+def select_foreground_tiles(
+        image: np.ndarray,
+        tile_boxes: np.ndarray,
+        min_foreground: float = 0.01,
+        downsample: int = 8,
+) -> np.ndarray:
+    mask = foreground_mask(image, downsample=downsample)
+
+    return tile_foreground_ratio(mask, tile_boxes, downsample=downsample) >= min_foreground
@@ -0,0 +1,121 @@
+import abc
+from functools import partial
+from pathlib import Path
+from typing import Callable, Tuple
+
+import mmcv
+import numpy as np
+
+tiff_extensions = ('.tif', '.tiff', '.svs')
+
+
+def strided_thumbnail(
+        read_region: Callable[[int, int, int, int], np.ndarray],
+        height: int,
+        width: int,
+        step: int,
+        block_size: int = 256,
+) -> np.ndarray:
+    # strided blocks keep memory bounded by one block, not the whole image
+    block = step * block_size
+    rows = []
+    for y_min in range(0, height, block):
+        row = [read_region(x_min, y_min, min(x_min + block, width), min(y_min + block, height))[::step, ::step]
+               for x_min in range(0, width, block)]
+        rows.append(np.concatenate(row, axis=1))
+
+    return np.concatenate(rows, axis=0)
+
+
+class ImageReader(abc.ABC):
+    # decodes rectangular regions of an image, returned as BGR like mmcv.imread
+
+    @property
+    @abc.abstractmethod
+    def shape(self) -> Tuple[int, int]:
+        pass
+
+    @abc.abstractmethod
+    def read_region(self, x_min: int, y_min: int, x_max: int, y_max: int) -> np.ndarray:
+        pass
+
+    def thumbnail(self, downsample: int, block_size: int = 256) -> Tuple[np.ndarray, int]:
+        height, width = self.shape
+        return strided_thumbnail(self.read_region, height, width, downsample, block_size), downsample
+
+    def close(self) -> None:
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+
+class ArrayImageReader(ImageReader):
+
+    def __init__(self, image_path: Path):
+        self.image = mmcv.imread(str(image_path))
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return self.image.shape[:2]
+
+    def read_region(self, x_min: int, y_min: int, x_max: int, y_max: int) -> np.ndarray:
+        return self.image[y_min:y_max, x_min:x_max]
+
+    def thumbnail(self, downsample: int, block_size: int = 256) -> Tuple[np.ndarray, int]:
+        return self.image[::downsample, ::downsample], downsample
+
+
+class TiffImageReader(ImageReader):
+    # only the TIFF tiles/strips a region overlaps are decoded, through the zarr view of tifffile
+
+    def __init__(self, image_path: Path):
+        import tifffile
+        import zarr
+
+        self.tiff = tifffile.TiffFile(str(image_path))
+        series = self.tiff.series[0]
+        if series.axes not in ('YX', 'YXS'):
+            raise ValueError(f'Unsupported TIFF axes {series.axes} in {image_path}')
+        self.levels = [zarr.open(series.aszarr(level=level), mode='r') for level in range(len(series.levels))]
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return tuple(self.levels[0].shape[:2])
+
+    def _read(self, level: int, x_min: int, y_min: int, x_max: int, y_max: int) -> np.ndarray:
+        region = np.asarray(self.levels[level][y_min:y_max, x_min:x_max])
+        if region.ndim == 2:
+            region = np.repeat(region[..., None], 3, axis=2)
+        # tifffile gives RGB(A), the rest of the pipeline works in BGR
+        return np.ascontiguousarray(region[..., 2::-1])
+
+    def read_region(self, x_min: int, y_min: int, x_max: int, y_max: int) -> np.ndarray:
+        return self._read(0, x_min, y_min, x_max, y_max)
+
+    def thumbnail(self, downsample: int, block_size: int = 256) -> Tuple[np.ndarray, int]:
+        # start from the smallest pyramid level that is still at least as fine as requested
+        level = 0
+        level_downsample = 1
+        for index, array in enumerate(self.levels):
+            factor = self.levels[0].shape[0] // array.shape[0]
+            if factor <= downsample:
+                level, level_downsample = index, factor
+
+        step = max(downsample // level_downsample, 1)
+        height, width = self.levels[level].shape[:2]
+        thumbnail = strided_thumbnail(partial(self._read, level), height, width, step, block_size)
+
+        return thumbnail, step * level_downsample
+
+    def close(self) -> None:
+        self.tiff.close()
+
+
+def open_image(image_path: Path) -> ImageReader:
+    if Path(image_path).suffix.lower() in tiff_extensions:
+        return TiffImageReader(image_path)
+    return ArrayImageReader(image_path)
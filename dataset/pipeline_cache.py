@@ -0,0 +1,79 @@
+import hashlib
+import json
+import os
+import os.path as osp
+import pickle
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from mmdet.datasets import PIPELINES
+from mmdet.datasets.pipelines import Compose
+
+from dataset.utils import file_hash
+
+# transforms whose output only depends on the input image and annotations
+deterministic_transforms = ('LoadImageFromFile', 'LoadAnnotations', 'Resize', 'Normalize', 'Pad', 'ImageToTensor',
+                            'DefaultFormatBundle', 'Collect', 'MultiScaleFlipAug')
+
+
+def is_deterministic(step: Dict) -> bool:
+    if step['type'] not in deterministic_transforms:
+        return False
+    # multi-scale training samples a new scale every time
+    if step['type'] == 'Resize':
+        img_scale = step.get('img_scale')
+        return not (isinstance(img_scale, list) and len(img_scale) > 1) and step.get('ratio_range') is None
+    return True
+
+
+def split_pipeline(pipeline: List[Dict]) -> Tuple[List[Dict], List[Dict]]:
+    for i, step in enumerate(pipeline):
+        if not is_deterministic(step):
+            return pipeline[:i], pipeline[i:]
+    return pipeline, []
+
+
+@PIPELINES.register_module()
+class CachedCompose:
+    # runs the transforms once per image and reads the pickled results back on later epochs
+
+    def __init__(self, transforms: List[Dict], cache_dir: str):
+        self.compose = Compose(transforms)
+        self.cache_dir = Path(cache_dir)
+
+    def __call__(self, results: Dict) -> Optional[Dict]:
+        cache_path = self.cache_dir / (results['img_info']['filename'] + '.pkl')
+        if cache_path.exists():
+            with open(cache_path, 'rb') as f:
+                return pickle.load(f)
+
+        results = self.compose(results)
+        if results is not None:
+            cache_path.parent.mkdir(parents=True, exist_ok=True)
+            # several dataloader workers may write the same image, the rename is atomic
+            tmp_path = cache_path.with_name(f'{cache_path.name}.{os.getpid()}.tmp')
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(results, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, cache_path)
+
+        return results
+
+    def __repr__(self) -> str:
+        return f'{self.__class__.__name__}(cache_dir={self.cache_dir}, {self.compose})'
+
+
+def use_pipeline_cache(cfg, cache_dir: str) -> None:
+    for split in ('train', 'val'):
+        split_cfg = cfg.data[split]
+        # shards are streamed, their images have no stable file to key the cache on
+        if 'ann_file' not in split_cfg:
+            continue
+        prefix, rest = split_pipeline(split_cfg.pipeline)
+        if not prefix:
+            continue
+
+        # a new prefix, annotation file or image folder gets its own cache
+        key = json.dumps([prefix, file_hash(split_cfg.ann_file), split_cfg.img_prefix], sort_keys=True, default=str)
+        key = hashlib.sha256(key.encode('utf-8')).hexdigest()[:8]
+        split_cfg.pipeline = [dict(type='CachedCompose', transforms=prefix,
+                                   cache_dir=osp.join(cache_dir, f'{split}_{key}'))] + rest
@@ -0,0 +1,117 @@
+import gzip
+import json
+import shutil
+import tempfile
+from pathlib import Path
+from typing import Dict, Optional, Sequence
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+gzip_magic = b'\x1f\x8b'
+zstd_magic = b'\x28\xb5\x2f\xfd'
+compression_suffixes = {'.gz': 'gzip', '.zst': 'zstd'}
+
+
+def dumps(data, pretty: bool = False) -> bytes:
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+        if pretty:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(data, option=option)
+    if pretty:
+        return json.dumps(data, ensure_ascii=False, indent=2).encode('utf-8')
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def loads(data: bytes):
+    return orjson.loads(data) if orjson is not None else json.loads(data)
+
+
+def get_compression(path: Path, compression: Optional[str] = None) -> Optional[str]:
+    if compression is not None:
+        return compression
+    return compression_suffixes.get(Path(path).suffix)
+
+
+def detect_compression(path: Path) -> Optional[str]:
+    # by content rather than suffix, annotation files keep their .json name whatever wrote them
+    with open(path, 'rb') as f:
+        magic = f.read(4)
+    if magic.startswith(gzip_magic):
+        return 'gzip'
+    if magic == zstd_magic:
+        return 'zstd'
+    return None
+
+
+def open_file(path: Path, mode: str, compression: Optional[str] = None):
+    if compression == 'gzip':
+        return gzip.open(path, mode, compresslevel=6)
+    if compression == 'zstd':
+        import zstandard
+        return zstandard.open(path, mode)
+    return open(path, mode)
+
+
+def read_file(path: Path):
+    with open_file(path, 'rb', detect_compression(path)) as f:
+        return loads(f.read())
+
+
+def write_file(data, path: Path, pretty: bool = False, compression: Optional[str] = None) -> None:
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    with open_file(path, 'wb', get_compression(path, compression)) as f:
+        f.write(dumps(data, pretty=pretty))
+
+
+class StreamingWriter:
+    # the list items are spooled to temporary files as they come, so the dataset is never held in memory;
+    # on close the rest of the dataset is written around them
+    def __init__(
+            self,
+            save_path: Path,
+            header: Dict,
+            compression: Optional[str] = None,
+            list_keys: Sequence[str] = ('images', 'annotations'),
+    ):
+        self.save_path = Path(save_path)
+        self.save_path.parent.mkdir(parents=True, exist_ok=True)
+        self.header = header
+        self.compression = get_compression(save_path, compression)
+        self.spools = {key: tempfile.TemporaryFile(dir=self.save_path.parent) for key in list_keys}
+        self.counts = {key: 0 for key in list_keys}
+
+    def add(self, key: str, item: Dict) -> None:
+        spool = self.spools[key]
+        if self.counts[key]:
+            spool.write(b',')
+        spool.write(dumps(item))
+        self.counts[key] += 1
+
+    def close(self) -> None:
+        header = dumps(self.header)
+        with open_file(self.save_path, 'wb', self.compression) as f:
+            f.write(header[:-1])
+            separator = b',' if len(header) > 2 else b''
+            for key, spool in self.spools.items():
+                f.write(separator + dumps(key) + b':[')
+                spool.seek(0)
+                shutil.copyfileobj(spool, f, 1 << 20)
+                f.write(b']')
+                separator = b','
+            f.write(b'}')
+        for spool in self.spools.values():
+            spool.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            for spool in self.spools.values():
+                spool.close()
@@ -0,0 +1,240 @@
+import io
+import random
+import tarfile
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Sequence
+
+import mmcv
+import numpy as np
+from mmdet.datasets import DATASETS, PIPELINES
+from mmdet.datasets.pipelines import Compose
+from torch.utils.data import IterableDataset, get_worker_info
+
+from dataset.serialization import dumps, loads
+from dataset.utils import read_data, write_data
+
+
+def sample_key(file_name: str) -> str:
+    # tar samples are grouped by the name before the first dot
+    return Path(file_name).stem.replace('.', '_')
+
+
+class ShardWriter:
+    # WebDataset-style tar shards: every tile is an image member followed by its json annotations
+
+    def __init__(self, output_dir: Path, categories: List[Dict], shard_size: int = 1000):
+        self.output_dir = Path(output_dir)
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        self.categories = categories
+        self.shard_size = shard_size
+        self.shards = []
+        self._tar = None
+
+    def _add(self, name: str, data: bytes) -> None:
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        self._tar.addfile(info, io.BytesIO(data))
+
+    def write(self, image_info: Dict, annotations: List[Dict], image_bytes: bytes) -> None:
+        if self._tar is None or self.shards[-1]['num_samples'] >= self.shard_size:
+            self._close_shard()
+            file_name = f'shard_{len(self.shards):05d}.tar'
+            self._tar = tarfile.open(self.output_dir / file_name, 'w')
+            self.shards.append({'file_name': file_name, 'num_samples': 0, 'num_positive': 0})
+
+        key = sample_key(image_info['file_name'])
+        self._add(key + Path(image_info['file_name']).suffix, image_bytes)
+        self._add(key + '.json', dumps({'image': image_info, 'annotations': annotations}))
+        self.shards[-1]['num_samples'] += 1
+        self.shards[-1]['num_positive'] += bool(annotations)
+
+    def _close_shard(self) -> None:
+        if self._tar is not None:
+            self._tar.close()
+            self._tar = None
+
+    def close(self) -> None:
+        self._close_shard()
+        write_data(data={'categories': self.categories, 'shards': self.shards},
+                   save_path=self.output_dir / 'index.json')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+
+def pack_coco_dataset(annotation_path: Path, image_dir: Path, output_dir: Path, shard_size: int = 1000) -> None:
+    dataset = read_data(data_path=annotation_path)
+    annotations_by_image = {}
+    for annotation in dataset['annotations']:
+        annotations_by_image.setdefault(annotation['image_id'], []).append(annotation)
+
+    with ShardWriter(output_dir, categories=dataset['categories'], shard_size=shard_size) as writer:
+        for image_info in dataset['images']:
+            image_path = Path(image_dir) / image_info['file_name']
+            if not image_path.exists():
+                continue
+            writer.write(image_info, annotations_by_image.get(image_info['id'], []), image_path.read_bytes())
+
+
+def read_shard(shard_path: Path) -> Iterator[Dict]:
+    # streaming mode, the shard is read front to back in one pass
+    sample = {}
+    with tarfile.open(shard_path, 'r|') as tar:
+        for member in tar:
+            if not member.isfile():
+                continue
+            key, extension = member.name.split('.', 1)
+            if sample and sample['key'] != key:
+                sample = {}
+            data = tar.extractfile(member).read()
+            sample['key'] = key
+            if extension == 'json':
+                sample.update(loads(data))
+            else:
+                sample['img_bytes'] = data
+            if 'img_bytes' in sample and 'image' in sample:
+                yield sample
+                sample = {}
+
+
+@PIPELINES.register_module()
+class LoadImageFromShard:
+
+    def __init__(self, to_float32: bool = False, color_type: str = 'color'):
+        self.to_float32 = to_float32
+        self.color_type = color_type
+
+    def __call__(self, results: Dict) -> Dict:
+        img = mmcv.imfrombytes(results.pop('img_bytes'), flag=self.color_type)
+        if self.to_float32:
+            img = img.astype(np.float32)
+
+        results['filename'] = results['img_info']['filename']
+        results['ori_filename'] = results['img_info']['filename']
+        results['img'] = img
+        results['img_shape'] = img.shape
+        results['ori_shape'] = img.shape
+        results['img_fields'] = ['img']
+        return results
+
+
+@DATASETS.register_module()
+class ShardedCocoDataset(IterableDataset):
+    # streams tar shards in shuffled order and mixes samples through a shuffle buffer
+
+    CLASSES = None
+
+    def __init__(
+            self,
+            shard_dir: str,
+            pipeline: List[Dict],
+            classes: Optional[Sequence[str]] = None,
+            shuffle_buffer: int = 1000,
+            filter_empty_gt: bool = True,
+            seed: int = 0,
+            test_mode: bool = False,
+    ):
+        self.shard_dir = Path(shard_dir)
+        index = read_data(data_path=self.shard_dir / 'index.json')
+        self.shards = index['shards']
+        categories = [category for category in index['categories']
+                      if classes is None or category['name'] in classes]
+        self.CLASSES = tuple(classes) if classes is not None else tuple(category['name'] for category in categories)
+        self.cat2label = {category['id']: self.CLASSES.index(category['name']) for category in categories}
+
+        self.pipeline = Compose(pipeline)
+        self.shuffle_buffer = shuffle_buffer
+        self.filter_empty_gt = filter_empty_gt and not test_mode
+        self.seed = seed
+        self.test_mode = test_mode
+        self._epoch = 0
+
+    def __len__(self) -> int:
+        key = 'num_positive' if self.filter_empty_gt else 'num_samples'
+        return sum(shard[key] for shard in self.shards)
+
+    def _parse_ann_info(self, image_info: Dict, annotations: List[Dict]) -> Dict:
+        gt_bboxes = []
+        gt_labels = []
+        gt_bboxes_ignore = []
+        for annotation in annotations:
+            if annotation.get('ignore', False) or annotation['category_id'] not in self.cat2label:
+                continue
+            x_min, y_min, width, height = annotation['bbox']
+            if annotation['area'] <= 0 or width < 1 or height < 1:
+                continue
+            bbox = [x_min, y_min, x_min + width, y_min + height]
+            if annotation.get('iscrowd', False):
+                gt_bboxes_ignore.append(bbox)
+            else:
+                gt_bboxes.append(bbox)
+                gt_labels.append(self.cat2label[annotation['category_id']])
+
+        return dict(
+            bboxes=np.array(gt_bboxes, dtype=np.float32).reshape(-1, 4),
+            labels=np.array(gt_labels, dtype=np.int64),
+            bboxes_ignore=np.array(gt_bboxes_ignore, dtype=np.float32).reshape(-1, 4),
+            masks=None,
+            seg_map=image_info['file_name'].rsplit('.', 1)[0] + '.png')
+
+    def _prepare(self, sample: Dict) -> Optional[Dict]:
+        image_info = dict(sample['image'], filename=sample['image']['file_name'])
+        ann_info = self._parse_ann_info(image_info, sample['annotations'])
+        if self.filter_empty_gt and len(ann_info['labels']) == 0:
+            return None
+
+        results = dict(img_info=image_info, ann_info=ann_info, img_bytes=sample['img_bytes'])
+        results['img_prefix'] = None
+        results['seg_prefix'] = None
+        results['proposal_file'] = None
+        results['bbox_fields'] = []
+        results['mask_fields'] = []
+        results['seg_fields'] = []
+        return self.pipeline(results)
+
+    def __iter__(self) -> Iterator[Dict]:
+        worker_info = get_worker_info()
+        if worker_info is None:
+            worker_id, num_workers, seed = 0, 1, self.seed + self._epoch
+            self._epoch += 1
+        else:
+            # the base seed changes every epoch and is shared by all workers
+            worker_id, num_workers, seed = worker_info.id, worker_info.num_workers, worker_info.seed - worker_info.id
+
+        shards = list(self.shards)
+        random.Random(seed).shuffle(shards)
+        rng = random.Random(seed + worker_id + 1)
+
+        buffer = []
+        for shard in shards[worker_id::num_workers]:
+            for sample in read_shard(self.shard_dir / shard['file_name']):
+                buffer.append(sample)
+                if len(buffer) < self.shuffle_buffer:
+                    continue
+                results = self._prepare(buffer.pop(rng.randrange(len(buffer))))
+                if results is not None:
+                    yield results
+
+        rng.shuffle(buffer)
+        for sample in buffer:
+            results = self._prepare(sample)
+            if results is not None:
+                yield results
+
+
+def use_sharded_train_data(cfg, shard_dir: str, shuffle_buffer: int = 1000) -> None:
+    pipeline = [dict(type='LoadImageFromShard') if step['type'] == 'LoadImageFromFile' else step
+                for step in cfg.data.train.pipeline]
+    cfg.data.train = dict(
+        type='ShardedCocoDataset',
+        shard_dir=shard_dir,
+        classes=cfg.classes,
+        pipeline=pipeline,
+        shuffle_buffer=shuffle_buffer,
+        seed=cfg.seed,
+    )
+    # the dataset shuffles itself, a sampler cannot be used with an iterable dataset
+    cfg.data.train_dataloader = dict(shuffle=False)
@@ -0,0 +1,161 @@
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+import cv2
+import mmcv
+import numpy as np
+from sahi.slicing import get_slice_bboxes
+
+from dataset.foreground import foreground_mask, tile_foreground_ratio
+from dataset.image_reader import open_image, tiff_extensions
+from dataset.shards import ShardWriter
+from dataset.serialization import StreamingWriter
+from dataset.utils import read_data
+
+
+def get_tile_boxes(height: int, width: int, tile_size: int, overlap_ratio: float) -> np.ndarray:
+    tile_boxes = get_slice_bboxes(
+        image_height=height,
+        image_width=width,
+        slice_height=tile_size,
+        slice_width=tile_size,
+        overlap_height_ratio=overlap_ratio,
+        overlap_width_ratio=overlap_ratio,
+    )
+
+    return np.asarray(tile_boxes, dtype=np.int64).reshape(-1, 4)
+
+
+def clip_to_tiles(bboxes: np.ndarray, tile_boxes: np.ndarray, min_area_ratio: float) -> Tuple[np.ndarray, np.ndarray]:
+    # bboxes are [x_min, y_min, x_max, y_max]; every tile is clipped against every box at once
+    top_left = np.maximum(bboxes[None, :, :2], tile_boxes[:, None, :2])
+    bottom_right = np.minimum(bboxes[None, :, 2:], tile_boxes[:, None, 2:])
+    wh = np.clip(bottom_right - top_left, 0, None)
+    area = (bboxes[:, 2] - bboxes[:, 0]) * (bboxes[:, 3] - bboxes[:, 1])
+
+    keep = (wh > 0).all(axis=2) & (wh[..., 0] * wh[..., 1] >= min_area_ratio * area[None, :])
+    clipped = np.concatenate([top_left, bottom_right], axis=2) - tile_boxes[:, None, [0, 1, 0, 1]]
+
+    return clipped, keep
+
+
+def encode_image(image: np.ndarray, suffix: str) -> bytes:
+    return cv2.imencode(suffix, image)[1].tobytes()
+
+
+def flush_tile(item: Tuple, shard_writer: Optional[ShardWriter]) -> None:
+    future, tile_info, annotations = item
+    result = future.result()
+    # tar shards are written sequentially from the slicing thread
+    if shard_writer is not None:
+        shard_writer.write(tile_info, annotations, result)
+
+
+def slice_coco_dataset(
+        annotation_path: Path,
+        image_dir: Path,
+        output_dir: Path,
+        output_annotation_file_name: str,
+        tile_size: int,
+        overlap_ratio: float,
+        min_area_ratio: float = 0.9,
+        ignore_negative_samples: bool = True,
+        min_foreground: Optional[float] = None,
+        num_workers: int = 8,
+        tile_chunk_size: int = 1024,
+        shard_writer: Optional[ShardWriter] = None,
+) -> Dict:
+    dataset = read_data(data_path=annotation_path)
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    annotations_by_image = defaultdict(list)
+    for annotation in dataset['annotations']:
+        annotations_by_image[annotation['image_id']].append(annotation)
+
+    # tiles and their boxes go straight to disk, a slide can have more than fit in memory
+    writer = StreamingWriter(Path(output_annotation_file_name + '_coco.json'),
+                             header={'categories': dataset['categories']})
+    num_tiles = 0
+    num_skipped = 0
+    pending = deque()
+
+    with writer, ThreadPoolExecutor(max_workers=num_workers) as executor:
+        for image_info in dataset['images']:
+            image_path = Path(image_dir) / image_info['file_name']
+            if not image_path.exists():
+                continue
+            reader = open_image(image_path)
+            # slide formats are not writable by OpenCV, their tiles become png
+            suffix = '.png' if image_path.suffix.lower() in tiff_extensions else image_path.suffix
+            height, width = reader.shape
+            tile_boxes = get_tile_boxes(height, width, tile_size, overlap_ratio)
+            num_tiles += len(tile_boxes)
+
+            annotations = annotations_by_image[image_info['id']]
+            bboxes = np.asarray([annotation['bbox'] for annotation in annotations], dtype=np.float64).reshape(-1, 4)
+            bboxes[:, 2:] += bboxes[:, :2]
+
+            # tiles with annotations always contain cells, the mask only decides for the negatives that are kept
+            foreground = np.ones(len(tile_boxes), dtype=bool)
+            if min_foreground is not None and not ignore_negative_samples:
+                thumbnail, downsample = reader.thumbnail(downsample=8)
+                foreground = tile_foreground_ratio(foreground_mask(thumbnail, downsample=1), tile_boxes,
+                                                   downsample=downsample) >= min_foreground
+
+            # whole slides have too many tiles x boxes for one matrix
+            for chunk in range(0, len(tile_boxes), tile_chunk_size):
+                clipped, keep = clip_to_tiles(bboxes, tile_boxes[chunk:chunk + tile_chunk_size], min_area_ratio)
+
+                for tile, (x_min, y_min, x_max, y_max) in enumerate(tile_boxes[chunk:chunk + tile_chunk_size].tolist()):
+                    if not keep[tile].any() and (ignore_negative_samples or not foreground[chunk + tile]):
+                        num_skipped += 1
+                        continue
+
+                    file_name = f'{image_path.stem}_{x_min}_{y_min}_{x_max}_{y_max}{suffix}'
+                    tile_id = writer.counts['images'] + 1
+                    tile_info = {
+                        "id": tile_id,
+                        "file_name": file_name,
+                        "height": y_max - y_min,
+                        "width": x_max - x_min,
+                    }
+                    writer.add('images', tile_info)
+                    tile_annotations = []
+                    for index in np.nonzero(keep[tile])[0]:
+                        box_min_x, box_min_y, box_max_x, box_max_y = clipped[tile, index].tolist()
+                        box_width = box_max_x - box_min_x
+                        box_height = box_max_y - box_min_y
+                        tile_annotations.append({
+                            "id": writer.counts['annotations'] + len(tile_annotations) + 1,
+                            "image_id": tile_id,
+                            "category_id": annotations[index]['category_id'],
+                            "bbox": [box_min_x, box_min_y, box_width, box_height],
+                            "area": box_width * box_height,
+                            "iscrowd": 0,
+                            "segmentation": [],
+                        })
+                    for annotation in tile_annotations:
+                        writer.add('annotations', annotation)
+
+                    # only decode the region of this tile and bound the tiles waiting to be written
+                    if len(pending) >= 2 * num_workers:
+                        flush_tile(pending.popleft(), shard_writer)
+                    region = reader.read_region(x_min, y_min, x_max, y_max)
+                    if shard_writer is None:
+                        future = executor.submit(mmcv.imwrite, region, str(output_dir / file_name))
+                    else:
+                        future = executor.submit(encode_image, region, suffix)
+                    pending.append((future, tile_info, tile_annotations))
+
+            reader.close()
+
+        while pending:
+            flush_tile(pending.popleft(), shard_writer)
+
+    print(f'{output_annotation_file_name}: {writer.counts["images"]}/{num_tiles} tiles written, '
+          f'{num_skipped} tiles without annotated cells skipped ({num_skipped / max(num_tiles, 1):.1%})')
+
+    return writer.counts
@@ -0,0 +1,195 @@
+import random
+import re
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from dataset.utils import file_hash, read_data, write_data
+
+test_fold = -1
+
+
+def image_group(image: Dict, group_pattern: Optional[str] = None) -> str:
+    # patient or slide of the image, from the annotation when it has one, otherwise from the file name; without a
+    # pattern every image is its own group
+    for key in ('patient_id', 'slide_id'):
+        if key in image:
+            return str(image[key])
+    if group_pattern is None:
+        return Path(image['file_name']).stem
+    match = re.match(group_pattern, image['file_name'])
+    return match.group(1) if match else Path(image['file_name']).stem
+
+
+def merge_groups(groups: Dict[int, str], duplicate_groups: Sequence[Sequence[int]]) -> Dict[int, str]:
+    # duplicates and overlapping fields of view of different groups must land in the same fold
+    parents = {group: group for group in groups.values()}
+
+    def find(group: str) -> str:
+        while parents[group] != group:
+            parents[group] = parents[parents[group]]
+            group = parents[group]
+        return group
+
+    for image_ids in duplicate_groups:
+        image_ids = [image_id for image_id in image_ids if image_id in groups]
+        for image_id in image_ids[1:]:
+            parents[find(groups[image_id])] = find(groups[image_ids[0]])
+
+    return {image_id: find(group) for image_id, group in groups.items()}
+
+
+def stratified_group_split(group_counts: Dict[str, np.ndarray], fractions: Sequence[float], seed: int = 42) -> Dict:
+    # greedy: the largest groups first, each into the part that keeps every column closest to its fraction
+    fractions = np.asarray(fractions, dtype=np.float64)
+    names = list(group_counts)
+    random.Random(seed).shuffle(names)
+    names.sort(key=lambda name: -group_counts[name].sum())
+
+    totals = np.maximum(np.sum([group_counts[name] for name in names], axis=0), 1)
+    part_counts = np.zeros((len(fractions), len(totals)))
+    assignment = {}
+    for name in names:
+        costs = []
+        for part in range(len(fractions)):
+            part_counts[part] += group_counts[name]
+            costs.append(((part_counts / totals - fractions[:, None]) ** 2).sum())
+            part_counts[part] -= group_counts[name]
+        part = int(np.argmin(costs))
+        part_counts[part] += group_counts[name]
+        assignment[name] = part
+
+    return assignment
+
+
+def make_manifest(
+        annotation_path: Path,
+        image_dir: Path,
+        num_folds: int = 5,
+        test_ratio: float = 0.15,
+        group_pattern: Optional[str] = None,
+        duplicates_path: Optional[Path] = None,
+        seed: int = 42,
+) -> Dict:
+    dataset = read_data(data_path=annotation_path)
+    category_ids = [category['id'] for category in dataset['categories']]
+
+    groups = {image['id']: image_group(image, group_pattern) for image in dataset['images']}
+    if duplicates_path is not None and Path(duplicates_path).exists():
+        groups = merge_groups(groups, read_data(data_path=duplicates_path)['groups'])
+
+    # class counts of every group, the last column counts images so the folds also get similar sizes
+    group_counts = {group: np.zeros(len(category_ids) + 1) for group in groups.values()}
+    for image_id, group in groups.items():
+        group_counts[group][-1] += 1
+    for annotation in dataset['annotations']:
+        if annotation['image_id'] in groups:
+            group_counts[groups[annotation['image_id']]][category_ids.index(annotation['category_id'])] += 1
+
+    if len(group_counts) < num_folds + 1:
+        raise ValueError(f'{len(group_counts)} groups cannot fill the test part and {num_folds} folds, '
+                         f'check the group pattern {group_pattern!r}')
+    fractions = [test_ratio] + [(1 - test_ratio) / num_folds] * num_folds
+    parts = stratified_group_split(group_counts, fractions, seed=seed)
+    empty = sorted(set(range(num_folds + 1)) - set(parts.values()))
+    if empty:
+        names = ['test' if part == 0 else f'fold {part - 1}' for part in empty]
+        raise ValueError(f'{", ".join(names)} got no images from the {len(group_counts)} groups, '
+                         f'check the group pattern {group_pattern!r}')
+
+    return {
+        'annotation_path': str(annotation_path),
+        'image_dir': str(image_dir),
+        'num_folds': num_folds,
+        'test_ratio': test_ratio,
+        'group_pattern': group_pattern,
+        'seed': seed,
+        'images': [{'id': image['id'], 'file_name': image['file_name'], 'group': groups[image['id']],
+                    'fold': parts[groups[image['id']]] - 1} for image in dataset['images']],
+    }
+
+
+def fold_image_ids(manifest: Dict, fold: int) -> Dict[str, List[int]]:
+    splits = {'train': [], 'val': [], 'test': []}
+    for image in manifest['images']:
+        if image['fold'] == test_fold:
+            splits['test'].append(image['id'])
+        elif image['fold'] == fold:
+            splits['val'].append(image['id'])
+        else:
+            splits['train'].append(image['id'])
+
+    return splits
+
+
+def select_images(dataset: Dict, image_ids: Sequence[int]) -> Dict:
+    image_ids = set(image_ids)
+    selected = {key: value for key, value in dataset.items() if key not in ('images', 'annotations')}
+    selected['images'] = [image for image in dataset['images'] if image['id'] in image_ids]
+    selected['annotations'] = [annotation for annotation in dataset['annotations']
+                               if annotation['image_id'] in image_ids]
+    return selected
+
+
+def tile_source(file_name: str) -> str:
+    # tiles of both slicers are named <image stem>_<x_min>_<y_min>_<x_max>_<y_max>
+    return Path(file_name).stem.rsplit('_', 4)[0]
+
+
+def pool_matches(pool: Dict[str, Path], manifest_path: Path) -> bool:
+    # the pool holds the train and val images of one manifest, a regenerated manifest moves images in and out
+    if not pool['annotation_file'].exists() or not pool['meta_file'].exists():
+        return False
+    return read_data(data_path=pool['meta_file'])['manifest_hash'] == file_hash(manifest_path)
+
+
+def write_fold_annotations(manifest_path: Path, fold: int, pool: Dict[str, Path]) -> Dict[str, Path]:
+    # the tiles of all images are sliced once, a fold only selects them by their source image
+    manifest = read_data(data_path=manifest_path)
+    if not 0 <= fold < manifest['num_folds']:
+        raise ValueError(f'fold {fold} is not in the {manifest["num_folds"]} folds of {manifest_path}')
+    if not pool_matches(pool, manifest_path):
+        raise ValueError(f'the tiles in {pool["image_path"]} were not sliced from {manifest_path}, '
+                         f'run slice_data.py --manifest {manifest_path} again')
+    folds = {Path(image['file_name']).stem: image['fold'] for image in manifest['images']}
+    tile_annotation_path = pool['annotation_file']
+    tiles = read_data(data_path=tile_annotation_path)
+
+    unknown = {tile_source(tile['file_name']) for tile in tiles['images']} - set(folds)
+    if unknown:
+        raise ValueError(f'{len(unknown)} source images of the tiles in {tile_annotation_path} are not in '
+                         f'{manifest_path}, e.g. {sorted(unknown)[0]}')
+    tile_folds = [(tile['id'], folds[tile_source(tile['file_name'])]) for tile in tiles['images']]
+    tile_ids = {
+        'train': [tile_id for tile_id, tile_fold in tile_folds if tile_fold not in (fold, test_fold)],
+        'val': [tile_id for tile_id, tile_fold in tile_folds if tile_fold == fold],
+    }
+
+    annotation_paths = {}
+    for split, split_tile_ids in tile_ids.items():
+        annotation_paths[split] = Path(tile_annotation_path).with_name(f'cv_fold{fold}_{split}_coco.json')
+        write_data(data=select_images(tiles, split_tile_ids), save_path=annotation_paths[split])
+
+    return annotation_paths
+
+
+def get_pool_paths(data_root: Path) -> Dict[str, Path]:
+    # data_root is <size>/images, the annotations live next to it
+    return {
+        'image_path': Path(data_root) / 'cv_images',
+        'annotation_file': Path(data_root).parent / 'annotations' / 'cv_annotations_coco.json',
+        'meta_file': Path(data_root).parent / 'annotations' / 'cv_pool.json',
+    }
+
+
+def get_fold_data_config(data_config: Dict, manifest_path: Path, fold: int) -> Dict:
+    pool = get_pool_paths(data_config['data_root'])
+    annotation_paths = write_fold_annotations(manifest_path, fold, pool)
+
+    fold_config = dict(data_config)
+    fold_config['train_annotation_file'] = str(annotation_paths['train'])
+    fold_config['train_image_path'] = str(pool['image_path'])
+    fold_config['val_annotation_file'] = str(annotation_paths['val'])
+    fold_config['val_image_path'] = str(pool['image_path'])
+    return fold_config
@@ -0,0 +1,100 @@
+from pathlib import Path
+from typing import Dict, Sequence, Tuple
+
+import cv2
+import numpy as np
+
+from dataset.utils import write_data
+
+# the six source categories of the annotation tool, grouped by category_schemes
+source_categories = [{'id': category_id, 'name': f'cell_type_{category_id}', 'supercategory': ''}
+                     for category_id in range(1, 7)]
+
+# malignant cells have larger, darker nuclei
+nucleus_ratios = {1: 0.3, 2: 0.32, 3: 0.35, 4: 0.45, 5: 0.5, 6: 0.6}
+
+
+def draw_cell(image: np.ndarray, center: Tuple[int, int], axes: Tuple[int, int], angle: float, category_id: int,
+              rng: np.random.RandomState) -> None:
+    cytoplasm = tuple(int(value) for value in rng.randint(150, 210, 3))
+    cv2.ellipse(image, center, axes, angle, 0, 360, cytoplasm, -1, cv2.LINE_AA)
+    nucleus_axes = tuple(max(int(axis * nucleus_ratios[category_id]), 2) for axis in axes)
+    nucleus = tuple(int(value) for value in np.clip(rng.randint(40, 110, 3) - 10 * category_id, 0, 255))
+    cv2.ellipse(image, center, nucleus_axes, angle, 0, 360, nucleus, -1, cv2.LINE_AA)
+
+
+def generate_image(
+        image_size: Tuple[int, int],
+        cells_per_image: int,
+        class_mix: np.ndarray,
+        rng: np.random.RandomState,
+) -> Tuple[np.ndarray, list]:
+    height, width = image_size
+    image = np.clip(rng.normal(228, 6, (height, width, 3)), 0, 255).astype(np.uint8)
+
+    cells = []
+    for _ in range(rng.poisson(cells_per_image)):
+        category_id = int(rng.choice(len(class_mix), p=class_mix)) + 1
+        axes = (int(rng.randint(12, 40)), int(rng.randint(12, 40)))
+        center = (int(rng.randint(0, width)), int(rng.randint(0, height)))
+        draw_cell(image, center, axes, float(rng.uniform(0, 180)), category_id, rng)
+
+        # bounding box of the rotated ellipse, clipped to the image
+        radius = max(axes)
+        x_min, y_min = max(center[0] - radius, 0), max(center[1] - radius, 0)
+        x_max, y_max = min(center[0] + radius, width), min(center[1] + radius, height)
+        if x_max - x_min >= 4 and y_max - y_min >= 4:
+            cells.append((category_id, [x_min, y_min, x_max - x_min, y_max - y_min]))
+
+    return image, cells
+
+
+def generate_dataset(
+        output_dir: Path,
+        num_images: int = 20,
+        cells_per_image: int = 50,
+        class_mix: Sequence[float] = (0.4, 0.2, 0.15, 0.1, 0.05, 0.1),
+        image_size: Tuple[int, int] = (1440, 1920),
+        images_per_patient: int = 3,
+        duplicate_ratio: float = 0.05,
+        seed: int = 0,
+) -> Dict[str, Path]:
+    # cytology-like COCO dataset, with a few files listed twice and re-shot fields of view
+    # so the leakage checks have something to find
+    rng = np.random.RandomState(seed)
+    class_mix = np.asarray(class_mix, dtype=np.float64) / np.sum(class_mix)
+    image_dir = Path(output_dir) / 'images'
+    image_dir.mkdir(parents=True, exist_ok=True)
+
+    dataset = {'images': [], 'annotations': [], 'categories': source_categories}
+    previous = None
+    for index in range(num_images):
+        file_name = f'P{index // images_per_patient:03d}_{index % images_per_patient}.jpg'
+        if previous is not None and rng.rand() < duplicate_ratio:
+            # same field of view shot again, a little brighter
+            image, cells = np.clip(previous[0].astype(np.int16) + 4, 0, 255).astype(np.uint8), previous[1]
+        else:
+            image, cells = generate_image(image_size, cells_per_image, class_mix, rng)
+        cv2.imwrite(str(image_dir / file_name), image)
+        previous = (image, cells)
+
+        listings = 2 if rng.rand() < duplicate_ratio else 1
+        for _ in range(listings):
+            image_id = len(dataset['images']) + 1
+            dataset['images'].append({'id': image_id, 'file_name': file_name, 'height': image_size[0],
+                                      'width': image_size[1]})
+            for category_id, bbox in cells:
+                dataset['annotations'].append({
+                    'id': len(dataset['annotations']) + 1,
+                    'image_id': image_id,
+                    'category_id': category_id,
+                    'bbox': bbox,
+                    'area': bbox[2] * bbox[3],
+                    'iscrowd': 0,
+                    'segmentation': [],
+                })
+
+    annotation_path = Path(output_dir) / 'annotations.json'
+    write_data(data=dataset, save_path=annotation_path)
+
+    return {'image_dir': image_dir, 'annotation_path': annotation_path}
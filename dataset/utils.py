@@ -1,120 +1,139 @@
 import copy
-import json
+import hashlib
 import shutil
 from pathlib import Path
-from typing import Dict
+from typing import Dict, List, Optional
 
+import numpy as np
 import sklearn
 
+from dataset.serialization import read_file, write_file
 from path_config import PathConfig
 
 pathConfig = PathConfig()
 
+grouped_categories = {
+    2: [
+        {
+            "id": 1,
+            "name": "normal",
+            "supercategory": ""
+        },
+        {
+            "id": 2,
+            "name": "cancer",
+            "supercategory": ""
+        }
+    ],
+    3: [
+        {
+            "id": 1,
+            "name": "normal",
+            "supercategory": ""
+        },
+        {
+            "id": 2,
+            "name": "cancer",
+            "supercategory": ""
+        },
+        {
+            "id": 3,
+            "name": "suspected_cancer",
+            "supercategory": ""
+        },
+    ]
+}
+
+# target category id: source category ids
+category_schemes = {
+    2: {1: [1, 2, 3], 2: [4, 5, 6]},
+    3: {1: [1, 2, 3], 2: [6], 3: [4, 5]},
+}
+
 
 def read_data(data_path: Path) -> Dict:
-    with open(data_path) as json_file:
-        data = json.load(json_file)
-        return data
+    # plain, gzip or zstd json, whatever write_data was asked for
+    return read_file(data_path)
 
 
-def write_data(data: Dict, save_path: Path) -> None:
-    Path(save_path).parent.mkdir(parents=True, exist_ok=True)
-    with open(str(save_path), 'w', encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=4)
+def write_data(data: Dict, save_path: Path, pretty: bool = False, compression: Optional[str] = None) -> None:
+    # compact unless pretty, compressed when asked for or when the path ends in .gz/.zst
+    write_file(data, save_path, pretty=pretty, compression=compression)
 
 
-def group_categories(annotation_path: Path, save_path: Path, num_classes: int) -> Dict:
+def file_hash(file_path: Path) -> str:
+    sha = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha.update(chunk)
+
+    return sha.hexdigest()
+
+
+def compile_scheme(scheme: Dict[int, List[int]], max_category_id: int) -> np.ndarray:
+    # lookup table from source to target category id, unmapped ids stay as they are
+    table = np.arange(max(max_category_id, max(max(ids) for ids in scheme.values())) + 1)
+    for target_id, source_ids in scheme.items():
+        table[source_ids] = target_id
+    return table
+
+
+def remap_categories(
+        annotation_path: Path,
+        save_paths: Dict[int, Path],
+        schemes: Dict[int, Dict[int, List[int]]] = category_schemes,
+        categories: Dict[int, List[Dict]] = grouped_categories,
+) -> Dict[int, Dict]:
+    # one parse for all schemes, every further scheme only costs a table lookup and a write
     dataset = read_data(data_path=annotation_path)
+    category_ids = np.array([annotation['category_id'] for annotation in dataset['annotations']], dtype=np.int64)
 
-    normal_category_ids = [1, 2, 3]
-    normal_id = 1
-
-    if num_classes == 2:
-        cancer_category_ids = [4, 5, 6]
-        cancer_category_id = 2
-
-        for annotation in dataset['annotations']:
-            if annotation['category_id'] in normal_category_ids:
-                annotation['category_id'] = normal_id
-            elif annotation['category_id'] in cancer_category_ids:
-                annotation['category_id'] = cancer_category_id
-
-        categories = [
-            {
-                "id": 1,
-                "name": "normal",
-                "supercategory": ""
-            },
-            {
-                "id": 2,
-                "name": "cancer",
-                "supercategory": ""
-            }
-        ]
-
-        dataset['categories'] = categories
-
-    if num_classes == 3:
-        cancer_category_ids = [6]
-        cancer_category_id = 2
-
-        suspected_cancer_category_ids = [4, 5]
-        suspected_cancer_category_id = 3
-
-        for annotation in dataset['annotations']:
-            if annotation['category_id'] in normal_category_ids:
-                annotation['category_id'] = normal_id
-            elif annotation['category_id'] in cancer_category_ids:
-                annotation['category_id'] = cancer_category_id
-            elif annotation['category_id'] in suspected_cancer_category_ids:
-                annotation['category_id'] = suspected_cancer_category_id
-
-        categories = [
-            {
-                "id": 1,
-                "name": "normal",
-                "supercategory": ""
-            },
-            {
-                "id": 2,
-                "name": "cancer",
-                "supercategory": ""
-            },
-            {
-                "id": 3,
-                "name": "suspected_cancer",
-                "supercategory": ""
-            },
-        ]
-
-        dataset['categories'] = categories
+    datasets = {}
+    for key, save_path in save_paths.items():
+        target_ids = compile_scheme(schemes[key], int(category_ids.max(initial=0)))[category_ids].tolist()
+        remapped = {name: value for name, value in dataset.items() if name not in ('annotations', 'categories')}
+        remapped['annotations'] = [dict(annotation, category_id=target_id)
+                                   for annotation, target_id in zip(dataset['annotations'], target_ids)]
+        remapped['categories'] = copy.deepcopy(categories[key])
+        write_data(data=remapped, save_path=save_path)
+        datasets[key] = remapped
 
-    write_data(data=dataset, save_path=save_path)
+    return datasets
 
-    return dataset
 
+def group_categories(annotation_path: Path, save_path: Path, num_classes: int) -> Dict:
+    return remap_categories(annotation_path, save_paths={num_classes: save_path})[num_classes]
 
-def prevent_data_leakage(annotation_path: Path, save_path: Path) -> None:
-    data = read_data(data_path=annotation_path)
 
-    # duplicate image
-    duplicate_images = {}
-    for item in data['images']:
-        if item['file_name'] not in duplicate_images.keys():
-            duplicate_images[item['file_name']] = [item['id']]
-        else:
-            duplicate_images[item['file_name']].append(item['id'])
+def prevent_data_leakage(
+        annotation_path: Path,
+        save_path: Path,
+        duplicate_groups: Optional[List[List[int]]] = None,
+) -> None:
+    data = read_data(data_path=annotation_path)
 
-    # collect unique image
-    unique_images = [image_id[-1] for image_id in duplicate_images.values()]
-    unique_images = [image for image in unique_images if image not in [53, 86, 82, 83, 50]] + [38, 39, 34, 20, 24]
+    # without image hashes only the same file listed twice is a duplicate
+    if duplicate_groups is None:
+        duplicate_images = {}
+        for item in data['images']:
+            duplicate_images.setdefault(item['file_name'], []).append(item['id'])
+        duplicate_groups = [image_ids for image_ids in duplicate_images.values() if len(image_ids) > 1]
+
+    # keep the most annotated image of every group, the last one on a tie
+    num_annotations = {}
+    for annotation in data['annotations']:
+        num_annotations[annotation['image_id']] = num_annotations.get(annotation['image_id'], 0) + 1
+    removed_images = set()
+    for image_ids in duplicate_groups:
+        keep = max(reversed(image_ids), key=lambda image_id: num_annotations.get(image_id, 0))
+        removed_images.update(image_id for image_id in image_ids if image_id != keep)
 
     dataset = copy.deepcopy(data)
 
     dataset['annotations'] = [annotation for annotation in dataset['annotations'] if
-                              annotation['image_id'] in unique_images]
+                              annotation['image_id'] not in removed_images]
 
-    dataset['images'] = [image for image in dataset['images'] if image['id'] in unique_images]
+    dataset['images'] = [image for image in dataset['images'] if image['id'] not in removed_images]
 
     write_data(data=dataset, save_path=save_path)
 
@@ -123,7 +142,8 @@ def split_data(
         annotation_path: Path,
         train_annotation_path: Path,
         val_annotation_path: Path,
-        test_annotation_path: Path
+        test_annotation_path: Path,
+        path_config: PathConfig = pathConfig,
 ) -> None:
     dataset = read_data(data_path=annotation_path)
 
@@ -142,16 +162,16 @@ def split_data(
             val_annotations[key] = []
             test_annotations[key] = []
             for image in value:
-                image_path = pathConfig.all_images_path / image['file_name']
+                image_path = path_config.all_images_path / image['file_name']
                 if image['id'] in image_ids[:65] and Path(image_path).exists():
                     train_annotations[key].append(image)
-                    shutil.copy(image_path, pathConfig.train_image_path / image['file_name'])
+                    shutil.copy(image_path, path_config.train_image_path / image['file_name'])
                 if image['id'] in image_ids[65:77] and Path(image_path).exists():
                     val_annotations[key].append(image)
-                    shutil.copy(image_path, pathConfig.val_image_path / image['file_name'])
+                    shutil.copy(image_path, path_config.val_image_path / image['file_name'])
                 if image['id'] in image_ids[77:] and Path(image_path).exists():
                     test_annotations[key].append(image)
-                    shutil.copy(image_path, pathConfig.test_image_path / image['file_name'])
+                    shutil.copy(image_path, path_config.test_image_path / image['file_name'])
 
         elif key == 'annotations':
             train_annotations[key] = []
@@ -0,0 +1,86 @@
+import argparse
+from pathlib import Path
+
+from dataset.utils import grouped_categories
+from inference.ensemble import Ensemble
+from inference.stream import StreamingInference, watch_folder
+from inference.utils import load_detector
+from slice_data import overlap_ratios
+
+
+def broadcast(values, count: int, flag: str):
+    if len(values) == 1:
+        return values * count
+    if len(values) != count:
+        raise ValueError(f'{flag} needs one value or one per method')
+    return values
+
+
+def ensemble_inference(opt) -> None:
+    num_models = len(opt.method)
+    checkpoints = broadcast(opt.checkpoint, num_models, '--checkpoint')
+    devices = broadcast(opt.device, num_models, '--device')
+    weights = broadcast(opt.weights, num_models, '--weights') if opt.weights else None
+
+    models = [load_detector(method=method, num_classes=opt.num_classes, img_size=opt.img_size, checkpoint=checkpoint,
+                            device=device)
+              for method, checkpoint, device in zip(opt.method, checkpoints, devices)]
+    # the same method may come with several checkpoints
+    names = [method if opt.method.count(method) == 1 else f'{method}_{index}'
+             for index, method in enumerate(opt.method)]
+
+    ensemble = Ensemble(models, names, weights=weights, iou_thr=opt.wbf_iou, concurrent=not opt.sequential)
+
+    pipeline = StreamingInference(
+        model=None,
+        categories=grouped_categories[opt.num_classes],
+        output_dir=Path(opt.output_dir),
+        tile_size=opt.img_size,
+        overlap_ratio=overlap_ratios[opt.img_size],
+        batch_size=opt.batch_size,
+        nms_iou=opt.nms_iou,
+        score_thr=opt.score_thr,
+        min_foreground=opt.min_foreground,
+        decode_workers=opt.decode_workers,
+        write_workers=opt.write_workers,
+        queue_size=opt.queue_size,
+        predictor=ensemble,
+    )
+
+    try:
+        pipeline.run(watch_folder(Path(opt.watch_dir), poll_interval=opt.poll_interval, once=opt.once))
+    finally:
+        ensemble.close()
+        ensemble.print_report()
+
+
+def parse_opt(known=False):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--method', required=True, type=str, nargs='+', help='methods of the trained models')
+    parser.add_argument('--checkpoint', required=True, type=str, nargs='+', help='trained checkpoint of every method')
+    parser.add_argument('--img_size', required=True, type=int, default=640, help='tile size (pixels) used in training')
+    parser.add_argument('--num_classes', required=True, type=int, default=2, help='number of classes: 2 or 3')
+    parser.add_argument('--watch_dir', required=True, type=str, help='folder the microscope writes images into')
+    parser.add_argument('--output_dir', required=True, type=str, help='folder for the COCO detections per image')
+    parser.add_argument('--device', type=str, nargs='+', default=['cuda:0'],
+                        help='device of every model, or one device for all of them')
+    parser.add_argument('--weights', type=float, nargs='+', default=None, help='WBF weight of every model')
+    parser.add_argument('--wbf_iou', type=float, default=0.55, help='IoU threshold of the WBF over the models')
+    parser.add_argument('--sequential', action="store_true", help='run the models one after another')
+    parser.add_argument('--batch_size', type=int, default=8, help='number of tiles per forward pass')
+    parser.add_argument('--nms_iou', type=float, default=0.5, help='IoU threshold to merge detections across tiles')
+    parser.add_argument('--score_thr', type=float, default=0.05, help='minimum score of written detections')
+    parser.add_argument('--min_foreground', type=float, default=None,
+                        help='skip tiles whose foreground fraction is below this value')
+    parser.add_argument('--decode_workers', type=int, default=2, help='number of image decode threads')
+    parser.add_argument('--write_workers', type=int, default=2, help='number of result writer threads')
+    parser.add_argument('--queue_size', type=int, default=8, help='maximum number of images waiting between stages')
+    parser.add_argument('--poll_interval', type=float, default=2.0, help='seconds between folder scans')
+    parser.add_argument('--once', action="store_true", help='process the images already in the folder and exit')
+
+    return parser.parse_known_args()[0] if known else parser.parse_args()
+
+
+if __name__ == "__main__":
+    opt = parse_opt()
+    ensemble_inference(opt)
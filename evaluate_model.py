@@ -0,0 +1,58 @@
+import argparse
+from pathlib import Path
+
+from mmdet.datasets import build_dataset
+
+from dataset.utils import file_hash
+from inference.prediction_store import PredictionStore, get_prediction_path
+from inference.raw_predictions import results_to_columns
+from inference.tta import add_tta_arguments, get_tta_settings, tta_tag
+from inference.utils import get_inference_config, predict_dataset
+
+
+def evaluate_model(opt) -> None:
+    cfg = get_inference_config(method=opt.method, num_classes=opt.num_classes, img_size=opt.img_size,
+                               device=opt.device, anchors=opt.anchors)
+    split_cfg = cfg.data[opt.split]
+    dataset = build_dataset(split_cfg, dict(test_mode=True))
+    image_ids = [info['id'] for info in dataset.data_infos]
+    tta = get_tta_settings(opt)
+
+    store = PredictionStore(get_prediction_path(
+        store_dir=Path(opt.store_dir),
+        checkpoint=opt.checkpoint,
+        name=Path(split_cfg.ann_file).stem + tta_tag(tta),
+        settings={'ann_hash': file_hash(split_cfg.ann_file), 'pipeline': split_cfg.pipeline, 'img_size': opt.img_size},
+    ))
+
+    # inference only runs once per checkpoint and dataset
+    if store.exists():
+        results = store.results(image_ids)
+    else:
+        results = predict_dataset(cfg, checkpoint=opt.checkpoint, dataset=dataset, compile_model=opt.compile,
+                                  tta=tta)
+        store.write(results_to_columns(results, image_ids=image_ids), classes=dataset.CLASSES)
+    print(f'Predictions stored in {store.path}')
+
+    dataset.evaluate(results, metric='bbox')
+
+
+def parse_opt(known=False):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--method', required=True, type=str, default='RetinaNet', help='Method of the trained model')
+    parser.add_argument('--img_size', required=True, type=int, default=640, help='train, val image size (pixels)')
+    parser.add_argument('--num_classes', required=True, type=int, default=2, help='number of classes: 2 or 3')
+    parser.add_argument('--checkpoint', required=True, type=str, help='trained checkpoint file')
+    parser.add_argument('--split', type=str, default='val', choices=['val', 'test'], help='dataset split to evaluate')
+    parser.add_argument('--store_dir', type=str, default='./predictions', help='root folder of the prediction store')
+    parser.add_argument('--device', type=str, default='cuda:0', help='device for inference')
+    parser.add_argument('--anchors', action="store_true", help='the model was trained with the fitted anchors')
+    parser.add_argument('--compile', action="store_true", help='compile backbone and neck with torch.compile')
+    add_tta_arguments(parser)
+
+    return parser.parse_known_args()[0] if known else parser.parse_args()
+
+
+if __name__ == "__main__":
+    opt = parse_opt()
+    evaluate_model(opt)
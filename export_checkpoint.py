@@ -0,0 +1,43 @@
+import argparse
+import os
+import time
+from pathlib import Path
+
+import torch
+
+from model.weight_store import export_slim_checkpoint
+
+
+def time_load(checkpoint: str, mmap: bool) -> float:
+    start = time.perf_counter()
+    kwargs = {'mmap': True} if mmap else {}
+    state = torch.load(checkpoint, map_location='cpu', **kwargs)
+    # mapped tensors are only read when touched
+    for value in state['state_dict'].values():
+        value.sum()
+    return time.perf_counter() - start
+
+
+def export_checkpoint(opt) -> None:
+    checkpoint = Path(opt.checkpoint)
+    save_path = opt.output or str(checkpoint.with_name(checkpoint.stem + '_slim.pth'))
+    export_slim_checkpoint(opt.checkpoint, save_path, half=not opt.fp32)
+
+    full_seconds = time_load(opt.checkpoint, mmap=False)
+    slim_seconds = time_load(save_path, mmap=True)
+    print(f'{opt.checkpoint}: {os.path.getsize(opt.checkpoint) / 2 ** 20:.1f} MB, loaded in {full_seconds:.2f} s')
+    print(f'{save_path}: {os.path.getsize(save_path) / 2 ** 20:.1f} MB, loaded in {slim_seconds:.2f} s')
+
+
+def parse_opt(known=False):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--checkpoint', required=True, type=str, help='trained checkpoint file')
+    parser.add_argument('--output', type=str, default=None, help='slim checkpoint, <checkpoint>_slim.pth by default')
+    parser.add_argument('--fp32', action="store_true", help='keep the weights in fp32')
+
+    return parser.parse_known_args()[0] if known else parser.parse_args()
+
+
+if __name__ == "__main__":
+    opt = parse_opt()
+    export_checkpoint(opt)
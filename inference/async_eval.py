@@ -0,0 +1,168 @@
+import multiprocessing as mp
+import os
+import os.path as osp
+import queue
+import shutil
+import sys
+from typing import Dict, Optional
+
+import torch
+from mmcv import Config
+from mmcv.runner import HOOKS, Hook, LoggerHook
+from mmdet.apis import single_gpu_test
+from mmdet.datasets import build_dataloader, build_dataset
+from mmdet.utils import build_dp
+
+# registers the datasets and pipelines the dumped config may refer to
+from dataset.array_dataset import ArrayCocoDataset  # noqa: F401
+from dataset.pipeline_cache import CachedCompose  # noqa: F401
+from model.distillation import DistillationSingleStageDetector  # noqa: F401
+from model.weight_store import init_model
+
+
+def evaluate_snapshots(config_file: str, device: str, metric: str, log_file: str, snapshot_queue, result_queue) -> None:
+    # progress bars of the val pass would interleave with the training log
+    sys.stdout = open(log_file, 'a')
+    cfg = Config.fromfile(config_file)
+    cfg.model.pretrained = None
+    dataset = build_dataset(cfg.data.val, dict(test_mode=True))
+    data_loader = build_dataloader(
+        dataset,
+        samples_per_gpu=1,
+        workers_per_gpu=cfg.data.workers_per_gpu,
+        dist=False,
+        shuffle=False)
+
+    while True:
+        item = snapshot_queue.get()
+        if item is None:
+            return
+        epoch, snapshot = item
+        model = init_model(cfg, snapshot, device=device)
+        model = build_dp(model, 'cuda' if device.startswith('cuda') else 'cpu', device_ids=[0])
+        results = single_gpu_test(model, data_loader)
+        result_queue.put((epoch, snapshot, dataset.evaluate(results, metric=metric, logger='silent')))
+        del model
+        sys.stdout.flush()
+
+
+@HOOKS.register_module()
+class AsyncEvalHook(Hook):
+    # the val pass of every snapshot runs in a separate process while training goes on
+
+    def __init__(
+            self,
+            config_file: str,
+            interval: int = 1,
+            device: str = 'cpu',
+            metric: str = 'bbox',
+            save_best: Optional[str] = 'bbox_mAP',
+    ):
+        self.config_file = config_file
+        self.interval = interval
+        self.device = device
+        self.metric = metric
+        self.save_best = save_best
+        self.pending = 0
+        self.process = None
+
+    def before_run(self, runner) -> None:
+        self.snapshot_dir = osp.join(runner.work_dir, 'async_eval')
+        os.makedirs(self.snapshot_dir, exist_ok=True)
+        runner.meta = runner.meta or {}
+        runner.meta.setdefault('hook_msgs', {})
+
+        context = mp.get_context('spawn')
+        self.snapshot_queue = context.Queue()
+        self.result_queue = context.Queue()
+
+        # the evaluator only sees its own gpu, which becomes cuda:0 there
+        device = self.device
+        visible_devices = os.environ.get('CUDA_VISIBLE_DEVICES')
+        if device.startswith('cuda:'):
+            gpu = device.split(':')[1]
+            if visible_devices:
+                gpu = visible_devices.split(',')[int(gpu)]
+            os.environ['CUDA_VISIBLE_DEVICES'] = gpu
+            device = 'cuda:0'
+
+        self.process = context.Process(
+            target=evaluate_snapshots,
+            args=(self.config_file, device, self.metric, osp.join(self.snapshot_dir, 'eval.log'),
+                  self.snapshot_queue, self.result_queue),
+            daemon=True)
+        self.process.start()
+
+        if visible_devices is None:
+            os.environ.pop('CUDA_VISIBLE_DEVICES', None)
+        else:
+            os.environ['CUDA_VISIBLE_DEVICES'] = visible_devices
+
+    def after_train_epoch(self, runner) -> None:
+        self._collect(runner, block=False)
+        if not self.every_n_epochs(runner, self.interval):
+            return
+
+        model = runner.model.module if hasattr(runner.model, 'module') else runner.model
+        snapshot = osp.join(self.snapshot_dir, f'epoch_{runner.epoch + 1}.pth')
+        state_dict = {name: value.detach().cpu() for name, value in model.state_dict().items()}
+        torch.save({'state_dict': state_dict, 'meta': dict(epoch=runner.epoch + 1, CLASSES=model.CLASSES)}, snapshot)
+        self.snapshot_queue.put((runner.epoch + 1, snapshot))
+        self.pending += 1
+
+    def after_run(self, runner) -> None:
+        self.snapshot_queue.put(None)
+        self._collect(runner, block=True)
+        self.process.join()
+
+    def _collect(self, runner, block: bool) -> None:
+        while self.pending:
+            try:
+                epoch, snapshot, eval_res = self.result_queue.get(block=block, timeout=60 if block else None)
+            except queue.Empty:
+                if not block:
+                    return
+                if not self.process.is_alive():
+                    runner.logger.warning(f'Async evaluation stopped with {self.pending} snapshots left')
+                    return
+                continue
+            self.pending -= 1
+            self._log(runner, epoch, eval_res)
+            self._save_best(runner, epoch, snapshot, eval_res)
+
+    def _log(self, runner, epoch: int, eval_res: Dict) -> None:
+        runner.logger.info(f'Async evaluation of epoch {epoch}: ' +
+                           ', '.join(f'{name}: {value}' for name, value in eval_res.items()))
+        # the logger hooks are called here for every result, in val mode: the results collected in after_run come
+        # after their last epoch, and the results of one collect would overwrite each other in the log buffer
+        output, ready = dict(runner.log_buffer.output), runner.log_buffer.ready
+        runner.log_buffer.output.clear()
+        runner.log_buffer.output.update(eval_epoch=epoch, **eval_res)
+        for hook in runner.hooks:
+            if isinstance(hook, LoggerHook):
+                hook.log(runner)
+        runner.log_buffer.output.clear()
+        runner.log_buffer.output.update(output)
+        runner.log_buffer.ready = ready
+
+    def _save_best(self, runner, epoch: int, snapshot: str, eval_res: Dict) -> None:
+        hook_msgs = runner.meta['hook_msgs']
+        score = eval_res.get(self.save_best) if self.save_best else None
+        if score is None or score <= hook_msgs.get('best_score', float('-inf')):
+            os.remove(snapshot)
+            return
+
+        if hook_msgs.get('best_ckpt') and osp.isfile(hook_msgs['best_ckpt']):
+            os.remove(hook_msgs['best_ckpt'])
+        best_ckpt = osp.join(runner.work_dir, f'best_{self.save_best}_epoch_{epoch}.pth')
+        shutil.move(snapshot, best_ckpt)
+        hook_msgs['best_score'] = score
+        hook_msgs['best_ckpt'] = best_ckpt
+        runner.logger.info(f'Now best checkpoint is saved as {osp.basename(best_ckpt)}. '
+                           f'Best {self.save_best} is {score:0.4f} at epoch {epoch}.')
+
+
+def use_async_evaluation(cfg, config_file: str, device: str = 'cpu') -> None:
+    cfg.custom_hooks = cfg.get('custom_hooks', []) + [
+        dict(type='AsyncEvalHook', config_file=config_file, interval=cfg.evaluation.interval, device=device,
+             metric=cfg.evaluation.metric, priority='LOW')]
@@ -0,0 +1,64 @@
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+# batch preprocessing of decoded tiles on the tensor side, the same steps as the test pipeline
+
+
+def get_norm_cfg(cfg) -> Dict:
+    for step in cfg.data.test.pipeline:
+        for transform in step.get('transforms', [step]):
+            if transform['type'] == 'Normalize':
+                return transform
+    raise ValueError('the test pipeline has no Normalize step')
+
+
+def get_size_divisor(cfg) -> int:
+    for step in cfg.data.test.pipeline:
+        for transform in step.get('transforms', [step]):
+            if transform['type'] == 'Pad' and transform.get('size_divisor'):
+                return transform['size_divisor']
+    return 1
+
+
+def pad_to(img: torch.Tensor, height: int, width: int) -> torch.Tensor:
+    return F.pad(img, (0, width - img.shape[-1], 0, height - img.shape[-2]))
+
+
+def stack_tiles(tiles: List[np.ndarray]) -> torch.Tensor:
+    # uint8 batch of the tiles, smaller tiles are zero padded at the bottom and right
+    height = max(tile.shape[0] for tile in tiles)
+    width = max(tile.shape[1] for tile in tiles)
+    raw = torch.zeros(len(tiles), height, width, 3, dtype=torch.uint8)
+    for index, tile in enumerate(tiles):
+        raw[index, :tile.shape[0], :tile.shape[1]] = torch.from_numpy(np.ascontiguousarray(tile))
+    return raw
+
+
+def normalize_tiles(
+        raw: torch.Tensor,
+        norm_cfg: Dict,
+        device,
+        tile_shapes: Optional[Sequence] = None,
+        size_divisor: int = 1,
+) -> torch.Tensor:
+    img = raw.to(device).float()
+    if norm_cfg.get('to_rgb', True):
+        img = img.flip(-1)
+    img = ((img - img.new_tensor(norm_cfg['mean'])) / img.new_tensor(norm_cfg['std'])).permute(0, 3, 1, 2)
+    # padding is zero after normalization, like the Pad step
+    for index, (height, width) in enumerate(tile_shapes or []):
+        img[index, :, height:, :] = 0
+        img[index, :, :, width:] = 0
+    height = int(np.ceil(img.shape[2] / size_divisor) * size_divisor)
+    width = int(np.ceil(img.shape[3] / size_divisor) * size_divisor)
+    return pad_to(img, height, width).contiguous()
+
+
+def tile_metas(tiles: List[np.ndarray], batch_shape: Sequence[int]) -> List[Dict]:
+    height, width = batch_shape
+    return [dict(ori_shape=(tile.shape[0], tile.shape[1], 3), img_shape=(tile.shape[0], tile.shape[1], 3),
+                 pad_shape=(height, width, 3), batch_input_shape=(height, width),
+                 scale_factor=np.ones(4, dtype=np.float32), flip=False) for tile in tiles]
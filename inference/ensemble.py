@@ -0,0 +1,116 @@
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import reduce
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+import torch
+
+from inference.batching import get_norm_cfg, get_size_divisor, normalize_tiles, stack_tiles, tile_metas
+from inference.fusion import fuse_results
+
+
+class Ensemble:
+    # the tiles are stacked once and normalized once per distinct normalization and device, every model reads the
+    # shared tensor; each model runs on its own thread, so models on separate devices overlap, and the results
+    # are fused per tile with weighted boxes fusion
+
+    def __init__(
+            self,
+            models: Sequence,
+            names: Sequence[str],
+            weights: Optional[Sequence[float]] = None,
+            iou_thr: float = 0.55,
+            skip_box_thr: float = 0.0,
+            concurrent: bool = True,
+    ):
+        self.models = list(models)
+        self.names = list(names)
+        self.weights = list(weights) if weights is not None else [1.0] * len(self.models)
+        if not len(self.models) == len(self.names) == len(self.weights):
+            raise ValueError('the ensemble needs one name and one weight per model')
+        self.iou_thr = iou_thr
+        self.skip_box_thr = skip_box_thr
+        self.norm_cfgs = [get_norm_cfg(model.cfg) for model in self.models]
+        self.devices = [next(model.parameters()).device for model in self.models]
+        # a single padded shape that every model accepts
+        self.size_divisor = reduce(lambda a, b: a * b // math.gcd(a, b),
+                                   [get_size_divisor(model.cfg) for model in self.models], 1)
+        concurrent = concurrent and len(self.models) > 1
+        self.executor = ThreadPoolExecutor(max_workers=len(self.models)) if concurrent else None
+
+        self.num_tiles = 0
+        self.model_seconds = [0.0] * len(self.models)
+        self.preprocess_seconds = 0.0
+        self.fusion_seconds = 0.0
+        self.total_seconds = 0.0
+
+    def preprocess(self, tiles: List[np.ndarray]) -> List[torch.Tensor]:
+        raw = stack_tiles(tiles)
+        tile_shapes = [tile.shape[:2] for tile in tiles]
+        shared = {}
+        inputs = []
+        for norm_cfg, device in zip(self.norm_cfgs, self.devices):
+            key = (tuple(norm_cfg['mean']), tuple(norm_cfg['std']), norm_cfg.get('to_rgb', True), str(device))
+            if key not in shared:
+                shared[key] = normalize_tiles(raw, norm_cfg, device, tile_shapes=tile_shapes,
+                                              size_divisor=self.size_divisor)
+            inputs.append(shared[key])
+        return inputs
+
+    def _forward(self, index: int, img: torch.Tensor, img_metas: List[Dict]) -> List[List[np.ndarray]]:
+        start = time.perf_counter()
+        with torch.no_grad():
+            results = self.models[index].simple_test(img, img_metas, rescale=True)
+        if img.is_cuda:
+            torch.cuda.synchronize(img.device)
+        self.model_seconds[index] += time.perf_counter() - start
+        return results
+
+    def predict(self, tiles: List[np.ndarray]) -> List[List[List[np.ndarray]]]:
+        # mmdet results of every model, a list of tiles each
+        start = time.perf_counter()
+        inputs = self.preprocess(tiles)
+        self.preprocess_seconds += time.perf_counter() - start
+
+        # every model gets its own metas, the heads may write into them
+        jobs = [(index, img, tile_metas(tiles, img.shape[2:])) for index, img in enumerate(inputs)]
+        if self.executor is not None:
+            return list(self.executor.map(lambda job: self._forward(*job), jobs))
+        return [self._forward(*job) for job in jobs]
+
+    def __call__(self, tiles: List[np.ndarray]) -> List[List[np.ndarray]]:
+        start = time.perf_counter()
+        model_results = self.predict(tiles)
+
+        fusion_start = time.perf_counter()
+        fused = [fuse_results([results[tile] for results in model_results], weights=self.weights,
+                              iou_thr=self.iou_thr, skip_box_thr=self.skip_box_thr)
+                 for tile in range(len(tiles))]
+        self.fusion_seconds += time.perf_counter() - fusion_start
+
+        self.num_tiles += len(tiles)
+        self.total_seconds += time.perf_counter() - start
+        return fused
+
+    def throughput(self) -> Dict[str, float]:
+        # tiles per second of every model forward on its own and of the whole ensemble, preprocessing and fusion
+        # included
+        report = {name: self.num_tiles / seconds if seconds else 0.0
+                  for name, seconds in zip(self.names, self.model_seconds)}
+        report['ensemble'] = self.num_tiles / self.total_seconds if self.total_seconds else 0.0
+        return report
+
+    def print_report(self) -> None:
+        print(f'{"model":<32}{"seconds":>10}{"tiles/s":>10}')
+        report = self.throughput()
+        for name, seconds in zip(self.names, self.model_seconds):
+            print(f'{name:<32}{seconds:>10.2f}{report[name]:>10.2f}')
+        print(f'{"preprocessing":<32}{self.preprocess_seconds:>10.2f}')
+        print(f'{"fusion":<32}{self.fusion_seconds:>10.2f}')
+        print(f'{"ensemble":<32}{self.total_seconds:>10.2f}{report["ensemble"]:>10.2f}')
+
+    def close(self) -> None:
+        if self.executor is not None:
+            self.executor.shutdown()
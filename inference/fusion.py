@@ -0,0 +1,85 @@
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+def box_iou(boxes: np.ndarray, box: np.ndarray) -> np.ndarray:
+    x_min = np.maximum(boxes[:, 0], box[0])
+    y_min = np.maximum(boxes[:, 1], box[1])
+    x_max = np.minimum(boxes[:, 2], box[2])
+    y_max = np.minimum(boxes[:, 3], box[3])
+    inter = np.clip(x_max - x_min, 0, None) * np.clip(y_max - y_min, 0, None)
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    return inter / np.maximum(areas + (box[2] - box[0]) * (box[3] - box[1]) - inter, 1e-6)
+
+
+def weighted_boxes_fusion(
+        boxes_list: Sequence[np.ndarray],
+        scores_list: Sequence[np.ndarray],
+        labels_list: Sequence[np.ndarray],
+        weights: Optional[Sequence[float]] = None,
+        iou_thr: float = 0.55,
+        skip_box_thr: float = 0.0,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # boxes of the same object from several predictions are averaged, weighted by score, instead of suppressed;
+    # objects found by only some of the predictions lose score
+    weights = np.ones(len(boxes_list)) if weights is None else np.asarray(weights, dtype=np.float64)
+    boxes = np.concatenate([np.asarray(b, dtype=np.float64).reshape(-1, 4) for b in boxes_list])
+    scores = np.concatenate([np.asarray(s, dtype=np.float64) * w for s, w in zip(scores_list, weights)])
+    raw_scores = np.concatenate([np.asarray(s, dtype=np.float64) for s in scores_list])
+    labels = np.concatenate([np.asarray(label, dtype=np.int64) for label in labels_list])
+    keep = raw_scores >= skip_box_thr
+    boxes, scores, labels = boxes[keep], scores[keep], labels[keep]
+
+    fused_boxes, fused_scores, fused_labels = [], [], []
+    for label in np.unique(labels):
+        indices = np.nonzero(labels == label)[0]
+        indices = indices[np.argsort(-scores[indices], kind='stable')]
+        # running sums of every cluster, the fused box is their score weighted mean
+        box_sums = np.zeros((len(indices), 4))
+        score_sums = np.zeros(len(indices))
+        counts = np.zeros(len(indices))
+        num_clusters = 0
+        for index in indices:
+            cluster = -1
+            if num_clusters:
+                ious = box_iou(box_sums[:num_clusters] / score_sums[:num_clusters, None], boxes[index])
+                best = int(np.argmax(ious))
+                if ious[best] > iou_thr:
+                    cluster = best
+            if cluster < 0:
+                cluster = num_clusters
+                num_clusters += 1
+            box_sums[cluster] += scores[index] * boxes[index]
+            score_sums[cluster] += scores[index]
+            counts[cluster] += 1
+
+        fused_boxes.append(box_sums[:num_clusters] / np.maximum(score_sums[:num_clusters, None], 1e-12))
+        fused_scores.append(score_sums[:num_clusters] / counts[:num_clusters]
+                            * np.minimum(counts[:num_clusters], len(weights)) / weights.sum())
+        fused_labels.append(np.full(num_clusters, label, dtype=np.int64))
+
+    if not fused_boxes:
+        return np.zeros((0, 4), dtype=np.float32), np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.int64)
+    return (np.concatenate(fused_boxes).astype(np.float32), np.concatenate(fused_scores).astype(np.float32),
+            np.concatenate(fused_labels))
+
+
+def fuse_results(
+        results: Sequence[List[np.ndarray]],
+        weights: Optional[Sequence[float]] = None,
+        iou_thr: float = 0.55,
+        skip_box_thr: float = 0.0,
+) -> List[np.ndarray]:
+    # fuses mmdet results of one image, a (n, 5) array per class each
+    num_classes = len(results[0])
+    boxes, scores, labels = weighted_boxes_fusion(
+        [np.concatenate([dets[:, :4] for dets in result]) for result in results],
+        [np.concatenate([dets[:, 4] for dets in result]) for result in results],
+        [np.concatenate([np.full(len(dets), label) for label, dets in enumerate(result)]) for result in results],
+        weights=weights,
+        iou_thr=iou_thr,
+        skip_box_thr=skip_box_thr,
+    )
+    dets = np.concatenate([boxes, scores[:, None]], axis=1)
+    return [dets[labels == label] for label in range(num_classes)]
@@ -0,0 +1,114 @@
+import hashlib
+import json
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from dataset.utils import file_hash
+
+
+def checkpoint_hash(checkpoint: str) -> str:
+    # same short form mmcv uses when publishing checkpoints
+    return file_hash(checkpoint)[:8]
+
+
+def get_prediction_path(store_dir: Path, checkpoint: str, name: str, settings: Optional[Dict] = None) -> Path:
+    # one store per checkpoint, dataset name and settings, e.g. the annotation hash and test pipeline; a re-sliced
+    # dataset keeps its file name but reuses the image ids for other tiles
+    if settings is not None:
+        key = hashlib.sha256(json.dumps(settings, sort_keys=True, default=str).encode('utf-8')).hexdigest()[:8]
+        name = f'{name}_{key}'
+    return Path(store_dir) / checkpoint_hash(checkpoint) / name
+
+
+class PredictionStore:
+    # predictions of one checkpoint on one dataset, sharded by image with an index for lookup
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._index = None
+        self._lookup = None
+        self._shards = {}
+
+    def exists(self) -> bool:
+        return (self.path / 'index.npz').exists()
+
+    def write(self, columns: Dict[str, np.ndarray], classes: Sequence[str], shard_size: int = 1000) -> None:
+        self.path.mkdir(parents=True, exist_ok=True)
+        image_ids = columns['image_ids']
+        offsets = columns['offsets']
+
+        shards = []
+        rows = []
+        for shard, start in enumerate(range(0, len(image_ids), shard_size)):
+            end = min(start + shard_size, len(image_ids))
+            first, last = offsets[start], offsets[end]
+            np.savez_compressed(
+                self.path / f'shard_{shard:05d}.npz',
+                image_ids=image_ids[start:end],
+                offsets=offsets[start:end + 1] - first,
+                bboxes=columns['bboxes'][first:last],
+                scores=columns['scores'][first:last],
+                labels=columns['labels'][first:last],
+            )
+            shards.append(np.full(end - start, shard, dtype=np.int32))
+            rows.append(np.arange(end - start, dtype=np.int32))
+
+        # the index is written last, a store without it is incomplete
+        np.savez(
+            self.path / 'index.npz',
+            image_ids=image_ids,
+            shards=np.concatenate(shards) if shards else np.zeros(0, dtype=np.int32),
+            rows=np.concatenate(rows) if rows else np.zeros(0, dtype=np.int32),
+            classes=np.asarray(classes, dtype=str),
+        )
+        self._index = None
+        self._lookup = None
+        self._shards = {}
+
+    @property
+    def index(self) -> Dict[str, np.ndarray]:
+        if self._index is None:
+            with np.load(self.path / 'index.npz') as data:
+                self._index = {key: data[key] for key in data.files}
+            self._lookup = {image_id: i for i, image_id in enumerate(self._index['image_ids'].tolist())}
+        return self._index
+
+    @property
+    def classes(self) -> List[str]:
+        return self.index['classes'].tolist()
+
+    @property
+    def image_ids(self) -> List[int]:
+        return self.index['image_ids'].tolist()
+
+    def __contains__(self, image_id: int) -> bool:
+        self.index
+        return image_id in self._lookup
+
+    def _shard(self, shard: int) -> Dict[str, np.ndarray]:
+        if shard not in self._shards:
+            with np.load(self.path / f'shard_{shard:05d}.npz') as data:
+                self._shards[shard] = {key: data[key] for key in data.files}
+        return self._shards[shard]
+
+    def get(self, image_id: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        if image_id not in self:
+            raise KeyError(f'No predictions for image {image_id} in {self.path}')
+        i = self._lookup[image_id]
+        shard = self._shard(int(self.index['shards'][i]))
+        row = int(self.index['rows'][i])
+        start, end = shard['offsets'][row], shard['offsets'][row + 1]
+
+        return shard['bboxes'][start:end], shard['scores'][start:end], shard['labels'][start:end]
+
+    def results(self, image_ids: Sequence[int]) -> List[List[np.ndarray]]:
+        num_classes = len(self.classes)
+        results = []
+        for image_id in image_ids:
+            bboxes, scores, labels = self.get(image_id)
+            dets = np.concatenate([bboxes, scores[:, None]], axis=1)
+            results.append([dets[labels == label] for label in range(num_classes)])
+
+        return results
@@ -0,0 +1,85 @@
+import json
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+from mmdet.datasets import build_dataset
+
+from inference.utils import predict_dataset
+
+
+def disable_nms(cfg, score_thr: float = 0.01, max_candidates: int = 1000) -> None:
+    test_cfg = cfg.model.test_cfg
+    # the class-wise NMS of Faster R-CNN lives in the rcnn stage
+    if 'rcnn' in test_cfg:
+        test_cfg = test_cfg.rcnn
+    test_cfg.score_thr = score_thr
+    # boxes are only suppressed above the IoU threshold, so 1.0 keeps every candidate
+    test_cfg.nms = dict(type='nms', iou_threshold=1.0)
+    test_cfg.max_per_img = max_candidates
+
+
+def results_to_columns(results: List[List[np.ndarray]], image_ids: List[int]) -> Dict[str, np.ndarray]:
+    bboxes = []
+    scores = []
+    labels = []
+    counts = []
+    for result in results:
+        count = 0
+        for label, dets in enumerate(result):
+            bboxes.append(dets[:, :4])
+            scores.append(dets[:, 4])
+            labels.append(np.full(len(dets), label, dtype=np.int16))
+            count += len(dets)
+        counts.append(count)
+
+    return {
+        'image_ids': np.asarray(image_ids, dtype=np.int64),
+        'offsets': np.concatenate([[0], np.cumsum(counts)]).astype(np.int64),
+        'bboxes': np.concatenate(bboxes).astype(np.float32).reshape(-1, 4),
+        'scores': np.concatenate(scores).astype(np.float32),
+        'labels': np.concatenate(labels),
+    }
+
+
+def columns_to_results(columns: Dict[str, np.ndarray], num_classes: int) -> List[List[np.ndarray]]:
+    offsets = columns['offsets']
+    dets = np.concatenate([columns['bboxes'], columns['scores'][:, None]], axis=1)
+    results = []
+    for start, end in zip(offsets[:-1], offsets[1:]):
+        labels = columns['labels'][start:end]
+        results.append([dets[start:end][labels == label] for label in range(num_classes)])
+
+    return results
+
+
+def collect_raw_predictions(
+        cfg,
+        checkpoint: str,
+        split: str = 'val',
+        score_thr: float = 0.01,
+        max_candidates: int = 1000,
+) -> Dict[str, np.ndarray]:
+    disable_nms(cfg, score_thr=score_thr, max_candidates=max_candidates)
+
+    dataset = build_dataset(cfg.data[split], dict(test_mode=True))
+    results = predict_dataset(cfg, checkpoint=checkpoint, dataset=dataset)
+
+    return results_to_columns(results, image_ids=[info['id'] for info in dataset.data_infos])
+
+
+def save_raw_predictions(columns: Dict[str, np.ndarray], save_path: Path, settings: Optional[Dict] = None) -> None:
+    # settings records what the predictions were made with, e.g. the checkpoint hash and the candidate limits
+    Path(save_path).parent.mkdir(parents=True, exist_ok=True)
+    np.savez_compressed(save_path, settings=np.asarray(json.dumps(settings or {}, sort_keys=True)), **columns)
+
+
+def load_raw_prediction_settings(data_path: Path) -> Dict:
+    # caches written without settings match none
+    with np.load(data_path) as data:
+        return json.loads(str(data['settings'])) if 'settings' in data.files else {}
+
+
+def load_raw_predictions(data_path: Path) -> Dict[str, np.ndarray]:
+    with np.load(data_path) as data:
+        return {key: data[key] for key in data.files if key != 'settings'}
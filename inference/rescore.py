@@ -0,0 +1,72 @@
+import itertools
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+
+def pairwise_iou(bboxes: np.ndarray) -> np.ndarray:
+    areas = (bboxes[:, 2] - bboxes[:, 0]) * (bboxes[:, 3] - bboxes[:, 1])
+    top_left = np.maximum(bboxes[:, None, :2], bboxes[None, :, :2])
+    bottom_right = np.minimum(bboxes[:, None, 2:], bboxes[None, :, 2:])
+    wh = np.clip(bottom_right - top_left, 0, None)
+    overlap = wh[..., 0] * wh[..., 1]
+
+    return overlap / np.maximum(areas[:, None] + areas[None, :] - overlap, 1e-6)
+
+
+def multi_threshold_nms(bboxes: np.ndarray, iou_thrs: Sequence[float]) -> np.ndarray:
+    # bboxes are sorted by descending score; returns a keep mask per IoU threshold
+    num_boxes = len(bboxes)
+    iou_thrs = np.asarray(iou_thrs, dtype=np.float32)[:, None]
+    keep = np.zeros((len(iou_thrs), num_boxes), dtype=bool)
+    suppressed = np.zeros((len(iou_thrs), num_boxes), dtype=bool)
+    if num_boxes == 0:
+        return keep
+
+    iou = pairwise_iou(bboxes)
+    for i in range(num_boxes):
+        active = ~suppressed[:, i]
+        if not active.any():
+            continue
+        keep[active, i] = True
+        suppressed[active] |= iou[i][None, :] > iou_thrs[active]
+
+    return keep
+
+
+def sweep_thresholds(
+        columns: Dict[str, np.ndarray],
+        num_classes: int,
+        iou_thrs: Sequence[float],
+        score_thrs: Sequence[float],
+        max_per_imgs: Sequence[int],
+) -> Dict[Tuple[float, float, int], List[List[np.ndarray]]]:
+    grid = list(itertools.product(iou_thrs, score_thrs, max_per_imgs))
+    sweep_results = {point: [] for point in grid}
+
+    offsets = columns['offsets']
+    for start, end in zip(offsets[:-1], offsets[1:]):
+        bboxes = columns['bboxes'][start:end]
+        scores = columns['scores'][start:end]
+        labels = columns['labels'][start:end]
+
+        # NMS runs once per class for all IoU thresholds; score thresholds only cut
+        # a prefix of the score-sorted boxes, so they reuse the same keep masks
+        order = np.lexsort((-scores, labels))
+        bboxes, scores, labels = bboxes[order], scores[order], labels[order]
+        keep = np.zeros((len(iou_thrs), len(order)), dtype=bool)
+        for label in range(num_classes):
+            index = np.nonzero(labels == label)[0]
+            keep[:, index] = multi_threshold_nms(bboxes[index], iou_thrs)
+
+        dets = np.concatenate([bboxes, scores[:, None]], axis=1)
+        for iou_index, iou_thr in enumerate(iou_thrs):
+            for score_thr in score_thrs:
+                kept = np.nonzero(keep[iou_index] & (scores >= score_thr))[0]
+                kept = kept[np.argsort(-scores[kept], kind='stable')]
+                for max_per_img in max_per_imgs:
+                    top = kept[:max_per_img]
+                    sweep_results[(iou_thr, score_thr, max_per_img)].append(
+                        [dets[top[labels[top] == label]] for label in range(num_classes)])
+
+    return sweep_results
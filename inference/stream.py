@@ -0,0 +1,182 @@
+import queue
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+
+import mmcv
+from mmdet.apis import inference_detector
+
+from dataset.utils import write_data
+from inference.utils import merge_tile_results, tile_image, to_coco_detections
+
+image_extensions = ('.jpg', '.jpeg', '.png', '.tif', '.tiff', '.bmp')
+
+# marks the end of the stream on every queue
+_stop = object()
+
+
+def watch_folder(
+        watch_dir: Path,
+        poll_interval: float = 2.0,
+        once: bool = False,
+) -> Iterator[Path]:
+    seen = set()
+    sizes = {}
+    while True:
+        for path in sorted(Path(watch_dir).iterdir()):
+            if path.suffix.lower() not in image_extensions or path in seen:
+                continue
+            size = path.stat().st_size
+            # the microscope writes files incrementally, wait until the size is stable
+            if not once and sizes.get(path) != size:
+                sizes[path] = size
+                continue
+            seen.add(path)
+            sizes.pop(path, None)
+            yield path
+
+        if once:
+            return
+        time.sleep(poll_interval)
+
+
+class StreamingInference:
+
+    def __init__(
+            self,
+            model,
+            categories: List[Dict],
+            output_dir: Path,
+            tile_size: int,
+            overlap_ratio: float,
+            batch_size: int = 8,
+            nms_iou: float = 0.5,
+            score_thr: float = 0.05,
+            min_foreground: Optional[float] = None,
+            decode_workers: int = 2,
+            write_workers: int = 2,
+            queue_size: int = 8,
+            predictor: Optional[Callable] = None,
+    ):
+        self.model = model
+        self.categories = categories
+        self.output_dir = Path(output_dir)
+        self.tile_size = tile_size
+        self.overlap_ratio = overlap_ratio
+        self.batch_size = batch_size
+        self.nms_iou = nms_iou
+        self.score_thr = score_thr
+        self.min_foreground = min_foreground
+        self.decode_workers = decode_workers
+        self.write_workers = write_workers
+        # maps a list of tiles to their mmdet results, e.g. BatchedTTA or Ensemble; the model itself when unset
+        self.predictor = predictor
+
+        self.path_queue = queue.Queue(maxsize=queue_size)
+        self.tile_queue = queue.Queue(maxsize=queue_size)
+        self.write_queue = queue.Queue(maxsize=queue_size)
+
+        self.num_images = 0
+        self.num_tiles = 0
+        self.num_skipped = 0
+
+    def output_path(self, image_path: Path) -> Path:
+        # the full name, a.jpg and a.tif are different images
+        return self.output_dir / (image_path.name + '.json')
+
+    def _feed(self, image_paths: Iterable[Path]) -> None:
+        for image_path in image_paths:
+            if self.output_path(image_path).exists():
+                continue
+            self.path_queue.put(image_path)
+        for _ in range(self.decode_workers):
+            self.path_queue.put(_stop)
+
+    def _decode(self) -> None:
+        # the main loop waits for a stop from every decoder, it has to come even when a decoder fails
+        try:
+            while True:
+                image_path = self.path_queue.get()
+                if image_path is _stop:
+                    return
+                try:
+                    image = mmcv.imread(str(image_path))
+                    if image is None:
+                        print(f'Skip unreadable image {image_path}')
+                        continue
+                    tiles, tile_boxes, num_tiles = tile_image(image, tile_size=self.tile_size,
+                                                              overlap_ratio=self.overlap_ratio,
+                                                              min_foreground=self.min_foreground)
+                except Exception as error:
+                    # a corrupt or half written slide only loses its own image
+                    print(f'Skip image {image_path}: {error!r}')
+                    continue
+                self.tile_queue.put((image_path, image.shape[:2], tiles, tile_boxes, num_tiles))
+        finally:
+            self.tile_queue.put(_stop)
+
+    def _write(self) -> None:
+        while True:
+            item = self.write_queue.get()
+            if item is _stop:
+                return
+            image_path, data = item
+            write_data(data=data, save_path=self.output_path(image_path))
+
+    def _predict(self, image_path: Path, image_shape, tiles, tile_boxes) -> Dict:
+        tile_results = []
+        for i in range(0, len(tiles), self.batch_size):
+            if self.predictor is not None:
+                tile_results.extend(self.predictor(tiles[i:i + self.batch_size]))
+            else:
+                tile_results.extend(inference_detector(self.model, tiles[i:i + self.batch_size]))
+
+        dets, labels = merge_tile_results(tile_results, tile_boxes, iou_threshold=self.nms_iou)
+
+        image_id = self.num_images + 1
+        return {
+            "images": [{
+                "id": image_id,
+                "file_name": image_path.name,
+                "height": int(image_shape[0]),
+                "width": int(image_shape[1]),
+            }],
+            "categories": self.categories,
+            "annotations": to_coco_detections(dets, labels, image_id=image_id, categories=self.categories,
+                                              score_thr=self.score_thr),
+        }
+
+    def run(self, image_paths: Iterable[Path]) -> None:
+        threads = [threading.Thread(target=self._feed, args=(image_paths,), daemon=True)]
+        threads += [threading.Thread(target=self._decode, daemon=True) for _ in range(self.decode_workers)]
+        writers = [threading.Thread(target=self._write, daemon=True) for _ in range(self.write_workers)]
+        for thread in threads + writers:
+            thread.start()
+
+        start = time.perf_counter()
+        finished_decoders = 0
+        # model forward stays in the main thread, decode and write overlap with it
+        try:
+            while finished_decoders < self.decode_workers:
+                item = self.tile_queue.get()
+                if item is _stop:
+                    finished_decoders += 1
+                    continue
+                image_path, image_shape, tiles, tile_boxes, num_tiles = item
+                data = self._predict(image_path, image_shape, tiles, tile_boxes)
+                self.write_queue.put((image_path, data))
+
+                self.num_images += 1
+                self.num_tiles += num_tiles
+                self.num_skipped += num_tiles - len(tiles)
+                elapsed = time.perf_counter() - start
+                print(f'{image_path.name}: {len(data["annotations"])} detections, {len(tiles)}/{num_tiles} tiles '
+                      f'({self.num_images / elapsed:.2f} images/s, '
+                      f'{self.num_skipped / max(self.num_tiles, 1):.1%} background tiles skipped)')
+        finally:
+            # the results already predicted are written out even when the model fails
+            for _ in writers:
+                self.write_queue.put(_stop)
+            for thread in writers:
+                thread.join()
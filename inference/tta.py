@@ -0,0 +1,165 @@
+import hashlib
+import json
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+from inference.batching import get_norm_cfg, get_size_divisor, normalize_tiles, pad_to, stack_tiles, tile_metas
+from inference.fusion import fuse_results
+
+
+def flip_horizontal(boxes: np.ndarray, width: np.ndarray, height: np.ndarray) -> np.ndarray:
+    return np.stack([width - boxes[:, 2], boxes[:, 1], width - boxes[:, 0], boxes[:, 3]], axis=1)
+
+
+def flip_vertical(boxes: np.ndarray, width: np.ndarray, height: np.ndarray) -> np.ndarray:
+    return np.stack([boxes[:, 0], height - boxes[:, 3], boxes[:, 2], height - boxes[:, 1]], axis=1)
+
+
+def rotate_back(boxes: np.ndarray, width: np.ndarray, height: np.ndarray) -> np.ndarray:
+    # torch.rot90 turns counterclockwise, a rotated (x, y) was (width - y, x)
+    return np.stack([width - boxes[:, 3], boxes[:, 0], width - boxes[:, 1], boxes[:, 2]], axis=1)
+
+
+# view: (image transform, inverse box transform, whether the view swaps height and width)
+tta_views = {
+    'identity': (lambda img: img, lambda boxes, width, height: boxes, False),
+    'hflip': (lambda img: torch.flip(img, dims=[3]), flip_horizontal, False),
+    'vflip': (lambda img: torch.flip(img, dims=[2]), flip_vertical, False),
+    'rot90': (lambda img: torch.rot90(img, k=1, dims=[2, 3]), rotate_back, True),
+}
+
+
+class BatchedTTA:
+    # every view of every tile goes through the detector in one forward pass, the views are then mapped back
+    # onto the tile and fused with weighted boxes fusion
+
+    def __init__(
+            self,
+            model,
+            views: Sequence[str] = ('identity', 'hflip', 'vflip', 'rot90'),
+            scales: Sequence[float] = (1.0,),
+            iou_thr: float = 0.55,
+            skip_box_thr: float = 0.0,
+            max_batch_size: Optional[int] = None,
+    ):
+        self.model = model
+        self.views = list(views)
+        self.scales = list(scales)
+        self.iou_thr = iou_thr
+        self.skip_box_thr = skip_box_thr
+        self.max_batch_size = max_batch_size
+        self.norm_cfg = get_norm_cfg(model.cfg)
+        self.size_divisor = get_size_divisor(model.cfg)
+        self.device = next(model.parameters()).device
+
+    def __call__(self, tiles: List[np.ndarray]) -> List[List[np.ndarray]]:
+        img = normalize_tiles(stack_tiles(tiles), self.norm_cfg, self.device,
+                              tile_shapes=[tile.shape[:2] for tile in tiles])
+        img_metas = tile_metas(tiles, img.shape[2:])
+        # boxes are only clipped to the view, the padding of the input is part of it
+        for img_meta in img_metas:
+            img_meta['img_shape'] = img_meta['pad_shape']
+        return self.predict(img, img_metas)
+
+    def predict(self, img: torch.Tensor, img_metas: List[Dict]) -> List[List[np.ndarray]]:
+        # img is a normalized batch, img_metas carry its scale factor to the original images
+        views = []
+        for scale in self.scales:
+            scaled = img if scale == 1 else F.interpolate(img, scale_factor=scale, mode='bilinear',
+                                                          align_corners=False)
+            for view in self.views:
+                views.append((view, scale, tta_views[view][0](scaled)))
+
+        height = max(view_img.shape[2] for _, _, view_img in views)
+        width = max(view_img.shape[3] for _, _, view_img in views)
+        height = int(np.ceil(height / self.size_divisor) * self.size_divisor)
+        width = int(np.ceil(width / self.size_divisor) * self.size_divisor)
+        batch = torch.cat([pad_to(view_img, height, width) for _, _, view_img in views])
+
+        batch_metas = []
+        for view, scale, view_img in views:
+            swap = tta_views[view][2]
+            for img_meta in img_metas:
+                scale_factor = np.asarray(img_meta['scale_factor'], dtype=np.float32) * scale
+                batch_metas.append(dict(
+                    ori_shape=img_meta['ori_shape'],
+                    # boxes are only clipped to the view, the padding of the input is part of it
+                    img_shape=(view_img.shape[2], view_img.shape[3], 3),
+                    pad_shape=(height, width, 3),
+                    batch_input_shape=(height, width),
+                    scale_factor=scale_factor[[1, 0, 3, 2]] if swap else scale_factor,
+                    flip=False,
+                ))
+
+        with torch.no_grad():
+            step = self.max_batch_size or len(batch)
+            view_results = []
+            for start in range(0, len(batch), step):
+                view_results.extend(self.model.simple_test(
+                    batch[start:start + step], batch_metas[start:start + step], rescale=True))
+
+        # extent of the input tensor in original image coordinates, the reference of the inverse transforms
+        scale_factors = np.stack([np.broadcast_to(np.asarray(img_meta['scale_factor'], dtype=np.float32), (4,))[:2]
+                                  for img_meta in img_metas])
+        extent_width = img.shape[3] / scale_factors[:, 0]
+        extent_height = img.shape[2] / scale_factors[:, 1]
+
+        num_images = len(img_metas)
+        num_classes = len(view_results[0])
+        # per image and view, the class results mapped back onto the image
+        per_image = [[[] for _ in views] for _ in range(num_images)]
+        for position, (view, _, _) in enumerate(views):
+            results = view_results[position * num_images:(position + 1) * num_images]
+            inverse = tta_views[view][1]
+            for label in range(num_classes):
+                counts = [len(result[label]) for result in results]
+                dets = np.concatenate([result[label].reshape(-1, 5) for result in results]).astype(np.float32)
+                image_index = np.repeat(np.arange(num_images), counts)
+                # all boxes of a view are mapped back at once
+                dets[:, :4] = inverse(dets[:, :4], extent_width[image_index], extent_height[image_index])
+                for image, image_dets in enumerate(np.split(dets, np.cumsum(counts)[:-1])):
+                    per_image[image][position].append(image_dets)
+
+        fused = []
+        for image, img_meta in enumerate(img_metas):
+            result = fuse_results(per_image[image], iou_thr=self.iou_thr, skip_box_thr=self.skip_box_thr)
+            ori_height, ori_width = img_meta['ori_shape'][:2]
+            for dets in result:
+                dets[:, [0, 2]] = dets[:, [0, 2]].clip(0, ori_width)
+                dets[:, [1, 3]] = dets[:, [1, 3]].clip(0, ori_height)
+            fused.append(result)
+
+        return fused
+
+
+def predict_loader(tta: BatchedTTA, data_loader) -> List[List[np.ndarray]]:
+    # test pipeline batches, already resized and normalized
+    results = []
+    for data in data_loader:
+        results.extend(tta.predict(data['img'][0].to(tta.device), data['img_metas'][0].data[0]))
+    return results
+
+
+def get_tta_settings(opt) -> Optional[Dict]:
+    if not opt.tta:
+        return None
+    return dict(views=opt.tta_views, scales=opt.tta_scales, iou_thr=opt.tta_iou)
+
+
+def tta_tag(settings: Optional[Dict]) -> str:
+    # names the stored predictions of a tta setting, other views, scales or iou are predicted again
+    if settings is None:
+        return ''
+    key = json.dumps(settings, sort_keys=True)
+    return '_tta_' + hashlib.sha256(key.encode('utf-8')).hexdigest()[:8]
+
+
+def add_tta_arguments(parser) -> None:
+    parser.add_argument('--tta', action="store_true", help='batched test time augmentation fused with WBF')
+    parser.add_argument('--tta_views', type=str, nargs='+', default=['identity', 'hflip', 'vflip', 'rot90'],
+                        choices=list(tta_views), help='views of every tile with --tta')
+    parser.add_argument('--tta_scales', type=float, nargs='+', default=[1.0], help='tile scales with --tta')
+    parser.add_argument('--tta_iou', type=float, default=0.55, help='IoU threshold of the WBF over the views')
@@ -0,0 +1,157 @@
+import argparse
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import torch
+from mmcv.ops import batched_nms
+from mmdet.apis import single_gpu_test
+from mmdet.datasets import build_dataloader
+from mmdet.utils import build_dp
+
+from dataset.foreground import select_foreground_tiles
+from dataset.slicing import get_tile_boxes
+from inference.tta import BatchedTTA, predict_loader
+from model.compile import compile_detector
+from model.weight_store import init_model
+from train_model import get_train_config
+
+
+def get_inference_config(
+        method: str,
+        num_classes: int,
+        img_size: int,
+        device: str = 'cuda:0',
+        memory_saving: bool = False,
+        checkpoint_stages: Optional[Sequence[int]] = None,
+        anchors: bool = False,
+        data_config: Optional[Dict] = None,
+):
+    opt = argparse.Namespace(method=method, num_classes=num_classes, img_size=img_size, epochs=12, lr=0.0025,
+                             pretrained=False, memory_saving=memory_saving, checkpoint_stages=checkpoint_stages,
+                             anchors=anchors, manifest=None)
+    cfg = get_train_config(opt, data_config)
+    cfg.model.pretrained = None
+    cfg.device = device
+
+    return cfg
+
+
+def load_detector(
+        method: str,
+        num_classes: int,
+        img_size: int,
+        checkpoint: str,
+        device: str = 'cuda:0',
+        compile_model: bool = False,
+        anchors: bool = False,
+):
+    cfg = get_inference_config(method=method, num_classes=num_classes, img_size=img_size, device=device,
+                               anchors=anchors)
+    model = init_model(cfg, checkpoint, device=device)
+    if compile_model:
+        compile_detector(model)
+
+    return model
+
+
+def predict_dataset(
+        cfg,
+        checkpoint: str,
+        dataset,
+        compile_model: bool = False,
+        tta: Optional[Dict] = None,
+) -> List[List[np.ndarray]]:
+    data_loader = build_dataloader(
+        dataset,
+        samples_per_gpu=1,
+        workers_per_gpu=cfg.data.workers_per_gpu,
+        dist=False,
+        shuffle=False)
+
+    model = init_model(cfg, checkpoint, device=cfg.device)
+    if compile_model:
+        compile_detector(model)
+    if tta is not None:
+        return predict_loader(BatchedTTA(model, **tta), data_loader)
+    device = 'cuda' if cfg.device.startswith('cuda') else 'cpu'
+    model = build_dp(model, device, device_ids=[0])
+
+    return single_gpu_test(model, data_loader)
+
+
+def tile_image(
+        image: np.ndarray,
+        tile_size: int,
+        overlap_ratio: float,
+        min_foreground: Optional[float] = None,
+) -> Tuple[List[np.ndarray], np.ndarray, int]:
+    tile_boxes = get_tile_boxes(image.shape[0], image.shape[1], tile_size, overlap_ratio)
+    num_tiles = len(tile_boxes)
+    # background tiles never reach the detector
+    if min_foreground is not None:
+        tile_boxes = tile_boxes[select_foreground_tiles(image, tile_boxes, min_foreground=min_foreground)]
+    tiles = [image[y_min:y_max, x_min:x_max] for x_min, y_min, x_max, y_max in tile_boxes.tolist()]
+
+    return tiles, tile_boxes.astype(np.float32), num_tiles
+
+
+def merge_tile_results(
+        tile_results: List[List[np.ndarray]],
+        tile_boxes: np.ndarray,
+        iou_threshold: float = 0.5,
+) -> Tuple[np.ndarray, np.ndarray]:
+    bboxes = []
+    labels = []
+    for result, tile_box in zip(tile_results, tile_boxes):
+        for label, dets in enumerate(result):
+            if len(dets) == 0:
+                continue
+            dets = dets.copy()
+            # move tile coordinates back onto the full image
+            dets[:, [0, 2]] += tile_box[0]
+            dets[:, [1, 3]] += tile_box[1]
+            bboxes.append(dets)
+            labels.append(np.full(len(dets), label, dtype=np.int64))
+
+    if not bboxes:
+        return np.zeros((0, 5), dtype=np.float32), np.zeros((0,), dtype=np.int64)
+
+    bboxes = np.concatenate(bboxes).astype(np.float32)
+    labels = np.concatenate(labels)
+
+    # overlapping tiles see the same cell twice, suppress duplicates per class
+    dets, keep = batched_nms(
+        torch.from_numpy(bboxes[:, :4]),
+        torch.from_numpy(bboxes[:, 4]),
+        torch.from_numpy(labels),
+        dict(type='nms', iou_threshold=iou_threshold),
+    )
+
+    return dets.numpy(), labels[keep.numpy()]
+
+
+def to_coco_detections(
+        dets: np.ndarray,
+        labels: np.ndarray,
+        image_id: int,
+        categories: List[Dict],
+        score_thr: float = 0.0,
+        start_id: int = 1,
+) -> List[Dict]:
+    annotations = []
+    for (x_min, y_min, x_max, y_max, score), label in zip(dets.tolist(), labels.tolist()):
+        if score < score_thr:
+            continue
+        width = x_max - x_min
+        height = y_max - y_min
+        annotations.append({
+            "id": start_id + len(annotations),
+            "image_id": image_id,
+            "category_id": categories[label]['id'],
+            "bbox": [x_min, y_min, width, height],
+            "area": width * height,
+            "iscrowd": 0,
+            "score": score,
+        })
+
+    return annotations
@@ -1,9 +1,12 @@
-from typing import Dict
+from typing import Dict, List, Optional
 
 from mmdet.apis import set_random_seed
 from pathlib import Path
 from mmcv import Config
 
+from model.anchors import apply_anchor_overrides
+from model.weight_store import resolve_weights
+
 
 def get_retinanet_config(
         data_config: Dict,
@@ -12,6 +15,7 @@ def get_retinanet_config(
         max_epochs: int = 12,
         lr: float = 0.0025,
         pretrained: bool = True,
+        anchors: Optional[List[Dict]] = None,
 ):
     if num_classes == 2:
         classes = ['normal', 'cancer']
@@ -45,7 +49,7 @@ def get_retinanet_config(
     # If we need to finetune a model based on a pre-trained detector, we need to
     # use load_from to set the path of checkpoints.
     if pretrained:
-        cfg.load_from = '/content/drive/MyDrive/checkpoints/retinanet_r101_fpn_1x_coco.pth'
+        cfg.load_from = resolve_weights('retinanet_r101_fpn_1x_coco')
     else:
         cfg.load_from = ''
 
@@ -92,4 +96,8 @@ def get_retinanet_config(
              log_checkpoint_metadata=True,
              num_eval_images=50)]
 
+    if anchors is not None:
+        # scales and ratios fitted to the cell boxes by optimize_anchors.py
+        apply_anchor_overrides(cfg.model.bbox_head.anchor_generator, anchors)
+
     return cfg
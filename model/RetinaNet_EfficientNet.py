@@ -1,9 +1,13 @@
-from typing import Dict
+from typing import Dict, List, Optional, Sequence
 
 from mmdet.apis import set_random_seed
 from pathlib import Path
 from mmcv import Config
 
+from model.anchors import apply_anchor_overrides
+from model.memory_saving import use_memory_saving
+from model.weight_store import resolve_weights
+
 
 def get_retinanet_efficientnet_config(
         data_config: Dict,
@@ -12,6 +16,9 @@ def get_retinanet_efficientnet_config(
         max_epochs: int = 12,
         lr: float = 0.0025,
         pretrained: bool = True,
+        memory_saving: bool = False,
+        checkpoint_stages: Optional[Sequence[int]] = None,
+        anchors: Optional[List[Dict]] = None,
 ):
     if num_classes == 2:
         classes = ['normal', 'cancer']
@@ -48,7 +55,7 @@ def get_retinanet_efficientnet_config(
     # If we need to finetune a model based on a pre-trained detector, we need to
     # use load_from to set the path of checkpoints.
     if pretrained:
-        cfg.load_from = 'https://download.openmmlab.com/mmdetection/v2.0/efficientnet/retinanet_effb3_fpn_crop896_8x4_1x_coco/retinanet_effb3_fpn_crop896_8x4_1x_coco_20220322_234806-615a0dda.pth'
+        cfg.load_from = resolve_weights('retinanet_effb3_fpn_crop896_8x4_1x_coco')
     else:
         cfg.load_from = ''
 
@@ -97,4 +104,12 @@ def get_retinanet_efficientnet_config(
              log_checkpoint_metadata=True,
              num_eval_images=50)]
 
+    if anchors is not None:
+        # scales and ratios fitted to the cell boxes by optimize_anchors.py
+        apply_anchor_overrides(cfg.model.bbox_head.anchor_generator, anchors)
+
+    if memory_saving:
+        # recompute the backbone activations in backward, None checkpoints every stage
+        use_memory_saving(cfg, stages=checkpoint_stages)
+
     return cfg
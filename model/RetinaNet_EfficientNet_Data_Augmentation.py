@@ -1,9 +1,14 @@
-from typing import Dict
+from typing import Dict, List, Optional, Sequence
 
 from mmdet.apis import set_random_seed
 from pathlib import Path
 from mmcv import Config
 
+from dataset.batch_augmentation import BatchAugmentationHook  # noqa: F401
+from model.anchors import apply_anchor_overrides
+from model.memory_saving import use_memory_saving
+from model.weight_store import resolve_weights
+
 
 def get_retinanet_efficientnet_data_augmentation_config(
         data_config: Dict,
@@ -12,6 +17,10 @@ def get_retinanet_efficientnet_data_augmentation_config(
         max_epochs: int = 12,
         lr: float = 0.0025,
         pretrained: bool = True,
+        batch_augmentation: bool = True,
+        memory_saving: bool = False,
+        checkpoint_stages: Optional[Sequence[int]] = None,
+        anchors: Optional[List[Dict]] = None,
 ):
     if num_classes == 2:
         classes = ['normal', 'cancer']
@@ -48,7 +57,7 @@ def get_retinanet_efficientnet_data_augmentation_config(
     # If we need to finetune a model based on a pre-trained detector, we need to
     # use load_from to set the path of checkpoints.
     if pretrained:
-        cfg.load_from = 'https://download.openmmlab.com/mmdetection/v2.0/efficientnet/retinanet_effb3_fpn_crop896_8x4_1x_coco/retinanet_effb3_fpn_crop896_8x4_1x_coco_20220322_234806-615a0dda.pth'
+        cfg.load_from = resolve_weights('retinanet_effb3_fpn_crop896_8x4_1x_coco')
     else:
         cfg.load_from = ''
 
@@ -141,6 +150,11 @@ def get_retinanet_efficientnet_data_augmentation_config(
             ])
     ]
 
+    if batch_augmentation:
+        # run the Albu transforms on the collated batch instead of per sample in the workers
+        train_pipeline = [step for step in train_pipeline if step['type'] != 'Albu']
+        cfg.custom_hooks = cfg.get('custom_hooks', []) + [dict(type='BatchAugmentationHook')]
+
     cfg.train_pipeline = train_pipeline
     cfg.test_pipeline = test_pipeline
     cfg.test_pipeline[1]['img_scale'] = (img_size, img_size)
@@ -163,4 +177,12 @@ def get_retinanet_efficientnet_data_augmentation_config(
              log_checkpoint_metadata=True,
              num_eval_images=50)]
 
+    if anchors is not None:
+        # scales and ratios fitted to the cell boxes by optimize_anchors.py
+        apply_anchor_overrides(cfg.model.bbox_head.anchor_generator, anchors)
+
+    if memory_saving:
+        # recompute the backbone activations in backward, None checkpoints every stage
+        use_memory_saving(cfg, stages=checkpoint_stages)
+
     return cfg
@@ -1,9 +1,12 @@
-from typing import Dict
+from typing import Dict, List, Optional, Sequence
 
 from mmdet.apis import set_random_seed
 from pathlib import Path
 from mmcv import Config
 
+from model.anchors import apply_anchor_overrides
+from model.memory_saving import use_memory_saving
+
 
 def get_retinanet_swin_config(
         data_config: Dict,
@@ -12,6 +15,9 @@ def get_retinanet_swin_config(
         max_epochs: int = 12,
         lr: float = 0.0025,
         pretrained: bool = True,
+        memory_saving: bool = False,
+        checkpoint_stages: Optional[Sequence[int]] = None,
+        anchors: Optional[List[Dict]] = None,
 ):
     if num_classes == 2:
         classes = ['normal', 'cancer']
@@ -92,4 +98,12 @@ def get_retinanet_swin_config(
              log_checkpoint_metadata=True,
              num_eval_images=50)]
 
+    if anchors is not None:
+        # scales and ratios fitted to the cell boxes by optimize_anchors.py
+        apply_anchor_overrides(cfg.model.bbox_head.anchor_generator, anchors)
+
+    if memory_saving:
+        # recompute the backbone activations in backward, None checkpoints every stage
+        use_memory_saving(cfg, stages=checkpoint_stages)
+
     return cfg
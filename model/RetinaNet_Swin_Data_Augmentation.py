@@ -1,8 +1,12 @@
-from typing import Dict
+from typing import Dict, List, Optional, Sequence
 
 from mmcv import Config
 from mmdet.apis import set_random_seed
 
+from dataset.batch_augmentation import BatchAugmentationHook  # noqa: F401
+from model.anchors import apply_anchor_overrides
+from model.memory_saving import use_memory_saving
+
 
 def get_retinanet_swin_data_augmentation_config(
         data_config: Dict,
@@ -11,6 +15,10 @@ def get_retinanet_swin_data_augmentation_config(
         max_epochs: int = 12,
         lr: float = 0.0025,
         pretrained: bool = True,
+        batch_augmentation: bool = True,
+        memory_saving: bool = False,
+        checkpoint_stages: Optional[Sequence[int]] = None,
+        anchors: Optional[List[Dict]] = None,
 ):
     if num_classes == 2:
         classes = ['normal', 'cancer']
@@ -115,6 +123,11 @@ def get_retinanet_swin_data_augmentation_config(
         dict(type='DefaultFormatBundle'),
         dict(type='Collect', keys=['img', 'gt_bboxes', 'gt_labels']),
     ]
+    if batch_augmentation:
+        # run the Albu transforms on the collated batch instead of per sample in the workers
+        train_pipeline = [step for step in train_pipeline if step['type'] != 'Albu']
+        cfg.custom_hooks = cfg.get('custom_hooks', []) + [dict(type='BatchAugmentationHook')]
+
     cfg.train_pipeline = train_pipeline
     cfg.test_pipeline[1]['img_scale'] = (img_size, img_size)
     # cfg.train_pipeline[2]['img_scale'] = (img_size, img_size)
@@ -138,4 +151,12 @@ def get_retinanet_swin_data_augmentation_config(
              log_checkpoint_metadata=True,
              num_eval_images=50)]
 
+    if anchors is not None:
+        # scales and ratios fitted to the cell boxes by optimize_anchors.py
+        apply_anchor_overrides(cfg.model.bbox_head.anchor_generator, anchors)
+
+    if memory_saving:
+        # recompute the backbone activations in backward, None checkpoints every stage
+        use_memory_saving(cfg, stages=checkpoint_stages)
+
     return cfg
@@ -4,6 +4,8 @@ from mmdet.apis import set_random_seed
 from pathlib import Path
 from mmcv import Config
 
+from model.weight_store import resolve_weights
+
 
 def get_ssd_config(
         data_config: Dict,
@@ -45,7 +47,7 @@ def get_ssd_config(
     # If we need to finetune a model based on a pre-trained detector, we need to
     # use load_from to set the path of checkpoints.
     if pretrained:
-        cfg.load_from = 'https://download.openmmlab.com/mmdetection/v2.0/ssd/ssd300_coco/ssd300_coco_20210803_015428-d231a06e.pth'
+        cfg.load_from = resolve_weights('ssd300_coco')
     else:
         cfg.load_from = ''
 
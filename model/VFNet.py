@@ -4,6 +4,8 @@ from mmdet.apis import set_random_seed
 from pathlib import Path
 from mmcv import Config
 
+from model.weight_store import resolve_weights
+
 
 def get_vfnet_config(
         data_config: Dict,
@@ -45,7 +47,7 @@ def get_vfnet_config(
     # If we need to finetune a model based on a pre-trained detector, we need to
     # use load_from to set the path of checkpoints.
     if pretrained:
-        cfg.load_from = data_config['checkpoint']
+        cfg.load_from = resolve_weights('vfnet_r101_fpn_1x_coco')
     else:
         cfg.load_from = ''
 
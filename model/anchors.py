@@ -0,0 +1,16 @@
+import warnings
+from typing import Dict, List
+
+
+def apply_anchor_overrides(anchor_generator, anchors: List[Dict]) -> bool:
+    # the fitted scales are relative to the strides, only a generator with the same strides can use them
+    for fitted in anchors:
+        if fitted['strides'] == list(anchor_generator.strides):
+            anchor_generator.pop('octave_base_scale', None)
+            anchor_generator.pop('scales_per_octave', None)
+            anchor_generator.scales = fitted['scales']
+            anchor_generator.ratios = fitted['ratios']
+            return True
+
+    warnings.warn(f'No fitted anchors for strides {anchor_generator.strides}, keeping the base config anchors')
+    return False
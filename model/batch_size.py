@@ -0,0 +1,54 @@
+import platform
+from pathlib import Path
+from typing import Dict, Optional
+
+import torch
+
+from dataset.utils import read_data, write_data
+from model.memory_saving import memory_saving_tag
+
+batch_settings_path = Path(__file__).resolve().parent.parent / 'batch_settings.json'
+
+
+def host_name(device: str) -> str:
+    # settings are only valid for the memory they were probed on
+    if device.startswith('cuda'):
+        properties = torch.cuda.get_device_properties(torch.device(device))
+        return f'{properties.name} {properties.total_memory // 2 ** 30}GB'
+    return f'cpu {platform.node()}'
+
+
+def settings_key(method: str, img_size: int, memory_saving: str = '') -> str:
+    return f'{method}_{img_size}{memory_saving}'
+
+
+def load_batch_settings(settings_path: Path = batch_settings_path) -> Dict:
+    if not Path(settings_path).exists():
+        return {}
+    return read_data(data_path=settings_path)
+
+
+def save_batch_setting(setting: Dict, host: str, key: str, settings_path: Path = batch_settings_path) -> None:
+    settings = load_batch_settings(settings_path)
+    settings.setdefault(host, {})[key] = setting
+    write_data(data=settings, save_path=settings_path, pretty=True)
+
+
+def apply_batch_settings(
+        cfg,
+        method: str,
+        img_size: int,
+        device: str = 'cuda',
+        settings_path: Path = batch_settings_path,
+) -> Optional[Dict]:
+    host = host_name(device)
+    key = settings_key(method, img_size, memory_saving_tag(cfg))
+    setting = load_batch_settings(settings_path).get(host, {}).get(key)
+    if setting is None:
+        print(f'No probed batch size for {method} {img_size} on {host}, keeping {cfg.data.samples_per_gpu}')
+        return None
+
+    # linear scaling rule, the configured lr belongs to the configured batch size
+    cfg.optimizer.lr = cfg.optimizer.lr * setting['batch_size'] / cfg.data.samples_per_gpu
+    cfg.data.samples_per_gpu = setting['batch_size']
+    return setting
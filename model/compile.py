@@ -0,0 +1,35 @@
+import os
+import warnings
+from typing import Optional
+
+import torch
+
+compile_cache_dir = os.path.expanduser('~/.cache/cancer_detection/torch_compile')
+
+
+def enable_compile_cache(cache_dir: str = compile_cache_dir) -> None:
+    # inductor reads the cache location once, before the first compilation
+    os.makedirs(cache_dir, exist_ok=True)
+    os.environ.setdefault('TORCHINDUCTOR_CACHE_DIR', cache_dir)
+    os.environ.setdefault('TORCHINDUCTOR_FX_GRAPH_CACHE', '1')
+
+
+def compile_detector(model, mode: Optional[str] = None, cache_dir: str = compile_cache_dir):
+    if not hasattr(torch, 'compile'):
+        warnings.warn(f'torch {torch.__version__} has no torch.compile, the detector stays in eager mode')
+        return model
+
+    enable_compile_cache(cache_dir)
+    # only importable on torch versions that have torch.compile
+    from torch import _dynamo
+    # a graph that fails to compile runs eagerly instead of stopping the run
+    _dynamo.config.suppress_errors = True
+
+    # only backbone and neck have static shapes, the heads decode a data dependent number of boxes.
+    # forward is replaced instead of the module so checkpoints keep their parameter names
+    for name in ('backbone', 'neck'):
+        module = getattr(model, name, None)
+        if module is not None:
+            module.forward = torch.compile(module.forward, mode=mode)
+
+    return model
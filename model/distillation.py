@@ -0,0 +1,260 @@
+import hashlib
+import json
+import math
+import os
+import os.path as osp
+import warnings
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from mmcv import Config
+from mmcv.runner import load_checkpoint
+from mmdet.models import DETECTORS, build_detector
+from mmdet.models.detectors import SingleStageDetector
+
+from dataset.pipeline_cache import is_deterministic, split_pipeline
+from dataset.utils import file_hash
+from inference.batching import get_norm_cfg
+
+# students whose forward is the one of SingleStageDetector
+single_stage_types = ('RetinaNet', 'SingleStageDetector', 'VFNet')
+
+
+def neck_channels(neck: Dict) -> List[int]:
+    # FPN has one width for all levels, SSDNeck one per level
+    if isinstance(neck['out_channels'], int):
+        return [neck['out_channels']] * neck['num_outs']
+    return list(neck['out_channels'])
+
+
+def crop_level(level: torch.Tensor, batch_shape, pad_shape) -> torch.Tensor:
+    # the part of a batch feature map that covers one image without the batch padding
+    height = math.ceil(pad_shape[0] * level.shape[-2] / batch_shape[0])
+    width = math.ceil(pad_shape[1] * level.shape[-1] / batch_shape[1])
+    return level[..., :height, :width]
+
+
+@DETECTORS.register_module()
+class DistillationSingleStageDetector(SingleStageDetector):
+    # a single stage student trained with the detection losses plus
+    #  - feature imitation: the neck levels, through a 1x1 adapter, regress the ones of the teacher,
+    #    with the cells weighted over the background
+    #  - response distillation: the class logits follow the softened teacher logits, where both heads
+    #    have the same anchors and classes
+    # teacher outputs are cached on disk per image and flip, the teacher only runs for images missing in the cache
+
+    def __init__(
+            self,
+            backbone,
+            neck=None,
+            bbox_head=None,
+            train_cfg=None,
+            test_cfg=None,
+            pretrained=None,
+            init_cfg=None,
+            teacher_model: Optional[Dict] = None,
+            teacher_checkpoint: Optional[str] = None,
+            teacher_norm_cfg: Optional[Dict] = None,
+            cache_dir: Optional[str] = None,
+            feature_weight: float = 1.0,
+            response_weight: float = 1.0,
+            temperature: float = 2.0,
+            background_weight: float = 0.1,
+    ):
+        super().__init__(backbone, neck, bbox_head, train_cfg, test_cfg, pretrained, init_cfg)
+        self.teacher_model = teacher_model
+        self.teacher_checkpoint = teacher_checkpoint
+        self.teacher_norm_cfg = teacher_norm_cfg
+        self.cache_dir = Path(cache_dir) if cache_dir else None
+        self.feature_weight = feature_weight
+        self.response_weight = response_weight
+        self.temperature = temperature
+        self.background_weight = background_weight
+        # levels are paired by index; the adapters are only used in training, a student loaded for inference
+        # skips them as unexpected keys
+        self.distill_adapters = nn.ModuleList([
+            nn.Conv2d(student, teacher, kernel_size=1)
+            for student, teacher in zip(neck_channels(neck), neck_channels(teacher_model['neck']))])
+        # built on the first cache miss, an epoch served from the cache never loads it
+        self.teacher = None
+
+    def __setattr__(self, name, value) -> None:
+        # the teacher is not a submodule, so it stays out of the optimizer and the checkpoints
+        if name == 'teacher':
+            object.__setattr__(self, name, value)
+        else:
+            super().__setattr__(name, value)
+
+    def get_teacher(self, device):
+        if self.teacher is None:
+            teacher = build_detector(self.teacher_model)
+            load_checkpoint(teacher, self.teacher_checkpoint, map_location='cpu')
+            teacher.to(device).eval()
+            for param in teacher.parameters():
+                param.requires_grad = False
+            self.teacher = teacher
+        return self.teacher
+
+    def teacher_input(self, img: torch.Tensor, img_metas: List[Dict]) -> torch.Tensor:
+        # the student batch, normalized the way the teacher was trained
+        student_norm = img_metas[0]['img_norm_cfg']
+        mean = img.new_tensor(student_norm['mean']).view(1, -1, 1, 1)
+        std = img.new_tensor(student_norm['std']).view(1, -1, 1, 1)
+        img = img * std + mean
+        if bool(student_norm.get('to_rgb', True)) != bool(self.teacher_norm_cfg.get('to_rgb', True)):
+            img = img.flip(1)
+        teacher_mean = img.new_tensor(self.teacher_norm_cfg['mean']).view(1, -1, 1, 1)
+        teacher_std = img.new_tensor(self.teacher_norm_cfg['std']).view(1, -1, 1, 1)
+        img = (img - teacher_mean) / teacher_std
+        for index, img_meta in enumerate(img_metas):
+            height, width = img_meta['img_shape'][:2]
+            img[index, :, height:, :] = 0
+            img[index, :, :, width:] = 0
+        return img
+
+    def cache_path(self, img_meta: Dict) -> Path:
+        flip = img_meta.get('flip_direction') if img_meta.get('flip') else 'none'
+        height, width = img_meta['img_shape'][:2]
+        name = img_meta.get('ori_filename') or osp.basename(img_meta['filename'])
+        return self.cache_dir / f'{name}.{flip}.{height}x{width}.pt'
+
+    def teacher_outputs(self, img: torch.Tensor, img_metas: List[Dict]) -> List[Dict]:
+        # per image, the teacher neck levels and class logits without the batch padding
+        paths = [self.cache_path(img_meta) for img_meta in img_metas] if self.cache_dir else [None] * len(img_metas)
+        if all(path is not None and path.exists() for path in paths):
+            return [torch.load(path, map_location=img.device) for path in paths]
+
+        teacher = self.get_teacher(img.device)
+        with torch.no_grad():
+            features = teacher.extract_feat(self.teacher_input(img, img_metas))
+            cls_scores = teacher.bbox_head(features)[0]
+
+        batch_shape = img.shape[2:]
+        outputs = []
+        for index, (img_meta, path) in enumerate(zip(img_metas, paths)):
+            output = {
+                'features': [crop_level(level[index], batch_shape, img_meta['pad_shape']).half()
+                             for level in features],
+                'cls_scores': [crop_level(level[index], batch_shape, img_meta['pad_shape']).half()
+                               for level in cls_scores],
+            }
+            if path is not None and not path.exists():
+                path.parent.mkdir(parents=True, exist_ok=True)
+                tmp_path = path.with_name(f'{path.name}.{os.getpid()}.tmp')
+                torch.save({key: [level.cpu() for level in levels] for key, levels in output.items()}, tmp_path)
+                os.replace(tmp_path, path)
+            outputs.append(output)
+        return outputs
+
+    def to_student_grid(self, outputs: List[Dict], key: str, level: int, student: torch.Tensor,
+                        img_metas: List[Dict]) -> torch.Tensor:
+        # teacher maps of one level pasted into the batch layout of the student map, resized when the strides differ
+        target = student.new_zeros(student.shape[0], outputs[0][key][level].shape[0], *student.shape[2:])
+        for index, (output, img_meta) in enumerate(zip(outputs, img_metas)):
+            region = crop_level(target[index], img_meta['batch_input_shape'], img_meta['pad_shape'])
+            teacher = output[key][level].float()
+            if teacher.shape[1:] != region.shape[1:]:
+                teacher = F.interpolate(teacher[None], size=region.shape[1:], mode='bilinear', align_corners=False)[0]
+            region.copy_(teacher)
+        return target
+
+    def image_mask(self, student: torch.Tensor, img_metas: List[Dict]) -> torch.Tensor:
+        # 1 on the images, 0 on the batch padding
+        mask = student.new_zeros(student.shape[0], 1, *student.shape[2:])
+        for index, img_meta in enumerate(img_metas):
+            crop_level(mask[index], img_meta['batch_input_shape'], img_meta['pad_shape']).fill_(1)
+        return mask
+
+    def foreground_mask(self, student: torch.Tensor, img_metas: List[Dict],
+                        gt_bboxes: List[torch.Tensor]) -> torch.Tensor:
+        # 1 inside the ground truth boxes, background_weight elsewhere on the images
+        mask = self.image_mask(student, img_metas) * self.background_weight
+        for index, (img_meta, boxes) in enumerate(zip(img_metas, gt_bboxes)):
+            scale_y = student.shape[2] / img_meta['batch_input_shape'][0]
+            scale_x = student.shape[3] / img_meta['batch_input_shape'][1]
+            for x_min, y_min, x_max, y_max in boxes.tolist():
+                mask[index, :, int(y_min * scale_y):math.ceil(y_max * scale_y),
+                     int(x_min * scale_x):math.ceil(x_max * scale_x)] = 1
+        return mask
+
+    def distillation_losses(self, x, cls_scores, outputs: List[Dict], img_metas: List[Dict],
+                            gt_bboxes: List[torch.Tensor]) -> Dict[str, torch.Tensor]:
+        feature_losses, response_losses = [], []
+        for level, adapter in enumerate(self.distill_adapters):
+            student = adapter(x[level])
+            teacher = self.to_student_grid(outputs, 'features', level, student, img_metas)
+            mask = self.foreground_mask(student, img_metas, gt_bboxes)
+            error = (student - teacher).pow(2).mean(dim=1, keepdim=True)
+            feature_losses.append((error * mask).sum() / mask.sum().clamp(min=1))
+
+        temperature = self.temperature
+        for level, student in enumerate(cls_scores):
+            if level >= len(outputs[0]['cls_scores']) or outputs[0]['cls_scores'][level].shape[0] != student.shape[1]:
+                continue
+            teacher = self.to_student_grid(outputs, 'cls_scores', level, student, img_metas)
+            mask = self.image_mask(student, img_metas)
+            loss = F.binary_cross_entropy_with_logits(student / temperature, torch.sigmoid(teacher / temperature),
+                                                      reduction='none')
+            response_losses.append((loss * mask).sum() / (mask.sum() * student.shape[1]).clamp(min=1)
+                                   * temperature ** 2)
+
+        losses = {'loss_distill_feature': self.feature_weight * sum(feature_losses) / len(feature_losses)}
+        if response_losses:
+            losses['loss_distill_response'] = self.response_weight * sum(response_losses) / len(response_losses)
+        return losses
+
+    def forward_train(self, img, img_metas, gt_bboxes, gt_labels, gt_bboxes_ignore=None):
+        # sets batch_input_shape in the metas
+        super(SingleStageDetector, self).forward_train(img, img_metas)
+        x = self.extract_feat(img)
+        outs = self.bbox_head(x)
+        losses = self.bbox_head.loss(*outs, gt_bboxes, gt_labels, img_metas, gt_bboxes_ignore=gt_bboxes_ignore)
+        teacher_outputs = self.teacher_outputs(img, img_metas)
+        losses.update(self.distillation_losses(x, outs[0], teacher_outputs, img_metas, gt_bboxes))
+        return losses
+
+
+def cacheable_views(cfg) -> bool:
+    # the cache keys on the image, flip and shape; any other random step, or the batch augmentation on the gpu,
+    # gives the student a view the cached teacher outputs do not match; a CachedCompose step is deterministic
+    pipeline = [step for step in cfg.data.train.get('pipeline', []) if step['type'] != 'CachedCompose']
+    _, rest = split_pipeline(pipeline)
+    if any(not is_deterministic(step) and step['type'] != 'RandomFlip' for step in rest):
+        return False
+    return not any(hook['type'] == 'BatchAugmentationHook' for hook in cfg.get('custom_hooks', []))
+
+
+def use_distillation(
+        cfg,
+        teacher_config: str,
+        teacher_checkpoint: str,
+        cache_dir: str,
+        feature_weight: float = 1.0,
+        response_weight: float = 1.0,
+        temperature: float = 2.0,
+) -> None:
+    if cfg.model.type not in single_stage_types:
+        raise ValueError(f'distillation needs a single stage student, not {cfg.model.type}')
+    if not teacher_config:
+        raise ValueError('distillation needs the config the teacher was trained with')
+    teacher_cfg = Config.fromfile(teacher_config)
+    teacher_cfg.model.pretrained = None
+
+    # a new teacher, checkpoint or train pipeline gets its own cache
+    key = json.dumps([teacher_cfg.model, file_hash(teacher_checkpoint), cfg.data.train.get('pipeline')],
+                     sort_keys=True, default=str)
+    key = hashlib.sha256(key.encode('utf-8')).hexdigest()[:8]
+
+    cfg.model.type = 'DistillationSingleStageDetector'
+    cfg.model.teacher_model = teacher_cfg.model
+    cfg.model.teacher_checkpoint = teacher_checkpoint
+    cfg.model.teacher_norm_cfg = get_norm_cfg(teacher_cfg)
+    cfg.model.cache_dir = osp.join(cache_dir, key) if cacheable_views(cfg) else None
+    if cfg.model.cache_dir is None:
+        warnings.warn('the train pipeline has random transforms, the teacher runs on every batch without a cache')
+    cfg.model.feature_weight = feature_weight
+    cfg.model.response_weight = response_weight
+    cfg.model.temperature = temperature
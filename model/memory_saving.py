@@ -0,0 +1,68 @@
+from typing import List, Optional, Sequence
+
+from mmcv.runner import HOOKS, Hook
+
+
+def backbone_stages(backbone) -> List:
+    if hasattr(backbone, 'stages'):
+        # swin
+        return list(backbone.stages)
+    if hasattr(backbone, 'res_layers'):
+        # resnet
+        return [getattr(backbone, name) for name in backbone.res_layers]
+    # efficientnet, the first layer is the stem
+    return list(backbone.layers)
+
+
+def checkpoint_stages(backbone, stages: Optional[Sequence[int]] = None) -> int:
+    # the blocks of these backbones recompute their activations in backward when with_cp is set
+    all_stages = backbone_stages(backbone)
+    num_blocks = 0
+    for index in range(len(all_stages)) if stages is None else stages:
+        for module in all_stages[index].modules():
+            if hasattr(module, 'with_cp'):
+                module.with_cp = True
+                num_blocks += 1
+
+    return num_blocks
+
+
+@HOOKS.register_module()
+class ActivationCheckpointHook(Hook):
+
+    def __init__(self, stages: Optional[Sequence[int]] = None):
+        self.stages = stages
+
+    def before_run(self, runner) -> None:
+        model = runner.model.module if hasattr(runner.model, 'module') else runner.model
+        num_blocks = checkpoint_stages(model.backbone, self.stages)
+        runner.logger.info(f'Activation checkpointing enabled in {num_blocks} backbone blocks '
+                           f'of stages {"all" if self.stages is None else list(self.stages)}')
+
+
+def use_memory_saving(cfg, stages: Optional[Sequence[int]] = None) -> None:
+    cfg.custom_hooks = cfg.get('custom_hooks', []) + [dict(type='ActivationCheckpointHook', stages=stages)]
+
+
+def get_memory_saving(cfg) -> Optional[dict]:
+    for hook in cfg.get('custom_hooks', []):
+        if hook['type'] == 'ActivationCheckpointHook':
+            return hook
+    return None
+
+
+def apply_memory_saving(model, cfg) -> int:
+    # for models used outside of a runner, e.g. when probing memory
+    hook = get_memory_saving(cfg)
+    if hook is None:
+        return 0
+    return checkpoint_stages(model.backbone, hook.get('stages'))
+
+
+def memory_saving_tag(cfg) -> str:
+    hook = get_memory_saving(cfg)
+    if hook is None:
+        return ''
+    if hook.get('stages') is None:
+        return '_cp'
+    return '_cp' + '-'.join(str(stage) for stage in hook['stages'])
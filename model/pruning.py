@@ -0,0 +1,196 @@
+import math
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import torch
+import torch.nn as nn
+from mmdet.models import BACKBONES
+from mmdet.models.backbones import ResNet
+
+
+def bottleneck_blocks(backbone) -> List:
+    return [block for name in backbone.res_layers for block in getattr(backbone, name)]
+
+
+def block_widths(backbone) -> List[List[int]]:
+    return [[block.conv1.out_channels, block.conv2.out_channels] for block in bottleneck_blocks(backbone)]
+
+
+def shrink_conv(conv: nn.Conv2d, in_keep: Optional[torch.Tensor] = None,
+                out_keep: Optional[torch.Tensor] = None) -> nn.Conv2d:
+    weight = conv.weight.data
+    bias = conv.bias.data if conv.bias is not None else None
+    if out_keep is not None:
+        weight = weight[out_keep]
+        bias = bias[out_keep] if bias is not None else None
+    if in_keep is not None:
+        weight = weight[:, in_keep]
+    new_conv = nn.Conv2d(weight.shape[1], weight.shape[0], conv.kernel_size, stride=conv.stride, padding=conv.padding,
+                         dilation=conv.dilation, bias=bias is not None).to(weight.device)
+    new_conv.weight.data.copy_(weight)
+    new_conv.weight.requires_grad = conv.weight.requires_grad
+    if bias is not None:
+        new_conv.bias.data.copy_(bias)
+        new_conv.bias.requires_grad = conv.bias.requires_grad
+    return new_conv
+
+
+def shrink_norm(norm: nn.BatchNorm2d, keep: torch.Tensor) -> nn.BatchNorm2d:
+    new_norm = nn.BatchNorm2d(len(keep), eps=norm.eps, momentum=norm.momentum).to(norm.weight.device)
+    new_norm.weight.data.copy_(norm.weight.data[keep])
+    new_norm.bias.data.copy_(norm.bias.data[keep])
+    new_norm.running_mean.copy_(norm.running_mean[keep])
+    new_norm.running_var.copy_(norm.running_var[keep])
+    new_norm.num_batches_tracked.copy_(norm.num_batches_tracked)
+    new_norm.weight.requires_grad = norm.weight.requires_grad
+    new_norm.bias.requires_grad = norm.bias.requires_grad
+    new_norm.train(norm.training)
+    return new_norm
+
+
+def shrink_bottleneck(block, keep1: torch.Tensor, keep2: torch.Tensor) -> None:
+    # only the inner channels go, the block input and output stay on the residual path
+    block.conv1 = shrink_conv(block.conv1, out_keep=keep1)
+    setattr(block, block.norm1_name, shrink_norm(block.norm1, keep1))
+    block.conv2 = shrink_conv(block.conv2, in_keep=keep1, out_keep=keep2)
+    setattr(block, block.norm2_name, shrink_norm(block.norm2, keep2))
+    block.conv3 = shrink_conv(block.conv3, in_keep=keep2)
+
+
+@BACKBONES.register_module()
+class PrunedResNet(ResNet):
+    # ResNet with narrower bottlenecks, block_channels holds the conv1 and conv2 widths of every block
+
+    def __init__(self, block_channels: Optional[Sequence[Sequence[int]]] = None, **kwargs):
+        super().__init__(**kwargs)
+        if block_channels is not None:
+            for block, (width1, width2) in zip(bottleneck_blocks(self), block_channels):
+                shrink_bottleneck(block, torch.arange(width1), torch.arange(width2))
+            # the new modules of the frozen stages have to be frozen again
+            self._freeze_stages()
+
+
+def channel_importance(model, data_loader, num_batches: int) -> List[Tuple[np.ndarray, np.ndarray]]:
+    # first order Taylor estimate of the loss change when a channel is removed, through the affine parameters of
+    # its batch norm; model is the data parallel wrapper, the batches carry the ground truth
+    blocks = bottleneck_blocks(model.module.backbone)
+    norms = [norm for block in blocks for norm in (block.norm1, block.norm2)]
+    frozen = [param for norm in norms for param in norm.parameters() if not param.requires_grad]
+    for param in frozen:
+        param.requires_grad = True
+
+    scores = [torch.zeros(norm.num_features, dtype=torch.float64) for norm in norms]
+    model.train()
+    for index, data in enumerate(data_loader):
+        if index >= num_batches:
+            break
+        model.zero_grad()
+        outputs = model.train_step(data, None)
+        outputs['loss'].backward()
+        for score, norm in zip(scores, norms):
+            taylor = norm.weight * norm.weight.grad + norm.bias * norm.bias.grad
+            score += taylor.detach().pow(2).double().cpu()
+
+    model.zero_grad()
+    for param in frozen:
+        param.requires_grad = False
+    return [(scores[2 * i].numpy(), scores[2 * i + 1].numpy()) for i in range(len(blocks))]
+
+
+def count_macs(model, img_size: int) -> Tuple[int, List[Tuple[int, int]]]:
+    # multiply-accumulates of the convolutions in the dummy forward of one tile, and the output size of conv1 and
+    # conv2 of every bottleneck
+    sizes = {}
+    macs = [0]
+
+    def hook(module, inputs, output):
+        sizes[module] = output.shape[-2] * output.shape[-1]
+        macs[0] += output[0].numel() * module.in_channels // module.groups * math.prod(module.kernel_size)
+
+    handles = [module.register_forward_hook(hook) for module in model.modules() if isinstance(module, nn.Conv2d)]
+    device = next(model.parameters()).device
+    with torch.no_grad():
+        model.forward_dummy(torch.zeros(1, 3, img_size, img_size, device=device))
+    for handle in handles:
+        handle.remove()
+    return macs[0], [(sizes[block.conv1], sizes[block.conv2]) for block in bottleneck_blocks(model.backbone)]
+
+
+def prune_plan(
+        model,
+        importance: List[Tuple[np.ndarray, np.ndarray]],
+        img_size: int,
+        target_ratio: float,
+        min_ratio: float = 0.1,
+        channel_multiple: int = 8,
+) -> List[Tuple[np.ndarray, np.ndarray]]:
+    # channels to keep in every block; the least important channels over the whole backbone go first until the
+    # detector is down to target_ratio of its MACs, then every layer is rounded up to a multiple of channel_multiple
+    total_macs, spatial_sizes = count_macs(model, img_size)
+    blocks = bottleneck_blocks(model.backbone)
+    widths = [[block.conv1.out_channels, block.conv2.out_channels] for block in blocks]
+    original = [list(pair) for pair in widths]
+
+    candidates = []
+    for index, scores in enumerate(importance):
+        for layer, layer_scores in enumerate(scores):
+            # taylor scores of different layers differ in scale, they are compared relative to the layer mean
+            normalized = layer_scores / max(layer_scores.mean(), 1e-12)
+            candidates.extend((value, index, layer, channel) for channel, value in enumerate(normalized))
+    candidates.sort()
+
+    removed = [[[], []] for _ in blocks]
+    macs = total_macs
+    target_macs = target_ratio * total_macs
+    for _, index, layer, channel in candidates:
+        if macs <= target_macs:
+            break
+        minimum = max(channel_multiple, math.ceil(original[index][layer] * min_ratio))
+        if widths[index][layer] <= minimum:
+            continue
+        block = blocks[index]
+        size1, size2 = spatial_sizes[index]
+        kernel = math.prod(block.conv2.kernel_size)
+        if layer == 0:
+            macs -= block.conv1.in_channels * size1 + kernel * widths[index][1] * size2
+        else:
+            macs -= kernel * widths[index][0] * size2 + block.conv3.out_channels * size2
+        widths[index][layer] -= 1
+        removed[index][layer].append(channel)
+
+    keeps = []
+    for index, scores in enumerate(importance):
+        block_keeps = []
+        for layer, layer_scores in enumerate(scores):
+            dropped = removed[index][layer]
+            # the last removed channels are the most important ones, they come back first
+            while dropped and (original[index][layer] - len(dropped)) % channel_multiple:
+                dropped.pop()
+            block_keeps.append(np.setdiff1d(np.arange(len(layer_scores)), dropped))
+        keeps.append(tuple(block_keeps))
+    return keeps
+
+
+def prune_backbone(backbone, keeps: List[Tuple[np.ndarray, np.ndarray]]) -> List[List[int]]:
+    for block, (keep1, keep2) in zip(bottleneck_blocks(backbone), keeps):
+        shrink_bottleneck(block, torch.as_tensor(keep1, dtype=torch.long), torch.as_tensor(keep2, dtype=torch.long))
+    return block_widths(backbone)
+
+
+def use_pruned_backbone(cfg, block_channels: List[List[int]]) -> None:
+    if cfg.model.backbone.type not in ('ResNet', 'PrunedResNet'):
+        raise ValueError(f'only ResNet backbones can be pruned, not {cfg.model.backbone.type}')
+    cfg.model.backbone.type = 'PrunedResNet'
+    cfg.model.backbone.block_channels = block_channels
+    # the weights come from the pruned checkpoint
+    cfg.model.backbone.init_cfg = None
+    cfg.model.pretrained = None
+    # checkpoints of a fine-tune carry the widths too, init_model rebuilds the backbone from them
+    if 'checkpoint_config' in cfg:
+        cfg.checkpoint_config.meta = dict(cfg.checkpoint_config.get('meta') or {}, block_channels=block_channels)
+
+
+def pruning_summary(block_channels: List[List[int]], original: List[List[int]]) -> Dict[str, float]:
+    kept = sum(sum(pair) for pair in block_channels)
+    total = sum(sum(pair) for pair in original)
+    return {'inner_channels': kept, 'inner_channels_kept': round(kept / total, 4)}
@@ -0,0 +1,193 @@
+import os
+import os.path as osp
+import re
+import shutil
+import warnings
+from pathlib import Path
+from typing import Dict, Iterator, Optional
+from urllib.parse import urlparse
+
+import torch
+from mmcv.runner import load_state_dict
+from mmdet.models import build_detector
+
+from dataset.utils import file_hash, read_data, write_data
+from model.pruning import use_pruned_backbone
+
+weight_store_dir = os.environ.get('CANCER_DETECTION_WEIGHTS',
+                                  os.path.expanduser('~/.cache/cancer_detection/weights'))
+
+# load_from names of the model configs and where the weights come from the first time
+pretrained_weights = {
+    'faster_rcnn_r101_fpn_1x_coco': '/content/drive/MyDrive/checkpoints/faster_rcnn_r101_fpn_1x_coco.pth',
+    'retinanet_r101_fpn_1x_coco': '/content/drive/MyDrive/checkpoints/retinanet_r101_fpn_1x_coco.pth',
+    'retinanet_r18_fpn_1x_coco': '/content/drive/MyDrive/checkpoints/retinanet_r18_fpn_1x_coco.pth',
+    'vfnet_r101_fpn_1x_coco': '/content/drive/MyDrive/checkpoints/vfnet_r101_fpn_1x_coco.pth',
+    'retinanet_effb3_fpn_crop896_8x4_1x_coco': 'https://download.openmmlab.com/mmdetection/v2.0/efficientnet/'
+                                               'retinanet_effb3_fpn_crop896_8x4_1x_coco/'
+                                               'retinanet_effb3_fpn_crop896_8x4_1x_coco_20220322_234806-615a0dda.pth',
+    'ssd300_coco': 'https://download.openmmlab.com/mmdetection/v2.0/ssd/ssd300_coco/'
+                   'ssd300_coco_20210803_015428-d231a06e.pth',
+}
+
+# openmmlab file names end with the first digits of their sha256
+hash_suffix = re.compile(r'-([0-9a-f]{8,})\.pth$')
+
+# what a slim checkpoint keeps of the meta data
+slim_meta_keys = ('CLASSES', 'config', 'mmdet_version', 'block_channels')
+
+
+def weight_name(source: str) -> str:
+    if source.startswith('torchvision://'):
+        return 'torchvision_' + source[len('torchvision://'):]
+    return Path(urlparse(source).path).stem
+
+
+def source_url(source: str) -> str:
+    if source.startswith('torchvision://'):
+        from mmcv.runner.checkpoint import get_torchvision_models
+        return get_torchvision_models()[source[len('torchvision://'):]]
+    return source
+
+
+class WeightStore:
+    # pretrained weights copied or downloaded once into a local folder; the manifest records the sha256 of every
+    # file, checked in full when the file changed since it was recorded
+
+    def __init__(self, store_dir: str = weight_store_dir):
+        self.store_dir = Path(store_dir)
+        self.manifest_path = self.store_dir / 'manifest.json'
+        self.manifest = read_data(data_path=self.manifest_path) if self.manifest_path.exists() else {}
+
+    def path(self, name: str) -> Path:
+        return self.store_dir / f'{name}.pth'
+
+    def _record(self, name: str, source: str, sha256: str) -> None:
+        stat = self.path(name).stat()
+        self.manifest[name] = {'source': source, 'sha256': sha256, 'size': stat.st_size, 'mtime': stat.st_mtime_ns}
+        write_data(data=self.manifest, save_path=self.manifest_path, pretty=True)
+
+    def verify(self, name: str, full: bool = False) -> bool:
+        entry = self.manifest.get(name)
+        path = self.path(name)
+        if entry is None or not path.exists():
+            return False
+        stat = path.stat()
+        if not full and stat.st_size == entry['size'] and stat.st_mtime_ns == entry['mtime']:
+            return True
+        if file_hash(path) != entry['sha256']:
+            return False
+        self._record(name, entry['source'], entry['sha256'])
+        return True
+
+    def add(self, name: str, source: str) -> Path:
+        self.store_dir.mkdir(parents=True, exist_ok=True)
+        path = self.path(name)
+        tmp_path = path.with_name(f'{path.name}.{os.getpid()}.tmp')
+        url = source_url(source)
+        expected = hash_suffix.search(url)
+        try:
+            if urlparse(url).scheme in ('http', 'https'):
+                torch.hub.download_url_to_file(url, str(tmp_path), progress=True)
+            else:
+                shutil.copyfile(source, tmp_path)
+            sha256 = file_hash(tmp_path)
+            if expected is not None and not sha256.startswith(expected.group(1)):
+                raise ValueError(f'{source} has sha256 {sha256}, its name says {expected.group(1)}')
+            os.replace(tmp_path, path)
+        finally:
+            if tmp_path.exists():
+                tmp_path.unlink()
+        self._record(name, source, sha256)
+        return path
+
+    def resolve(self, name: str, source: Optional[str] = None) -> str:
+        if self.verify(name):
+            return str(self.path(name))
+        if name in self.manifest and self.path(name).exists():
+            raise ValueError(f'{self.path(name)} does not match its recorded sha256, remove it to fetch it again')
+
+        source = source or pretrained_weights.get(name)
+        if source is None:
+            raise KeyError(f'no source is known for the weights {name}')
+        try:
+            return str(self.add(name, source))
+        except OSError as error:
+            raise FileNotFoundError(f'{name} is not in the weight store {self.store_dir} and {source} cannot be read '
+                                    f'({error}); run weight_store.py --add {name} <file> with a copy of it') from error
+
+
+def resolve_weights(name: str) -> str:
+    return WeightStore().resolve(name)
+
+
+def find_init_cfgs(cfg) -> Iterator[Dict]:
+    if isinstance(cfg, dict):
+        if cfg.get('type') == 'Pretrained' and isinstance(cfg.get('checkpoint'), str):
+            yield cfg
+        for value in cfg.values():
+            yield from find_init_cfgs(value)
+    elif isinstance(cfg, (list, tuple)):
+        for value in cfg:
+            yield from find_init_cfgs(value)
+
+
+def use_weight_store(cfg) -> None:
+    # the backbone init checkpoints of the base configs are urls too, they are read from the store
+    store = WeightStore()
+    for init_cfg in find_init_cfgs(cfg.model):
+        source = init_cfg['checkpoint']
+        if osp.exists(source):
+            continue
+        try:
+            init_cfg['checkpoint'] = store.resolve(weight_name(source), source)
+        except FileNotFoundError as error:
+            warnings.warn(str(error))
+
+
+def export_slim_checkpoint(checkpoint: str, save_path: str, half: bool = True) -> None:
+    # weights only, without optimizer state and training-only modules; fp16 except the batch norm statistics
+    state = torch.load(checkpoint, map_location='cpu')
+    state_dict = state.get('state_dict', state)
+    slim = {}
+    for key, value in state_dict.items():
+        if key.startswith('distill_adapters.'):
+            continue
+        if half and value.is_floating_point() and not key.endswith(('running_mean', 'running_var')):
+            value = value.half()
+        # a view would keep the whole storage it shares in the file
+        slim[key] = value.clone()
+    meta = {key: value for key, value in state.get('meta', {}).items() if key in slim_meta_keys}
+    Path(save_path).parent.mkdir(parents=True, exist_ok=True)
+    torch.save({'meta': meta, 'state_dict': slim}, save_path)
+
+
+def read_checkpoint(checkpoint: str) -> Dict:
+    # memory mapped, the tensors are paged in as they are copied into the model and the optimizer state of a full
+    # checkpoint is never read
+    try:
+        return torch.load(checkpoint, map_location='cpu', mmap=True)
+    except (TypeError, RuntimeError):
+        # torch without mmap, or a checkpoint in the legacy format
+        return torch.load(checkpoint, map_location='cpu')
+
+
+def init_model(cfg, checkpoint: Optional[str], device: str = 'cuda:0'):
+    # init_detector that loads the checkpoint memory mapped; a pruned checkpoint brings the widths of its backbone
+    state = read_checkpoint(checkpoint) if checkpoint else {}
+    meta = state.get('meta', {})
+    if meta.get('block_channels'):
+        use_pruned_backbone(cfg, meta['block_channels'])
+    cfg.model.pretrained = None
+    cfg.model.train_cfg = None
+    if cfg.model.get('backbone', {}).get('init_cfg'):
+        cfg.model.backbone.init_cfg = None
+    model = build_detector(cfg.model, test_cfg=cfg.get('test_cfg'))
+    if checkpoint:
+        # fp16 weights are cast to the model dtype by the copy
+        load_state_dict(model, state.get('state_dict', state))
+    model.CLASSES = meta.get('CLASSES', cfg.get('classes'))
+    model.cfg = cfg
+    model.to(device)
+    model.eval()
+    return model
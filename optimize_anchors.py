@@ -0,0 +1,50 @@
+import argparse
+from pathlib import Path
+
+from dataset.anchors import box_statistics, coco_anchor_generators, fit_anchor_generator, get_anchor_path, load_boxes
+from dataset.data_config import data_configs
+from dataset.utils import write_data
+
+
+def optimize_anchors(opt):
+    data_cfg = data_configs[str(opt.num_classes)][str(opt.img_size)]
+    annotation_path = Path(opt.annotation_path or data_cfg['train_annotation_file'])
+    wh, category_ids, categories = load_boxes(annotation_path)
+    print(f'{annotation_path}: {len(wh)} boxes')
+
+    statistics = box_statistics(wh, category_ids, categories)
+    for name, stats in statistics.items():
+        print(f'{name}: {stats["count"]} boxes, size percentiles {stats["size_percentiles"]}, '
+              f'aspect (h/w) percentiles {stats["aspect_percentiles"]}')
+
+    anchor_generators = []
+    for coco_anchor_generator in coco_anchor_generators:
+        fitted = fit_anchor_generator(wh, coco_anchor_generator, num_ratios=opt.num_ratios,
+                                      iou_threshold=opt.iou_threshold, seed=opt.seed)
+        anchor_generators.append(fitted)
+        print(f'strides {fitted["strides"]}: ratios {fitted["ratios"]}, scales {fitted["scales"]}, '
+              f'{fitted["num_anchors"]} anchors per location with recall@{opt.iou_threshold} {fitted["recall"]:.1%} '
+              f'(COCO anchors: {fitted["coco_num_anchors"]} with recall {fitted["coco_recall"]:.1%})')
+
+    anchor_path = get_anchor_path(annotation_path)
+    write_data(data={'statistics': statistics, 'anchor_generators': anchor_generators}, save_path=anchor_path,
+               pretty=True)
+    print(f'Anchors saved to {anchor_path}, train with --anchors to use them')
+
+
+def parse_opt(known=False):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--img_size', required=True, type=int, default=640, help='train image size (pixels)')
+    parser.add_argument('--num_classes', required=True, type=int, default=2, help='number of classes: 2 or 3')
+    parser.add_argument('--annotation_path', type=str, default=None,
+                        help='sliced train annotations, the data_config train file by default')
+    parser.add_argument('--num_ratios', type=int, default=3, help='number of aspect ratios per location')
+    parser.add_argument('--iou_threshold', type=float, default=0.5, help='IoU at which a box counts as matched')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the k-means initialisation')
+
+    return parser.parse_known_args()[0] if known else parser.parse_args()
+
+
+if __name__ == "__main__":
+    opt = parse_opt()
+    optimize_anchors(opt)
@@ -0,0 +1,27 @@
+import argparse
+
+from dataset.shards import pack_coco_dataset
+
+
+def pack_shards(parse) -> None:
+    pack_coco_dataset(
+        annotation_path=parse.annotation_path,
+        image_dir=parse.img_path,
+        output_dir=parse.output_dir,
+        shard_size=parse.shard_size
+    )
+
+
+def parse_opt(known=False):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--img_path', required=True, type=str, help='The location of the sliced images')
+    parser.add_argument('--annotation_path', required=True, type=str, help='The location of the sliced annotation')
+    parser.add_argument('--output_dir', required=True, type=str, help='The location to write the tar shards to')
+    parser.add_argument('--shard_size', type=int, default=1000, help='number of tiles per shard')
+
+    return parser.parse_known_args()[0] if known else parser.parse_args()
+
+
+if __name__ == "__main__":
+    opt = parse_opt()
+    pack_shards(opt)
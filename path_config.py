@@ -3,8 +3,8 @@ from pathlib import Path
 
 class PathConfig:
 
-    def __init__(self):
-        self.data_path = Path('/content/drive/MyDrive')
+    def __init__(self, data_path: Path = Path('/content/drive/MyDrive')):
+        self.data_path = Path(data_path)
 
         self.image_folder_path = self.data_path / "dataset" / "images"
         self.annotation_folder_path = self.data_path / "dataset" / "annotations"
@@ -13,8 +13,12 @@ class PathConfig:
         self.all_annotation_path = self.annotation_folder_path / "annotations.json"
 
         self.cleaned_annotation_path = self.annotation_folder_path / "cleaned_annotation_s.json"
+        self.image_hashes_path = self.annotation_folder_path / "image_hashes.json.gz"
+        self.duplicates_path = self.annotation_folder_path / "duplicates.json"
         self.annotation_2_classes_path = self.annotation_folder_path / "annotations_2_classes.json"
         self.annotation_3_classes_path = self.annotation_folder_path / "annotations_3_classes.json"
+        self.split_manifest_2_classes_path = self.annotation_folder_path / "split_manifest_2_classes.json"
+        self.split_manifest_3_classes_path = self.annotation_folder_path / "split_manifest_3_classes.json"
 
         self.train_image_path = self.image_folder_path / "train_images"
         self.train_annotation_2_classes_path = self.annotation_folder_path / "train_annotation_2_classes.json"
@@ -2,11 +2,33 @@ import argparse
 
 import fiftyone as fo
 
+from inference.prediction_store import PredictionStore
 from path_config import PathConfig
 
 pathConfig = PathConfig()
 
 
+def add_predictions(coco_dataset, prediction_path: str) -> None:
+    store = PredictionStore(prediction_path)
+    coco_dataset.compute_metadata()
+
+    for sample in coco_dataset:
+        if sample['coco_id'] not in store:
+            continue
+        bboxes, scores, labels = store.get(sample['coco_id'])
+        width, height = sample.metadata.width, sample.metadata.height
+        # fiftyone expects relative [x, y, w, h] boxes
+        sample['predictions'] = fo.Detections(detections=[
+            fo.Detection(
+                label=store.classes[label],
+                bounding_box=[x_min / width, y_min / height, (x_max - x_min) / width, (y_max - y_min) / height],
+                confidence=score,
+            )
+            for (x_min, y_min, x_max, y_max), score, label in zip(bboxes.tolist(), scores.tolist(), labels.tolist())
+        ])
+        sample.save()
+
+
 def plot_data(parse) -> None:
     img_path = parse.img_path
     annotation_path = parse.annotation_path
@@ -18,6 +40,9 @@ def plot_data(parse) -> None:
         label_field="detections",
     )
 
+    if parse.prediction_path:
+        add_predictions(coco_dataset, prediction_path=parse.prediction_path)
+
     session = fo.launch_app(coco_dataset)
 
 
@@ -26,6 +51,8 @@ def parse_opt(known=False):
     parser.add_argument('--img_path', required=True, type=str, help='The location of the images for certain dataset')
     parser.add_argument('--annotation_path', required=True, type=str,
                         help='The location of the annotation for certain dataset')
+    parser.add_argument('--prediction_path', type=str, default='',
+                        help='The location of stored predictions to overlay, written by evaluate_model.py')
 
     return parser.parse_known_args()[0] if known else parser.parse_args()
 
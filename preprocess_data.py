@@ -1,28 +1,42 @@
 import argparse
 
-from dataset.utils import prevent_data_leakage, group_categories
+from dataset.duplicates import find_duplicates
+from dataset.utils import prevent_data_leakage, remap_categories, write_data
 from path_config import PathConfig
 
 pathConfig = PathConfig()
 
 
 def preprocessing_data(parse) -> None:
-    prevent_data_leakage(annotation_path=pathConfig.all_annotation_path, save_path=pathConfig.cleaned_annotation_path)
-
-    if parse.num_classes == 2:
-        group_categories(annotation_path=pathConfig.cleaned_annotation_path,
-                         save_path=pathConfig.annotation_2_classes_path,
-                         num_classes=2)
-
-    if parse.num_classes == 3:
-        group_categories(annotation_path=pathConfig.cleaned_annotation_path,
-                         save_path=pathConfig.annotation_3_classes_path,
-                         num_classes=3)
+    duplicate_groups, overlap_groups = find_duplicates(annotation_path=pathConfig.all_annotation_path,
+                                       image_dir=pathConfig.all_images_path,
+                                       cache_path=pathConfig.image_hashes_path,
+                                       threshold=parse.max_distance,
+                                       hash_type=parse.hash_type,
+                                       num_workers=parse.hash_workers)
+    print(f'{len(duplicate_groups)} groups of duplicate images, {len(overlap_groups)} groups of duplicate or '
+          f'overlapping images')
+    # only the duplicates are removed, the overlapping images stay and are kept in one fold by the split
+    write_data(data={'max_distance': parse.max_distance, 'hash_type': parse.hash_type, 'groups': overlap_groups,
+                     'duplicates': duplicate_groups},
+               save_path=pathConfig.duplicates_path)
+
+    prevent_data_leakage(annotation_path=pathConfig.all_annotation_path, save_path=pathConfig.cleaned_annotation_path,
+                         duplicate_groups=duplicate_groups)
+
+    annotation_paths = {2: pathConfig.annotation_2_classes_path, 3: pathConfig.annotation_3_classes_path}
+    remap_categories(annotation_path=pathConfig.cleaned_annotation_path,
+                     save_paths={num_classes: annotation_paths[num_classes] for num_classes in parse.num_classes})
 
 
 def parse_opt(known=False):
     parser = argparse.ArgumentParser()
-    parser.add_argument('--num_classes', required=True, type=int, default=2, help='number of classes: 2 or 3')
+    parser.add_argument('--num_classes', required=True, type=int, nargs='+', default=[2], choices=[2, 3],
+                        help='number of classes: 2 and/or 3, all groupings are written in one pass')
+    parser.add_argument('--max_distance', type=int, default=8,
+                        help='largest hamming distance between the 64 bit hashes of duplicate images')
+    parser.add_argument('--hash_type', type=str, default='phash', choices=['phash', 'dhash'], help='perceptual hash')
+    parser.add_argument('--hash_workers', type=int, default=None, help='processes hashing images, all cores by default')
 
     return parser.parse_known_args()[0] if known else parser.parse_args()
 
@@ -0,0 +1,203 @@
+import argparse
+import multiprocessing as mp
+import os
+import resource
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+from typing import Callable, Dict, Optional
+
+import numpy as np
+import torch
+from mmcv.runner import build_optimizer
+from mmdet.models import build_detector
+
+from inference.utils import get_inference_config
+from model.batch_size import batch_settings_path, host_name, save_batch_setting, settings_key
+from model.memory_saving import apply_memory_saving, memory_saving_tag
+
+out_of_memory_messages = ('out of memory', "can't allocate memory")
+
+
+def make_batch(batch_size: int, img_size: int, num_boxes: int, num_classes: int, device: str):
+    img = torch.randn(batch_size, 3, img_size, img_size, device=device)
+    shape = (img_size, img_size, 3)
+    img_metas = [dict(img_shape=shape, ori_shape=shape, pad_shape=shape, batch_input_shape=(img_size, img_size),
+                      scale_factor=np.ones(4, dtype=np.float32), flip=False) for _ in range(batch_size)]
+    # dense tiles have many small cells, the box count drives the head memory
+    top_left = torch.rand(batch_size, num_boxes, 2, device=device) * img_size * 0.8
+    size = 8 + torch.rand(batch_size, num_boxes, 2, device=device) * img_size * 0.15
+    gt_bboxes = list(torch.cat([top_left, top_left + size], dim=2))
+    gt_labels = list(torch.randint(0, num_classes, (batch_size, num_boxes), device=device))
+
+    return img, img_metas, gt_bboxes, gt_labels
+
+
+def peak_memory(device: str) -> int:
+    if device.startswith('cuda'):
+        return torch.cuda.max_memory_allocated(device)
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def peak_memory_fraction(device: str) -> float:
+    if device.startswith('cuda'):
+        return peak_memory(device) / torch.cuda.get_device_properties(device).total_memory
+    return peak_memory(device) / (os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES'))
+
+
+def train_throughput(model, optimizer, batch, iterations: int, warmup: int, device: str) -> float:
+    img, img_metas, gt_bboxes, gt_labels = batch
+    for step in range(warmup + iterations):
+        if step == warmup:
+            if device.startswith('cuda'):
+                torch.cuda.synchronize(device)
+            start = time.perf_counter()
+        losses = model(img, img_metas, gt_bboxes=gt_bboxes, gt_labels=gt_labels, return_loss=True)
+        loss, _ = model._parse_losses(losses)
+        loss.backward()
+        optimizer.step()
+        optimizer.zero_grad()
+    if device.startswith('cuda'):
+        torch.cuda.synchronize(device)
+
+    return iterations * len(img) / (time.perf_counter() - start)
+
+
+def probe(model, optimizer, batch_size: int, img_size: int, opt, device: str) -> Optional[float]:
+    if device.startswith('cuda'):
+        torch.cuda.reset_peak_memory_stats(device)
+    out_of_memory = False
+    try:
+        batch = make_batch(batch_size, img_size, opt.num_boxes, opt.num_classes, device)
+        throughput = train_throughput(model, optimizer, batch, opt.iterations, opt.warmup, device)
+    except RuntimeError as e:
+        if not any(message in str(e) for message in out_of_memory_messages):
+            raise
+        out_of_memory = True
+    # memory is released outside the except block, the traceback holds the activations
+    batch = None
+    optimizer.zero_grad()
+    if device.startswith('cuda'):
+        torch.cuda.empty_cache()
+
+    # the probe batch is synthetic, keep headroom for real tiles with more cells
+    if out_of_memory or peak_memory_fraction(device) > opt.headroom:
+        print(f'batch size {batch_size}: does not fit')
+        return None
+    print(f'batch size {batch_size}: {throughput:.1f} images/s, peak memory {peak_memory_fraction(device):.0%}')
+    return throughput
+
+
+def build_model(opt, img_size: int, device: str):
+    cfg = get_inference_config(opt.method, num_classes=opt.num_classes, img_size=img_size, device=device,
+                               memory_saving=opt.memory_saving, checkpoint_stages=opt.checkpoint_stages)
+    model = build_detector(cfg.model).to(device)
+    apply_memory_saving(model, cfg)
+    model.train()
+    optimizer = build_optimizer(model, cfg.optimizer)
+    return cfg, model, optimizer
+
+
+def probe_new_model(batch_size: int, img_size: int, opt, device: str) -> Optional[float]:
+    _, model, optimizer = build_model(opt, img_size, device)
+    return probe(model, optimizer, batch_size, img_size, opt, device)
+
+
+def probe_subprocess(batch_size: int, img_size: int, opt, device: str) -> Optional[float]:
+    # the peak host memory of a process never goes down, every cpu probe runs in a fresh process
+    with ProcessPoolExecutor(1, mp_context=mp.get_context('spawn')) as executor:
+        try:
+            return executor.submit(probe_new_model, batch_size, img_size, opt, device).result()
+        except BrokenProcessPool:
+            # killed by the kernel when out of memory
+            print(f'batch size {batch_size}: does not fit')
+            return None
+
+
+def find_batch_size(run_probe: Callable[[int], Optional[float]], max_batch_size: int) -> Dict[int, float]:
+    throughputs = {}
+    largest, smallest_failed = 0, max_batch_size + 1
+    # grow exponentially until it breaks, then binary search the boundary
+    batch_size = 1
+    while batch_size <= max_batch_size:
+        throughput = run_probe(batch_size)
+        if throughput is None:
+            smallest_failed = batch_size
+            break
+        throughputs[batch_size] = throughput
+        largest = batch_size
+        batch_size *= 2
+
+    while smallest_failed - largest > 1 and largest > 0:
+        batch_size = (largest + smallest_failed) // 2
+        throughput = run_probe(batch_size)
+        if throughput is None:
+            smallest_failed = batch_size
+        else:
+            throughputs[batch_size] = throughput
+            largest = batch_size
+
+    return throughputs
+
+
+def probe_batch_size(opt):
+    device = opt.device
+    host = host_name(device)
+    for img_size in opt.img_size:
+        if device.startswith('cuda'):
+            cfg, model, optimizer = build_model(opt, img_size, device)
+            run_probe = partial(probe, model, optimizer, img_size=img_size, opt=opt, device=device)
+        else:
+            cfg = get_inference_config(opt.method, num_classes=opt.num_classes, img_size=img_size, device=device,
+                                       memory_saving=opt.memory_saving, checkpoint_stages=opt.checkpoint_stages)
+            model = optimizer = None
+            run_probe = partial(probe_subprocess, img_size=img_size, opt=opt, device=device)
+
+        throughputs = find_batch_size(run_probe, opt.max_batch_size)
+        if not throughputs:
+            print(f'{opt.method} {img_size}: not even a batch of 1 fits on {host}')
+            continue
+
+        best = max(throughputs, key=throughputs.get)
+        print(f'{opt.method} {img_size} on {host}: max batch size {max(throughputs)}, '
+              f'best throughput {throughputs[best]:.1f} images/s at batch size {best}')
+        save_batch_setting(
+            setting={
+                'batch_size': best,
+                'max_batch_size': max(throughputs),
+                'throughput': {str(batch_size): throughput for batch_size, throughput in sorted(throughputs.items())},
+            },
+            host=host,
+            key=settings_key(opt.method, img_size, memory_saving_tag(cfg)),
+            settings_path=opt.settings_path,
+        )
+        del model, optimizer, run_probe
+        if device.startswith('cuda'):
+            torch.cuda.empty_cache()
+
+
+def parse_opt(known=False):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--method', required=True, type=str, default='RetinaNet', help='Method to probe')
+    parser.add_argument('--img_size', required=True, type=int, nargs='+', default=[640], help='image sizes (pixels)')
+    parser.add_argument('--num_classes', type=int, default=2, help='number of classes: 2 or 3')
+    parser.add_argument('--device', type=str, default='cuda:0', help='device to probe')
+    parser.add_argument('--memory_saving', action="store_true",
+                        help='probe with activation checkpointing in the Swin and EfficientNet backbones')
+    parser.add_argument('--checkpoint_stages', type=int, nargs='+', default=None,
+                        help='backbone stages to checkpoint with --memory_saving, all stages by default')
+    parser.add_argument('--max_batch_size', type=int, default=128, help='upper bound of the search')
+    parser.add_argument('--num_boxes', type=int, default=50, help='synthetic ground truth boxes per image')
+    parser.add_argument('--headroom', type=float, default=0.9, help='maximum fraction of memory a probe may peak at')
+    parser.add_argument('--warmup', type=int, default=1, help='untimed train steps per batch size')
+    parser.add_argument('--iterations', type=int, default=3, help='timed train steps per batch size')
+    parser.add_argument('--settings_path', type=str, default=str(batch_settings_path),
+                        help='file the results go to')
+
+    return parser.parse_known_args()[0] if known else parser.parse_args()
+
+
+if __name__ == "__main__":
+    opt = parse_opt()
+    probe_batch_size(opt)
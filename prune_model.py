@@ -0,0 +1,177 @@
+import argparse
+import copy
+import os.path as osp
+import time
+from typing import Dict, List
+
+import mmcv
+import torch
+from mmcv.runner import load_checkpoint, save_checkpoint
+from mmdet.apis import train_detector
+from mmdet.datasets import build_dataloader, build_dataset
+from mmdet.models import build_detector
+from mmdet.utils import build_dp
+
+from dataset.utils import write_data
+from inference.utils import get_inference_config, predict_dataset
+from model.pruning import (block_widths, channel_importance, count_macs, prune_backbone, prune_plan,
+                           pruning_summary, use_pruned_backbone)
+
+# the methods with a ResNet-101 backbone
+prunable_methods = ['Faster_RCNN', 'RetinaNet', 'VFNet']
+
+
+@torch.no_grad()
+def cpu_latency(model, img_size: int, iterations: int, warmup: int = 2) -> float:
+    model = copy.deepcopy(model).cpu().eval()
+    img = torch.randn(1, 3, img_size, img_size)
+    for _ in range(warmup):
+        model.forward_dummy(img)
+    start = time.perf_counter()
+    for _ in range(iterations):
+        model.forward_dummy(img)
+    return (time.perf_counter() - start) / iterations
+
+
+def evaluate(cfg, checkpoint: str, dataset) -> Dict[str, float]:
+    results = predict_dataset(cfg, checkpoint=checkpoint, dataset=dataset)
+    metrics = dataset.evaluate(results, metric='bbox')
+    return {'bbox_mAP': metrics['bbox_mAP'], 'bbox_mAP_50': metrics['bbox_mAP_50']}
+
+
+def finetune(cfg, pruned_checkpoint: str, work_dir: str, epochs: int) -> str:
+    cfg = copy.deepcopy(cfg)
+    cfg.load_from = pruned_checkpoint
+    cfg.work_dir = work_dir
+    cfg.runner.max_epochs = epochs
+    cfg.device = 'cuda' if cfg.device.startswith('cuda') else 'cpu'
+    # every run of a method and size logs to the same wandb run id, the fine-tunes would overwrite it
+    cfg.log_config.hooks = [dict(type='TextLoggerHook')]
+
+    datasets = [build_dataset(cfg.data.train)]
+    model = build_detector(cfg.model)
+    model.CLASSES = datasets[0].CLASSES
+    cfg.dump(osp.join(work_dir, 'config.py'))
+    train_detector(model, datasets, cfg, distributed=False, validate=True)
+
+    return osp.join(work_dir, 'latest.pth')
+
+
+def pruned_model(model, importance, opt, ratio: float):
+    pruned = copy.deepcopy(model)
+    keeps = prune_plan(pruned, importance, img_size=opt.img_size, target_ratio=ratio, min_ratio=opt.min_ratio,
+                       channel_multiple=opt.channel_multiple)
+    return pruned, prune_backbone(pruned.backbone, keeps)
+
+
+def latency_ratio(model, importance, opt, target_seconds: float) -> float:
+    # largest MACs ratio whose pruned model meets the latency budget, by bisection
+    low, high = opt.min_ratio, 1.0
+    for _ in range(opt.search_steps):
+        ratio = (low + high) / 2
+        pruned, _ = pruned_model(model, importance, opt, ratio)
+        latency = cpu_latency(pruned, opt.img_size, opt.latency_iterations)
+        print(f'MACs ratio {ratio:.3f}: {latency * 1000:.1f} ms')
+        if latency <= target_seconds:
+            low = ratio
+        else:
+            high = ratio
+    return low
+
+
+def prune_model(opt) -> None:
+    if opt.threads:
+        torch.set_num_threads(opt.threads)
+    cfg = get_inference_config(method=opt.method, num_classes=opt.num_classes, img_size=opt.img_size,
+                               device=opt.device, anchors=opt.anchors)
+    # the inference calls clear train_cfg on the config they get, scoring and fine-tuning need the assigners
+    train_cfg = copy.deepcopy(cfg)
+    val_dataset = build_dataset(cfg.data.val, dict(test_mode=True))
+
+    # the importance needs the losses, the val tiles go through the train pipeline
+    score_cfg = copy.deepcopy(cfg.data.val)
+    score_cfg.pipeline = cfg.data.train.pipeline
+    score_loader = build_dataloader(build_dataset(score_cfg), samples_per_gpu=cfg.data.samples_per_gpu,
+                                    workers_per_gpu=cfg.data.workers_per_gpu, dist=False, shuffle=True, seed=0)
+
+    model = build_detector(copy.deepcopy(train_cfg).model)
+    checkpoint = load_checkpoint(model, opt.checkpoint, map_location='cpu')
+    model.CLASSES = checkpoint.get('meta', {}).get('CLASSES', cfg.get('classes'))
+    model.to(opt.device)
+    device = 'cuda' if opt.device.startswith('cuda') else 'cpu'
+    importance = channel_importance(build_dp(model, device, device_ids=[0]), score_loader, opt.importance_batches)
+    model.eval()
+
+    original_macs, _ = count_macs(model, opt.img_size)
+    original_widths = block_widths(model.backbone)
+    curve: List[Dict] = [{
+        'name': 'original',
+        'gmacs': round(original_macs / 1e9, 2),
+        'latency_ms': round(cpu_latency(model, opt.img_size, opt.latency_iterations) * 1000, 1),
+        **pruning_summary(original_widths, original_widths),
+        **evaluate(copy.deepcopy(cfg), opt.checkpoint, val_dataset),
+    }]
+    print(curve[-1])
+
+    for target in opt.targets:
+        ratio = target if opt.budget == 'macs' else latency_ratio(model, importance, opt, target / 1000)
+        pruned, block_channels = pruned_model(model, importance, opt, ratio)
+        name = f'{opt.budget}_{target:g}'
+        work_dir = osp.join(opt.work_dir, f'{opt.method}_{opt.num_classes}_{opt.img_size}_{name}')
+        mmcv.mkdir_or_exist(osp.abspath(work_dir))
+
+        pruned_cfg = copy.deepcopy(train_cfg)
+        use_pruned_backbone(pruned_cfg, block_channels)
+        checkpoint = osp.join(work_dir, 'pruned.pth')
+        save_checkpoint(pruned, checkpoint, meta=dict(CLASSES=model.CLASSES, block_channels=block_channels))
+        if opt.finetune_epochs:
+            checkpoint = finetune(pruned_cfg, checkpoint, work_dir, opt.finetune_epochs)
+
+        macs, _ = count_macs(pruned, opt.img_size)
+        curve.append({
+            'name': name,
+            'gmacs': round(macs / 1e9, 2),
+            'latency_ms': round(cpu_latency(pruned, opt.img_size, opt.latency_iterations) * 1000, 1),
+            **pruning_summary(block_channels, original_widths),
+            **evaluate(copy.deepcopy(pruned_cfg), checkpoint, val_dataset),
+            'checkpoint': checkpoint,
+        })
+        print(curve[-1])
+
+    curve_path = osp.join(opt.work_dir, f'{opt.method}_{opt.num_classes}_{opt.img_size}_pruning_curve.json')
+    write_data(data=curve, save_path=curve_path, pretty=True)
+
+    print(f'\n{"model":<20}{"GMACs":>8}{"CPU ms":>10}{"channels":>10}{"mAP":>8}{"mAP50":>8}')
+    for point in curve:
+        print(f'{point["name"]:<20}{point["gmacs"]:>8.1f}{point["latency_ms"]:>10.1f}'
+              f'{point["inner_channels_kept"]:>10.1%}{point["bbox_mAP"]:>8.3f}{point["bbox_mAP_50"]:>8.3f}')
+    print(f'Accuracy versus latency written to {curve_path}')
+
+
+def parse_opt(known=False):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--method', required=True, type=str, choices=prunable_methods,
+                        help='Method of the trained model')
+    parser.add_argument('--img_size', required=True, type=int, default=640, help='tile size (pixels) used in training')
+    parser.add_argument('--num_classes', required=True, type=int, default=2, help='number of classes: 2 or 3')
+    parser.add_argument('--checkpoint', required=True, type=str, help='trained checkpoint file')
+    parser.add_argument('--budget', type=str, default='macs', choices=['macs', 'latency'],
+                        help='targets are fractions of the detector MACs or CPU milliseconds per tile')
+    parser.add_argument('--targets', type=float, nargs='+', default=[0.75, 0.5], help='budgets of the pruned models')
+    parser.add_argument('--importance_batches', type=int, default=50, help='val batches to score the channels')
+    parser.add_argument('--min_ratio', type=float, default=0.1, help='smallest fraction of channels kept per layer')
+    parser.add_argument('--channel_multiple', type=int, default=8, help='kept channels per layer are a multiple of it')
+    parser.add_argument('--finetune_epochs', type=int, default=3, help='epochs of fine-tuning, 0 evaluates as pruned')
+    parser.add_argument('--search_steps', type=int, default=6, help='bisection steps of a latency budget')
+    parser.add_argument('--latency_iterations', type=int, default=10, help='timed CPU forward passes per model')
+    parser.add_argument('--threads', type=int, default=None, help='torch CPU threads, torch default when unset')
+    parser.add_argument('--device', type=str, default='cuda:0', help='device for scoring, fine-tuning and evaluation')
+    parser.add_argument('--anchors', action="store_true", help='the model was trained with the fitted anchors')
+    parser.add_argument('--work_dir', type=str, default='./pruning', help='folder of the pruned models')
+
+    return parser.parse_known_args()[0] if known else parser.parse_args()
+
+
+if __name__ == "__main__":
+    opt = parse_opt()
+    prune_model(opt)
@@ -1,12 +1,99 @@
 import argparse
 import os
+import shutil
+from pathlib import Path
+from typing import Optional
 
 from sahi.slicing import slice_coco
 
+from dataset.shards import ShardWriter
+from dataset.slicing import slice_coco_dataset
+from dataset.splits import fold_image_ids, get_pool_paths, pool_matches, select_images, write_fold_annotations
+from dataset.utils import file_hash, read_data, write_data
 from path_config import PathConfig
 
 pathConfig = PathConfig()
 
+overlap_ratios = {
+    224: 0.2,
+    256: 0.2,
+    512: 0.1,
+    640: 0.15,
+    1024: 0.05,
+}
+
+
+def slice_split(
+        parser,
+        annotation_path: Path,
+        image_dir: Path,
+        output_dir: Path,
+        output_annotation_file_name: str,
+        overlap_ratio: float,
+        shard_dir: Optional[Path] = None,
+) -> None:
+    # sahi decodes whole images and cannot filter tiles, these options need our own slicer
+    if shard_dir or parser.region_read or parser.keep_negative_samples or parser.min_foreground is not None:
+        shard_writer = None
+        if shard_dir:
+            shard_writer = ShardWriter(shard_dir, categories=read_data(annotation_path)['categories'],
+                                       shard_size=parser.shard_size)
+        slice_coco_dataset(
+            annotation_path=annotation_path,
+            image_dir=image_dir,
+            output_dir=output_dir,
+            output_annotation_file_name=output_annotation_file_name,
+            tile_size=parser.image_size,
+            overlap_ratio=overlap_ratio,
+            min_area_ratio=0.9,
+            ignore_negative_samples=not parser.keep_negative_samples,
+            min_foreground=parser.min_foreground,
+            shard_writer=shard_writer,
+        )
+        if shard_writer is not None:
+            shard_writer.close()
+    else:
+        slice_coco(
+            coco_annotation_file_path=annotation_path,
+            image_dir=image_dir,
+            output_coco_annotation_file_name=output_annotation_file_name,
+            ignore_negative_samples=True,
+            output_dir=output_dir,
+            slice_height=parser.image_size,
+            slice_width=parser.image_size,
+            overlap_height_ratio=overlap_ratio,
+            overlap_width_ratio=overlap_ratio,
+            min_area_ratio=0.9,
+        )
+
+
+def slice_folds(parser, output_image_path: Path, output_annotation_path: Path, overlap_ratio: float) -> None:
+    # the train and val images of all folds are sliced once, folds only select tiles
+    manifest = read_data(parser.manifest)
+    pool = get_pool_paths(output_image_path)
+    if not pool_matches(pool, parser.manifest):
+        # tiles of another manifest may belong to test images now
+        shutil.rmtree(pool['image_path'], ignore_errors=True)
+        splits = fold_image_ids(manifest, fold=0)
+        source_annotation_path = output_annotation_path / 'cv_source.json'
+        write_data(data=select_images(read_data(manifest['annotation_path']), splits['train'] + splits['val']),
+                   save_path=source_annotation_path)
+        os.makedirs(pool['image_path'], exist_ok=True)
+        slice_split(
+            parser,
+            annotation_path=source_annotation_path,
+            image_dir=Path(manifest['image_dir']),
+            output_dir=pool['image_path'],
+            output_annotation_file_name=str(output_annotation_path / 'cv_annotations'),
+            overlap_ratio=overlap_ratio,
+        )
+        write_data(data={'manifest': str(parser.manifest), 'manifest_hash': file_hash(parser.manifest)},
+                   save_path=pool['meta_file'], pretty=True)
+
+    for fold in range(manifest['num_folds']) if parser.fold is None else [parser.fold]:
+        annotation_paths = write_fold_annotations(parser.manifest, fold, pool)
+        print(f'fold {fold}: {annotation_paths["train"]}, {annotation_paths["val"]}')
+
 
 def slice_data(parser) -> None:
     num_classes = parser.num_classes
@@ -24,58 +111,52 @@ def slice_data(parser) -> None:
     if image_size == 224:
         output_image_path = data_root / pathConfig.size_224_image_path
         output_annotation_path = data_root / pathConfig.size_224_annotation_path
-        overlap_ratio = 0.2
 
     if image_size == 256:
         output_image_path = data_root / pathConfig.size_256_image_path
         output_annotation_path = data_root / pathConfig.size_256_annotation_path
-        overlap_ratio = 0.2
 
     if image_size == 512:
         output_image_path = data_root / pathConfig.size_512_image_path
         output_annotation_path = data_root / pathConfig.size_512_annotation_path
-        overlap_ratio = 0.1
 
     if image_size == 640:
         output_image_path = data_root / pathConfig.size_640_image_path
         output_annotation_path = data_root / pathConfig.size_640_annotation_path
-        overlap_ratio = 0.15
 
     if image_size == 1024:
         output_image_path = data_root / pathConfig.size_1024_image_path
         output_annotation_path = data_root / pathConfig.size_1024_annotation_path
-        overlap_ratio = 0.05
+
+    overlap_ratio = overlap_ratios[image_size]
 
     os.makedirs(output_annotation_path, exist_ok=True)
+    if parser.manifest:
+        slice_folds(parser, output_image_path, output_annotation_path, overlap_ratio)
+        return
+
     os.makedirs(output_image_path / "train_images", exist_ok=True)
     os.makedirs(output_image_path / "val_images", exist_ok=True)
 
-    # slice train dataset
-    coco_dict, coco_path = slice_coco(
-        coco_annotation_file_path=train_input_annotation_path,
+    # slice train dataset, its tiles can go into tar shards
+    slice_split(
+        parser,
+        annotation_path=train_input_annotation_path,
         image_dir=pathConfig.train_image_path,
-        output_coco_annotation_file_name=str(output_annotation_path / "train_annotations"),
-        ignore_negative_samples=True,
         output_dir=output_image_path / "train_images",
-        slice_height=image_size,
-        slice_width=image_size,
-        overlap_height_ratio=overlap_ratio,
-        overlap_width_ratio=overlap_ratio,
-        min_area_ratio=0.9,
+        output_annotation_file_name=str(output_annotation_path / "train_annotations"),
+        overlap_ratio=overlap_ratio,
+        shard_dir=output_image_path / "train_shards" if parser.shards else None,
     )
 
-    # slice val dataset
-    coco_dict, coco_path = slice_coco(
-        coco_annotation_file_path=val_input_annotation_path,
+    # slice val dataset, it stays as files for the COCO evaluation
+    slice_split(
+        parser,
+        annotation_path=val_input_annotation_path,
         image_dir=pathConfig.val_image_path,
-        output_coco_annotation_file_name=str(output_annotation_path / "val_annotations"),
-        ignore_negative_samples=True,
         output_dir=output_image_path / "val_images",
-        slice_height=image_size,
-        slice_width=image_size,
-        overlap_height_ratio=overlap_ratio,
-        overlap_width_ratio=overlap_ratio,
-        min_area_ratio=0.9,
+        output_annotation_file_name=str(output_annotation_path / "val_annotations"),
+        overlap_ratio=overlap_ratio,
     )
 
 
@@ -83,6 +164,16 @@ def parse_opt(known=False):
     parser = argparse.ArgumentParser()
     parser.add_argument('--image_size', required=True, type=int, default=640, help='train, val image size (pixels)')
     parser.add_argument('--num_classes', required=True, type=int, default=2, help='number of classes: 2 or 3')
+    parser.add_argument('--region_read', action="store_true",
+                        help='decode only the region of each tile, for whole-slide and pyramidal TIFF images')
+    parser.add_argument('--shards', action="store_true", help='pack train tiles into tar shards instead of files')
+    parser.add_argument('--shard_size', type=int, default=1000, help='number of tiles per shard')
+    parser.add_argument('--keep_negative_samples', action="store_true", help='also write tiles without annotations')
+    parser.add_argument('--min_foreground', type=float, default=None,
+                        help='skip tiles without annotations whose foreground fraction is below this value')
+    parser.add_argument('--manifest', type=str, default=None,
+                        help='split manifest of train_test_val_split --num_folds, slices its images in place')
+    parser.add_argument('--fold', type=int, default=None, help='fold of the manifest to write, all folds by default')
 
     return parser.parse_known_args()[0] if known else parser.parse_args()
 
@@ -0,0 +1,71 @@
+import argparse
+from pathlib import Path
+
+from dataset.utils import grouped_categories
+from inference.stream import StreamingInference, watch_folder
+from inference.tta import BatchedTTA, add_tta_arguments, get_tta_settings
+from inference.utils import load_detector
+from slice_data import overlap_ratios
+
+
+def stream_inference(opt) -> None:
+    model = load_detector(
+        method=opt.method,
+        num_classes=opt.num_classes,
+        img_size=opt.img_size,
+        checkpoint=opt.checkpoint,
+        device=opt.device,
+        compile_model=opt.compile,
+        anchors=opt.anchors,
+    )
+
+    tta = get_tta_settings(opt)
+
+    pipeline = StreamingInference(
+        model=model,
+        categories=grouped_categories[opt.num_classes],
+        output_dir=Path(opt.output_dir),
+        tile_size=opt.img_size,
+        overlap_ratio=overlap_ratios[opt.img_size],
+        batch_size=opt.batch_size,
+        nms_iou=opt.nms_iou,
+        score_thr=opt.score_thr,
+        min_foreground=opt.min_foreground,
+        decode_workers=opt.decode_workers,
+        write_workers=opt.write_workers,
+        queue_size=opt.queue_size,
+        predictor=BatchedTTA(model, **tta) if tta is not None else None,
+    )
+
+    pipeline.run(watch_folder(Path(opt.watch_dir), poll_interval=opt.poll_interval, once=opt.once))
+
+
+def parse_opt(known=False):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--method', required=True, type=str, default='RetinaNet_Swin', help='Method of the trained model')
+    parser.add_argument('--img_size', required=True, type=int, default=640, help='tile size (pixels) used in training')
+    parser.add_argument('--num_classes', required=True, type=int, default=2, help='number of classes: 2 or 3')
+    parser.add_argument('--checkpoint', required=True, type=str, help='trained checkpoint file')
+    parser.add_argument('--watch_dir', required=True, type=str, help='folder the microscope writes images into')
+    parser.add_argument('--output_dir', required=True, type=str, help='folder for the COCO detections per image')
+    parser.add_argument('--device', type=str, default='cuda:0', help='device for the model forward')
+    parser.add_argument('--anchors', action="store_true", help='the model was trained with the fitted anchors')
+    parser.add_argument('--compile', action="store_true", help='compile backbone and neck with torch.compile')
+    add_tta_arguments(parser)
+    parser.add_argument('--batch_size', type=int, default=8, help='number of tiles per forward pass')
+    parser.add_argument('--nms_iou', type=float, default=0.5, help='IoU threshold to merge detections across tiles')
+    parser.add_argument('--score_thr', type=float, default=0.05, help='minimum score of written detections')
+    parser.add_argument('--min_foreground', type=float, default=None,
+                        help='skip tiles whose foreground fraction is below this value')
+    parser.add_argument('--decode_workers', type=int, default=2, help='number of image decode threads')
+    parser.add_argument('--write_workers', type=int, default=2, help='number of result writer threads')
+    parser.add_argument('--queue_size', type=int, default=8, help='maximum number of images waiting between stages')
+    parser.add_argument('--poll_interval', type=float, default=2.0, help='seconds between folder scans')
+    parser.add_argument('--once', action="store_true", help='process the images already in the folder and exit')
+
+    return parser.parse_known_args()[0] if known else parser.parse_args()
+
+
+if __name__ == "__main__":
+    opt = parse_opt()
+    stream_inference(opt)
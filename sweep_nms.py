@@ -0,0 +1,91 @@
+import argparse
+from pathlib import Path
+
+from mmdet.datasets import build_dataset
+
+from dataset.utils import file_hash, write_data
+from inference.prediction_store import checkpoint_hash
+from inference.raw_predictions import (collect_raw_predictions, load_raw_prediction_settings, load_raw_predictions,
+                                       save_raw_predictions)
+from inference.rescore import sweep_thresholds
+from inference.utils import get_inference_config
+
+
+def sweep_nms(opt) -> None:
+    cfg = get_inference_config(method=opt.method, num_classes=opt.num_classes, img_size=opt.img_size,
+                               device=opt.device)
+    cache_file = Path(opt.cache_file)
+    settings = {
+        'ann_hash': file_hash(cfg.data[opt.split].ann_file),
+        'img_size': opt.img_size,
+        'max_candidates': opt.max_candidates,
+    }
+
+    # the model only runs when there is no cache of this checkpoint and these settings yet; a cache with a lower
+    # score threshold holds every candidate a higher one keeps
+    cached = load_raw_prediction_settings(cache_file) if cache_file.exists() else None
+    valid = (cached is not None and all(cached.get(key) == value for key, value in settings.items())
+             and cached.get('score_thr', float('inf')) <= min(opt.score_thrs)
+             and (not opt.checkpoint or cached.get('checkpoint_hash') == checkpoint_hash(opt.checkpoint)))
+    if not valid:
+        if not opt.checkpoint:
+            raise ValueError(f'{cache_file} is missing or was made with other settings, pass --checkpoint to build it')
+        if cached is not None:
+            print(f'{cache_file} was made with another checkpoint or settings, predicting again')
+        settings.update(checkpoint_hash=checkpoint_hash(opt.checkpoint), score_thr=min(opt.score_thrs))
+        columns = collect_raw_predictions(cfg, checkpoint=opt.checkpoint, split=opt.split,
+                                          score_thr=settings['score_thr'], max_candidates=opt.max_candidates)
+        save_raw_predictions(columns, save_path=cache_file, settings=settings)
+    columns = load_raw_predictions(cache_file)
+
+    dataset = build_dataset(cfg.data[opt.split], dict(test_mode=True))
+    sweep_results = sweep_thresholds(
+        columns,
+        num_classes=opt.num_classes,
+        iou_thrs=opt.iou_thrs,
+        score_thrs=opt.score_thrs,
+        max_per_imgs=opt.max_per_imgs,
+    )
+
+    metrics = []
+    for (iou_thr, score_thr, max_per_img), results in sweep_results.items():
+        eval_results = dataset.evaluate(results, metric='bbox', logger='silent')
+        metrics.append({
+            'iou_thr': iou_thr,
+            'score_thr': score_thr,
+            'max_per_img': max_per_img,
+            **{key: float(value) for key, value in eval_results.items() if not isinstance(value, str)},
+        })
+
+    metrics = sorted(metrics, key=lambda item: item['bbox_mAP'], reverse=True)
+    for item in metrics:
+        print(f"iou_thr={item['iou_thr']:.2f} score_thr={item['score_thr']:.2f} "
+              f"max_per_img={item['max_per_img']}: mAP={item['bbox_mAP']:.3f} mAP_50={item['bbox_mAP_50']:.3f}")
+
+    if opt.output:
+        write_data(data=metrics, save_path=Path(opt.output))
+
+
+def parse_opt(known=False):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--method', required=True, type=str, default='RetinaNet', help='Method of the trained model')
+    parser.add_argument('--img_size', required=True, type=int, default=640, help='train, val image size (pixels)')
+    parser.add_argument('--num_classes', required=True, type=int, default=2, help='number of classes: 2 or 3')
+    parser.add_argument('--cache_file', required=True, type=str, help='npz file with the raw pre-NMS predictions')
+    parser.add_argument('--checkpoint', type=str,
+                        help='trained checkpoint, checked against the cache and needed to build it')
+    parser.add_argument('--split', type=str, default='val', choices=['val', 'test'], help='dataset split to evaluate')
+    parser.add_argument('--device', type=str, default='cuda:0', help='device used to build the cache')
+    parser.add_argument('--max_candidates', type=int, default=1000, help='raw boxes kept per image in the cache')
+    parser.add_argument('--iou_thrs', type=float, nargs='+', default=[0.3, 0.4, 0.5, 0.6, 0.7],
+                        help='NMS IoU thresholds to evaluate')
+    parser.add_argument('--score_thrs', type=float, nargs='+', default=[0.05], help='score thresholds to evaluate')
+    parser.add_argument('--max_per_imgs', type=int, nargs='+', default=[100], help='max detections per image')
+    parser.add_argument('--output', type=str, default='', help='json file to write the metrics to')
+
+    return parser.parse_known_args()[0] if known else parser.parse_args()
+
+
+if __name__ == "__main__":
+    opt = parse_opt()
+    sweep_nms(opt)
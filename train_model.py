@@ -7,19 +7,38 @@ from mmdet.apis import train_detector
 from mmdet.datasets import build_dataset
 from mmdet.models import build_detector
 
+from dataset.anchors import load_anchors
+from dataset.array_dataset import use_array_datasets
 from dataset.data_config import data_configs
+from dataset.pipeline_cache import use_pipeline_cache
+from dataset.shards import use_sharded_train_data
+from dataset.splits import get_fold_data_config
+from inference.async_eval import use_async_evaluation
+from model.batch_size import apply_batch_settings
+from model.compile import compile_detector
+from model.distillation import use_distillation
 from model.Faster_RCNN import get_faster_rcnn_config
 from model.RetinaNet import get_retinanet_config
+from model.RetinaNet_R18 import get_retinanet_r18_config
 from model.RetinaNet_EfficientNet import get_retinanet_efficientnet_config
 from model.RetinaNet_EfficientNet_Data_Augmentation import get_retinanet_efficientnet_data_augmentation_config
 from model.RetinaNet_Swin import get_retinanet_swin_config
 from model.RetinaNet_Swin_Data_Augmentation import get_retinanet_swin_data_augmentation_config
 from model.SSD import get_ssd_config
 from model.VFNet import get_vfnet_config
+from model.weight_store import use_weight_store
 
 
-def get_train_config(opt):
+def get_data_config(opt):
     data_cfg = data_configs[str(opt.num_classes)][str(opt.img_size)]
+    if opt.manifest:
+        data_cfg = get_fold_data_config(data_cfg, manifest_path=opt.manifest, fold=opt.fold)
+    return data_cfg
+
+
+def get_train_config(opt, data_cfg=None):
+    data_cfg = data_cfg or get_data_config(opt)
+    anchors = load_anchors(data_cfg['train_annotation_file']) if opt.anchors else None
 
     if opt.method == "Faster_RCNN":
         return get_faster_rcnn_config(
@@ -28,7 +47,8 @@ def get_train_config(opt):
             img_size=opt.img_size,
             max_epochs=opt.epochs,
             lr=opt.lr,
-            pretrained=opt.pretrained
+            pretrained=opt.pretrained,
+            anchors=anchors,
         )
     if opt.method == "RetinaNet":
         return get_retinanet_config(
@@ -37,7 +57,18 @@ def get_train_config(opt):
             img_size=opt.img_size,
             max_epochs=opt.epochs,
             lr=opt.lr,
-            pretrained=opt.pretrained
+            pretrained=opt.pretrained,
+            anchors=anchors,
+        )
+    if opt.method == "RetinaNet_R18":
+        return get_retinanet_r18_config(
+            data_config=data_cfg,
+            num_classes=opt.num_classes,
+            img_size=opt.img_size,
+            max_epochs=opt.epochs,
+            lr=opt.lr,
+            pretrained=opt.pretrained,
+            anchors=anchors,
         )
     if opt.method == "VFNet":
         return get_vfnet_config(
@@ -55,7 +86,10 @@ def get_train_config(opt):
             img_size=opt.img_size,
             max_epochs=opt.epochs,
             lr=opt.lr,
-            pretrained=False
+            pretrained=False,
+            memory_saving=opt.memory_saving,
+            checkpoint_stages=opt.checkpoint_stages,
+            anchors=anchors,
         )
     if opt.method == "RetinaNet_EfficientNet":
         return get_retinanet_efficientnet_config(
@@ -64,7 +98,10 @@ def get_train_config(opt):
             img_size=opt.img_size,
             max_epochs=opt.epochs,
             lr=opt.lr,
-            pretrained=False
+            pretrained=False,
+            memory_saving=opt.memory_saving,
+            checkpoint_stages=opt.checkpoint_stages,
+            anchors=anchors,
         )
     if opt.method == "RetinaNet_Swin_Data_Aug":
         return get_retinanet_swin_data_augmentation_config(
@@ -73,7 +110,10 @@ def get_train_config(opt):
             img_size=opt.img_size,
             max_epochs=opt.epochs,
             lr=opt.lr,
-            pretrained=False
+            pretrained=False,
+            memory_saving=opt.memory_saving,
+            checkpoint_stages=opt.checkpoint_stages,
+            anchors=anchors,
         )
     if opt.method == "RetinaNet_EfficientNet_Data_Aug":
         return get_retinanet_efficientnet_data_augmentation_config(
@@ -82,7 +122,10 @@ def get_train_config(opt):
             img_size=opt.img_size,
             max_epochs=opt.epochs,
             lr=opt.lr,
-            pretrained=False
+            pretrained=False,
+            memory_saving=opt.memory_saving,
+            checkpoint_stages=opt.checkpoint_stages,
+            anchors=anchors,
         )
     if opt.method == "SSD":
         return get_ssd_config(
@@ -96,23 +139,50 @@ def get_train_config(opt):
 
 
 def train_model(opt):
-    cfg = get_train_config(opt)
+    data_cfg = get_data_config(opt)
+    cfg = get_train_config(opt, data_cfg)
+    if opt.manifest:
+        cfg.work_dir = osp.join(cfg.work_dir, f'fold{opt.fold}')
+
+    if opt.shards:
+        use_sharded_train_data(cfg, shard_dir=osp.join(data_cfg['data_root'], 'train_shards'))
+    elif opt.array_dataset:
+        use_array_datasets(cfg)
+    if opt.pipeline_cache:
+        use_pipeline_cache(cfg, cache_dir=osp.join(data_cfg['data_root'], 'pipeline_cache'))
+    if opt.teacher_checkpoint:
+        use_distillation(cfg, teacher_config=opt.teacher_config, teacher_checkpoint=opt.teacher_checkpoint,
+                         cache_dir=osp.join(data_cfg['data_root'], 'distill_cache'),
+                         feature_weight=opt.distill_feature_weight, response_weight=opt.distill_response_weight,
+                         temperature=opt.distill_temperature)
+    if opt.auto_batch:
+        apply_batch_settings(cfg, method=opt.method, img_size=opt.img_size, device=cfg.device)
+    config_file = osp.join(cfg.work_dir, opt.method + '.py')
+    if opt.async_eval:
+        use_async_evaluation(cfg, config_file=config_file, device=opt.eval_device)
 
     # Build dataset
     datasets = [build_dataset(cfg.data.train)]
 
+    init_weights = opt.pretrained is False or opt.method == 'RetinaNet_Swin'
+    if init_weights:
+        # the backbone init checkpoints are read from the local weight store
+        use_weight_store(cfg)
+
     # Build the detector
     model = build_detector(cfg.model)
     # Add an attribute for visualization convenience
     model.CLASSES = datasets[0].CLASSES
-    if opt.pretrained is False or opt.method == 'RetinaNet_Swin':
+    if init_weights:
         model.init_weights()
+    if opt.compile:
+        compile_detector(model)
 
     # Create work_dir
     mmcv.mkdir_or_exist(osp.abspath(cfg.work_dir))
-    cfg.dump(osp.join(cfg.work_dir, opt.method + '.py'))
+    cfg.dump(config_file)
 
-    train_detector(model, datasets, cfg, distributed=False, validate=True)
+    train_detector(model, datasets, cfg, distributed=False, validate=not opt.async_eval)
 
 
 def parse_opt(known=False):
@@ -123,6 +193,33 @@ def parse_opt(known=False):
     parser.add_argument('--epochs', type=int, default=12, help='number of epochs training')
     parser.add_argument('--lr', type=float, default=0.0025, help='initial learning rate')
     parser.add_argument('--pretrained', action="store_true", help='Use pretrained model')
+    parser.add_argument('--shards', action="store_true", help='stream train tiles from the tar shards of slice_data')
+    parser.add_argument('--manifest', type=str, default=None,
+                        help='split manifest of train_test_val_split --num_folds, trains on the tiles of slice_data')
+    parser.add_argument('--fold', type=int, default=0, help='fold of the manifest used for validation')
+    parser.add_argument('--array_dataset', action="store_true",
+                        help='load train and val annotations from the cached array index')
+    parser.add_argument('--pipeline_cache', action="store_true",
+                        help='cache the output of the deterministic pipeline steps on disk after the first epoch')
+    parser.add_argument('--anchors', action="store_true", help='use the anchors fitted by optimize_anchors')
+    parser.add_argument('--memory_saving', action="store_true",
+                        help='activation checkpointing in the Swin and EfficientNet backbones')
+    parser.add_argument('--checkpoint_stages', type=int, nargs='+', default=None,
+                        help='backbone stages to checkpoint with --memory_saving, all stages by default')
+    parser.add_argument('--auto_batch', action="store_true",
+                        help='use the batch size found by probe_batch_size for this host')
+    parser.add_argument('--compile', action="store_true", help='compile backbone and neck with torch.compile')
+    parser.add_argument('--async_eval', action="store_true", help='evaluate epoch snapshots in a separate process')
+    parser.add_argument('--eval_device', type=str, default='cpu',
+                        help='device of the async evaluation, e.g. cpu or cuda:1')
+    parser.add_argument('--teacher_config', type=str, default=None,
+                        help='config the teacher was trained with, the one train_model dumps into its work_dir')
+    parser.add_argument('--teacher_checkpoint', type=str, default=None,
+                        help='trained teacher checkpoint, trains the method as a distilled student')
+    parser.add_argument('--distill_feature_weight', type=float, default=1.0, help='weight of the neck imitation loss')
+    parser.add_argument('--distill_response_weight', type=float, default=1.0,
+                        help='weight of the soft class logit loss')
+    parser.add_argument('--distill_temperature', type=float, default=2.0, help='temperature of the teacher logits')
 
     return parser.parse_known_args()[0] if known else parser.parse_args()
 
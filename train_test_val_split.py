@@ -1,14 +1,41 @@
 import argparse
 
-from dataset.utils import split_data
+from dataset.splits import make_manifest
+from dataset.utils import split_data, write_data
 from path_config import PathConfig
 
 pathConfig = PathConfig()
 
 
+def write_split_manifest(parse):
+    annotation_path = {2: pathConfig.annotation_2_classes_path, 3: pathConfig.annotation_3_classes_path}
+    manifest_path = {2: pathConfig.split_manifest_2_classes_path, 3: pathConfig.split_manifest_3_classes_path}
+
+    # images are referenced by id and file name, nothing is copied
+    manifest = make_manifest(
+        annotation_path=annotation_path[parse.num_classes],
+        image_dir=pathConfig.all_images_path,
+        num_folds=parse.num_folds,
+        test_ratio=parse.test_ratio,
+        group_pattern=parse.group_pattern,
+        duplicates_path=pathConfig.duplicates_path,
+        seed=parse.seed,
+    )
+    write_data(data=manifest, save_path=manifest_path[parse.num_classes])
+
+    for fold in [-1] + list(range(parse.num_folds)):
+        images = [image for image in manifest['images'] if image['fold'] == fold]
+        print(f'{"test" if fold == -1 else f"fold {fold}"}: {len(images)} images, '
+              f'{len({image["group"] for image in images})} groups')
+
+
 def split_train_test_val(parse):
     num_classes = parse.num_classes
 
+    if parse.num_folds:
+        write_split_manifest(parse)
+        return
+
     if num_classes == 2:
         split_data(
             annotation_path=pathConfig.annotation_2_classes_path,
@@ -29,6 +56,14 @@ def split_train_test_val(parse):
 def parse_opt(known=False):
     parser = argparse.ArgumentParser()
     parser.add_argument('--num_classes', required=True, type=int, default=2, help='number of classes: 2 or 3')
+    parser.add_argument('--num_folds', type=int, default=None,
+                        help='write a patient grouped k-fold manifest instead of copying the images into splits')
+    parser.add_argument('--test_ratio', type=float, default=0.15, help='fraction of the groups held out for testing')
+    parser.add_argument('--group_pattern', type=str, default=None,
+                        help='regex whose first group is the patient or slide in the image file name, '
+                             'used when the annotations have no patient_id or slide_id; '
+                             'without it every image is its own group')
+    parser.add_argument('--seed', type=int, default=42, help='seed of the group order')
 
     return parser.parse_known_args()[0] if known else parser.parse_args()
 
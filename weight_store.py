@@ -0,0 +1,34 @@
+import argparse
+
+from model.weight_store import WeightStore, pretrained_weights, weight_store_dir
+
+
+def weight_store(opt) -> None:
+    store = WeightStore(opt.store_dir)
+    if opt.add:
+        name, source = opt.add
+        print(f'{name}: {store.add(name, source)}')
+    for name in (list(pretrained_weights) if opt.fetch == [] else opt.fetch or []):
+        print(f'{name}: {store.resolve(name)}')
+
+    print(f'\n{"weights":<48}{"MB":>10}  sha256')
+    for name, entry in sorted(store.manifest.items()):
+        status = '' if store.verify(name, full=opt.verify) else '  FAILED'
+        print(f'{name:<48}{entry["size"] / 2 ** 20:>10.1f}  {entry["sha256"][:16]}{status}')
+
+
+def parse_opt(known=False):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--store_dir', type=str, default=weight_store_dir, help='folder of the weight store')
+    parser.add_argument('--fetch', type=str, nargs='*', default=None,
+                        help='copy or download these pretrained weights into the store, all of them without names')
+    parser.add_argument('--add', type=str, nargs=2, default=None, metavar=('NAME', 'FILE'),
+                        help='add a local file or url to the store under a name, e.g. for offline machines')
+    parser.add_argument('--verify', action="store_true", help='hash every file instead of checking size and mtime')
+
+    return parser.parse_known_args()[0] if known else parser.parse_args()
+
+
+if __name__ == "__main__":
+    opt = parse_opt()
+    weight_store(opt)